@@ -1,13 +1,52 @@
 import os
-import math
+import mmap
 import numpy as np
 import re
 from pathlib import Path
 from numpy.typing import NDArray
 from qe_utils.io_file import IOFiles
-import matplotlib.pyplot as plt
 
 from qe_utils.pwx_in import PWxIn
+from qe_utils.profiling import profiled
+from qe_utils.fixed_width import parse_reals
+
+class EnergyIndex:
+    """sorted index over band energies to find states (k, band) in energy windows.
+    
+    Energies are sorted once, so that states in a window are found by np.searchsorted in O(log n + hits).
+
+    Attributes
+    ----------
+    energies: NDArray
+        (nk, nbnd) band energies from which the index is made.
+    order: NDArray
+        flat indices of states in ascending order of energies.
+    sorted_energies: NDArray
+        energies[order].
+    """
+    def __init__(self, energies:NDArray):
+        self.energies = energies
+        self.order = np.argsort(energies, axis = None, kind = "stable")
+        self.sorted_energies = energies.ravel()[self.order]
+        
+    def window(self, emin:float|None = None, emax:float|None = None)->NDArray:
+        """flat indices of states with emin <= energy <= emax in ascending order of energies.
+        
+        None means no bound.
+        """
+        start = 0 if emin is None else np.searchsorted(self.sorted_energies, emin, side = "left")
+        stop = len(self.order) if emax is None else np.searchsorted(self.sorted_energies, emax, side = "right")
+        return self.order[start:stop]
+    
+    def states(self, emin:float|None = None, emax:float|None = None)->tuple[NDArray, NDArray]:
+        """k and band indices of states with emin <= energy <= emax sorted by (k, band).
+        """
+        return np.unravel_index(np.sort(self.window(emin, emax)), self.energies.shape)
+    
+    def bands(self, emin:float|None = None, emax:float|None = None)->NDArray:
+        """indices of bands which have at least one state with emin <= energy <= emax.
+        """
+        return np.unique(self.window(emin, emax) % self.energies.shape[1])
 
 class BandxOut:
     """parse the output of bands.x
@@ -33,25 +72,36 @@ class Filband:
     def from_iofiles(self,iofiles:IOFiles):
         raise NotImplementedError("from_iofiles is not implemented.")
         
-    def read(self):
+    @profiled("Filband.read")
+    def read(self, chunk_size:int = 1 << 18):
         """read filband.
+        
+        bands.x writes a k point by (10x,3f10.6) and its energies by (10f9.3), so that the lines of
+        each k point have the same length. The body of the file is viewed as a (num_k, length) array of 
+        characters of the memory-mapped file and fields are converted by numpy in chunks of about 
+        chunk_size energies. If the body does not have this layout, values separated by spaces are converted at once.
+
+        Parameters
+        ----------
+        chunk_size : int, optional
+            the number of energies converted at once, by default 2**18
         """
         assert os.path.isfile(self.file), "filband file, {} not found".format(self.file)
-        with open(self.file) as fp:
-            first_line = fp.readline()
-            self.num_band:int = int(first_line.split()[2].strip(",")) # the number of bands.
-            self.num_k:int = int(first_line.split()[4]) # the number of kpoints
-            self.k_list:NDArray = np.zeros([self.num_k,3]) # kpoints list at which band energies are calculated.
-            self.bands_en:NDArray = np.zeros([self.num_k,self.num_band]) # band energies
-            num_line_for_one_k = math.ceil(self.num_band/10)+1
-            lines = fp.readlines()
-            for indk in np.arange(self.num_k):
-                self.k_list[indk] = np.array(lines[indk*num_line_for_one_k].strip("\n").split(),dtype=np.float64)
-                #FIXME: the performance of the code below might not be good.
-                bands_en = []
-                for line in lines[indk*num_line_for_one_k+1:(indk+1)*num_line_for_one_k]:
-                    bands_en += [float(value) for value in line.strip("\n").split()]
-                self.bands_en[indk] = bands_en 
+        with open(self.file, "rb") as fp, mmap.mmap(fp.fileno(), 0, access = mmap.ACCESS_READ) as data:
+            start = data.find(b"\n") + 1
+            self.num_band, self.num_k = _parse_filband_header(data[:start])
+            try:
+                self.k_list, self.bands_en = _parse_filband_fixed_width(data, self.num_k, self.num_band, start, chunk_size)
+                return
+            except ValueError:
+                body = data[start:]
+        # NOTE: values of the (10f9.3) format which are not separated by spaces raise ValueError.
+        values = np.array(body.split(), dtype = np.float64)
+        if len(values) != self.num_k*(3 + self.num_band):
+            raise ValueError(f"the number of values in {self.file} is not num_k*(3 + num_band).")
+        values = values.reshape(self.num_k, 3 + self.num_band)
+        self.k_list:NDArray = values[:, :3].copy() # kpoints list at which band energies are calculated.
+        self.bands_en:NDArray = values[:, 3:].copy() # band energies
                 
     @property 
     def e_max(self):
@@ -86,6 +136,16 @@ class Filband:
     @bands_en.setter
     def bands_en(self, bands_en:NDArray):
         self._bands_en = bands_en
+        if hasattr(self, "_energy_index"):
+            del self._energy_index
+        
+    @property
+    def energy_index(self)->EnergyIndex:
+        """sorted index over bands_en for energy window queries.
+        """
+        if not hasattr(self, "_energy_index"):
+            self._energy_index = EnergyIndex(self.bands_en)
+        return self._energy_index
         
     def get_filbandgnu(self):
         """get Filbandgnu consistent with filband.
@@ -102,6 +162,13 @@ class Filband:
         
 class Filbandgnu:
     """read data from filband.gnu generated by bands.x
+    
+    Attributes
+    ----------
+    k_path: NDArray
+        (num_k,) the length of the k path at k points, which is the same for all bands.
+    energies: NDArray
+        (num_band, num_k) energies of bands.
     """
     def __init__(self, file:str|Path, num_k:int, num_band:int):
         self.file = file
@@ -116,21 +183,38 @@ class Filbandgnu:
         num_band = filband.num_band
         return cls(file, nk, num_band)
         
+    @profiled("Filbandgnu.read")
     def read(self):
-        self.ek = np.zeros([self.num_band, self.num_k,2]) # [i,j,0] is kpath norm [i,j,1] is energy
-        iband = 0
-        ik = 0
-        with open(self.file) as fp:
-            while True:
-                line = fp.readline()
-                if not line:
-                    break
-                if not line.strip():
-                    iband += 1
-                    ik = 0
-                else:
-                    self.ek[iband,ik,:] = [float(num) for num in line.split()] # FIXME: kpoints is the same for all bands.
-                    ik += 1
+        """read filband.gnu.
+        
+        bands.x writes (2f10.4) lines of the length of the k path and the energy for each band
+        and a blank line after each band, so that the blocks of bands have the same length.
+        The memory-mapped file is viewed as a (num_band, num_k, line length) array of characters 
+        and fields are converted by numpy. If the file does not have this layout, values separated 
+        by spaces are converted at once.
+        """
+        with open(self.file, "rb") as fp, mmap.mmap(fp.fileno(), 0, access = mmap.ACCESS_READ) as data:
+            try:
+                self.k_path, self.energies = _parse_filbandgnu_fixed_width(data, self.num_k, self.num_band)
+                return
+            except ValueError:
+                body = data[:]
+        values = np.array(body.split(), dtype = np.float64)
+        if len(values) != 2*self.num_k*self.num_band:
+            raise ValueError(f"the number of values in {self.file} is not 2*num_k*num_band.")
+        values = values.reshape(self.num_band, self.num_k, 2)
+        if np.any(values[:, :, 0] != values[0, :, 0]):
+            print(f"warning: the k path in {self.file} is not the same for all bands. That of the first band is used.")
+        self.k_path:NDArray = values[0, :, 0].copy()
+        self.energies:NDArray = values[:, :, 1].copy()
+        
+    @property
+    def ek(self)->NDArray:
+        """(num_band, num_k, 2) array whose [i,j,0] is the length of the k path and [i,j,1] is the energy.
+        
+        NOTE: this is made at each access from self.k_path and self.energies for compatibility.
+        """
+        return np.stack([np.broadcast_to(self.k_path, self.energies.shape), self.energies], axis = -1)
                     
     def plot(self, pwxin:PWxIn|None = None, highlight_bands:list = [], savefig:str|None = None, show:bool = False, fermi:float|None = None):
         """plot energy bands alogn k-path
@@ -142,9 +226,10 @@ class Filbandgnu:
         pwxin : _type_, optional
             _description_, by default None
         """
+        import matplotlib.pyplot as plt # imported here not to slow down importing this module.
         fig, ax = plt.subplots()
-        for i in range(self.ek.shape[0]):
-            ax.plot(self.ek[i,:,0], self.ek[i,:,1] - fermi if fermi else self.ek[i,:,1], color = "red" if i in highlight_bands else "black")
+        for i in range(self.energies.shape[0]):
+            ax.plot(self.k_path, self.energies[i] - fermi if fermi else self.energies[i], color = "red" if i in highlight_bands else "black")
         if pwxin:
             if not re.match(r"bands", pwxin.calculation, flags = re.IGNORECASE):
                 raise ValueError("given PWxIn is not for bands.x.")
@@ -164,12 +249,104 @@ class Filbandgnu:
                         xlabels.append(pwxin.high_sym_labels[i][0])
                         xpindex.append(xpindex[xpindex_ind] + inc)
                         xpindex_ind += 1
-                b = self.ek[0,xpindex,0]
-                ax.set_xticks(self.ek[0,xpindex,0],labels=xlabels) #xpoints must be norm!
+                ax.set_xticks(self.k_path[xpindex],labels=xlabels) #xpoints must be norm!
                 for index in xpindex:
-                    ax.axvline(self.ek[0,index,0], color = "black", lw=1)
+                    ax.axvline(self.k_path[index], color = "black", lw=1)
             ax.set_ylabel("Energy [eV]")
         if savefig:
             plt.savefig(savefig)
         if show:
-            plt.show()
\ No newline at end of file
+            plt.show()
+
+def _parse_filband_header(line:bytes)->tuple[int, int]:
+    """the number of bands and k points in the first line of filband, " &plot nbnd=  60, nks=   274 /".
+    """
+    match = re.search(rb"nbnd\s*=\s*(\d+)\s*,\s*nks\s*=\s*(\d+)", line)
+    if match is None:
+        raise ValueError(f"the first line of filband, {line!r} is invalid.")
+    return int(match.group(1)), int(match.group(2))
+
+def _parse_filband_fixed_width(data:bytes|mmap.mmap, num_k:int, num_band:int, start:int = 0, chunk_size:int = 1 << 18):
+    """convert the body of filband, data[start:], written by (10x,3f10.6) and (10f9.3) for each k point.
+
+    The fields of energies are strided views of the buffer, so that no per-value python work 
+    and no copy of the buffer is made. Raises ValueError if the body has other layouts.
+
+    Returns
+    -------
+    tuple[NDArray, NDArray]
+        k points (num_k, 3) and energies (num_k, num_band).
+    """
+    num_full, num_rest = divmod(num_band, 10)
+    # the length of lines of a k point including newlines.
+    length = 41 + 91*num_full + (9*num_rest + 1 if num_rest else 0)
+    end = start + num_k*length
+    if len(data) < end or data[end:].strip() or (num_k and data[end - 1:end] != b"\n"):
+        raise ValueError("lines of k points do not have the same length.")
+    _check_characters(data, start, end, "filband")
+    blocks = np.frombuffer(data, dtype = np.uint8, count = num_k*length, offset = start).reshape(num_k, length)
+    line_ends = np.append(40 + 91*np.arange(num_full + 1), length - 1)
+    if np.any(blocks[:, line_ends] != ord("\n")):
+        raise ValueError("lines of k points do not have the same length.")
+    k_list = parse_reals(blocks[:, 10:40].reshape(num_k, 3, 10), 3, check = False)
+    # (num_k, line, field, character) views of full lines and the last line.
+    full = blocks[:, 41:41 + 91*num_full].reshape(num_k, num_full, 91)[:, :, :90].reshape(num_k, num_full, 10, 9)
+    rest = blocks[:, 41 + 91*num_full:41 + 91*num_full + 9*num_rest].reshape(num_k, num_rest, 9)
+    bands_en = np.empty([num_k, num_band])
+    step = max(1, chunk_size//max(num_band, 1))
+    for ik in range(0, num_k, step):
+        bands_en[ik:ik + step, :10*num_full] = parse_reals(full[ik:ik + step], 5, check = False).reshape(-1, 10*num_full)
+        bands_en[ik:ik + step, 10*num_full:] = parse_reals(rest[ik:ik + step], 5, check = False)
+    return k_list, bands_en
+
+def _parse_filbandgnu_fixed_width(data:bytes|mmap.mmap, num_k:int, num_band:int):
+    """convert filband.gnu written by (2f10.4) lines and a blank line for each band.
+
+    The blocks of bands are strided views of the buffer separated by blank lines (which may contain spaces).
+    Raises ValueError if data has other layouts.
+
+    Returns
+    -------
+    tuple[NDArray, NDArray]
+        the length of the k path (num_k,) and energies (num_band, num_k).
+    """
+    if num_k == 0 or num_band == 0:
+        raise ValueError("no values in filband.gnu.")
+    lines_end = 21*num_k
+    separator_end = data.find(b"\n", lines_end) + 1
+    if data[20:21] != b"\n" or separator_end <= 0 or data[lines_end:separator_end].strip():
+        raise ValueError("unexpected layout of filband.gnu.")
+    block_length = separator_end
+    # the last blank line may be missing.
+    end = (num_band - 1)*block_length + lines_end
+    if len(data) < end or data[end:].strip():
+        raise ValueError("unexpected layout of filband.gnu.")
+    _check_characters(data, 0, end, "filband.gnu")
+    buffer = np.frombuffer(data, dtype = np.uint8, count = end)
+    lines = np.lib.stride_tricks.as_strided(buffer, shape = (num_band, num_k, 21), strides = (block_length, 21, 1),
+                                            writeable = False)
+    separators = np.lib.stride_tricks.as_strided(buffer[lines_end:], shape = (num_band - 1, block_length - lines_end),
+                                                 strides = (block_length, 1), writeable = False)
+    if (np.any(lines[:, :, 20] != ord("\n")) or np.any(separators[:, -1] != ord("\n")) 
+        or np.any(separators[:, :-1] != ord(" "))):
+        raise ValueError("unexpected layout of filband.gnu.")
+    k_path = parse_reals(lines[0, :, :10], 5, check = False)
+    energies = np.empty([num_band, num_k])
+    same_path = True
+    step = max(1, (1 << 18)//num_k)
+    for iband in range(0, num_band, step):
+        same_path = same_path and not np.any(lines[iband:iband + step, :, :10] != lines[0, :, :10])
+        energies[iband:iband + step] = parse_reals(lines[iband:iband + step, :, 10:20], 5, check = False)
+    if not same_path:
+        print("warning: the k path in filband.gnu is not the same for all bands. That of the first band is used.")
+    return k_path, energies
+
+def _check_characters(data:bytes|mmap.mmap, start:int, end:int, name:str):
+    """raise ValueError if data[start:end] has characters other than those of fixed-point fields and newlines.
+
+    Fields are converted by parse_reals without its check after this.
+    """
+    for offset in range(start, end, 1 << 24):
+        # checked in slices since translate allocates a buffer of the size of its input.
+        if data[offset:min(offset + (1 << 24), end)].translate(None, b"0123456789 .-\n"):
+            raise ValueError(f"unexpected characters in {name}.")
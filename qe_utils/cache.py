@@ -0,0 +1,192 @@
+"""cache
+
+This module contains a class to cache numpy arrays parsed from output files of QE.
+
+Arrays are stored as .npy files in a directory (an entry) for each source file
+so that they can be loaded by memory-mapped reads.
+"""
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+from pathlib import Path
+
+CACHE_VERSION = 3 # increment this when the format of cached arrays changes.
+
+class ArrayCache:
+    """cache numpy arrays obtained from a source file.
+
+    An entry of a source file (and a kind of arrays) is a directory containing
+        meta.json  : size, mtime and content hash of the source file and user-given metadata.
+        {name}.npy : cached arrays.
+    An entry is valid if the size and mtime of the source file are the same as those in meta.json.
+    If only mtime is changed (e.g. by touch or copy), the content hash is compared.
+    Other files from which arrays are obtained (dependencies, e.g. filproj of projwfc.x) are 
+    recorded and checked in the same way, and an entry saved with other dependencies is invalid.
+    Invalid entries are removed automatically.
+
+    Attributes
+    ----------
+    cache_dir: Path | None
+        the directory where entries are stored.
+        If None, an entry is stored next to the source file as ".{source name}.qe_utils_cache".
+    max_bytes: int | None
+        the upper bound of the total size of entries in cache_dir.
+        Least recently used entries are evicted if the total size exceeds this value.
+        This is ignored if cache_dir is None.
+    """
+    def __init__(self, cache_dir:str|Path|None = None, max_bytes:int|None = None):
+        if cache_dir is None and os.environ.get("QE_UTILS_CACHE_DIR"):
+            cache_dir = os.environ["QE_UTILS_CACHE_DIR"]
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        self.max_bytes = max_bytes
+
+    def entry_dir(self, source:str|Path, kind:str|None = None) -> Path:
+        """the directory of the entry for source.
+        
+        kind distinguishes entries of different arrays obtained from the same source.
+        """
+        source = Path(source).resolve()
+        name = f"{source.name}.{kind}" if kind else source.name
+        if self.cache_dir is None:
+            return source.parent/f".{name}.qe_utils_cache"
+        path_hash = hashlib.blake2b(str(source).encode(), digest_size = 8).hexdigest()
+        return self.cache_dir/f"{name}-{path_hash}"
+
+    @staticmethod
+    def content_hash(source:str|Path, chunk_size:int = 1 << 23) -> str:
+        """blake2b hash of the content of source.
+        """
+        hasher = hashlib.blake2b(digest_size = 16)
+        with open(source, "rb") as fp:
+            while chunk := fp.read(chunk_size):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+
+    def load(self, source:str|Path, mmap_mode:str|None = "r", kind:str|None = None,
+             dependencies:list[str|Path]|None = None):
+        """load cached arrays of source.
+
+        Parameters
+        ----------
+        source : str | Path
+            the source file.
+        mmap_mode : str | None, optional
+            mmap_mode of np.load, by default "r"
+        kind : str | None, optional
+            the kind of arrays, by default None
+        dependencies : list[str | Path] | None, optional
+            other files from which arrays are obtained, by default None
+
+        Returns
+        -------
+        tuple[dict, dict] | None
+            cached arrays and metadata. None if the entry is not found or invalid.
+        """
+        entry = self.entry_dir(source, kind)
+        try:
+            with open(entry/"meta.json") as fp:
+                meta = json.load(fp)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        dependencies = [str(Path(file).resolve()) for file in dependencies] if dependencies else []
+        file_metas = [meta] + meta.get("dependencies", [])
+        valid = (meta.get("version") == CACHE_VERSION 
+                 and [file_meta["source"] for file_meta in file_metas[1:]] == dependencies)
+        if valid:
+            mtimes = [file_meta.get("mtime_ns") for file_meta in file_metas]
+            valid = all(self._is_unchanged(file_meta, file) for file_meta, file in zip(file_metas, [source] + dependencies))
+            if valid and mtimes != [file_meta.get("mtime_ns") for file_meta in file_metas]:
+                self._write_meta(entry, meta)
+        if not valid:
+            shutil.rmtree(entry, ignore_errors = True)
+            return None
+        try:
+            arrays = {name: np.load(entry/f"{name}.npy", mmap_mode = mmap_mode) for name in meta["arrays"]}
+        except (FileNotFoundError, ValueError):
+            shutil.rmtree(entry, ignore_errors = True)
+            return None
+        os.utime(entry) # mark the entry as recently used.
+        return arrays, meta["data"]
+
+    def save(self, source:str|Path, arrays:dict, data:dict|None = None, kind:str|None = None,
+             dependencies:list[str|Path]|None = None):
+        """save arrays obtained from source.
+
+        Parameters
+        ----------
+        source : str | Path
+            the source file.
+        arrays : dict
+            name -> array
+        data : dict | None, optional
+            json-serializable metadata stored with arrays, by default None
+        kind : str | None, optional
+            the kind of arrays, by default None
+        dependencies : list[str | Path] | None, optional
+            other files from which arrays are obtained, by default None
+        """
+        entry = self.entry_dir(source, kind)
+        entry.parent.mkdir(parents = True, exist_ok = True)
+        meta = dict(version = CACHE_VERSION, **self._file_meta(source),
+                    dependencies = [self._file_meta(file) for file in dependencies] if dependencies else [],
+                    arrays = list(arrays), data = data if data else {})
+        # write to a temporary directory first not to leave a broken entry.
+        tmp_entry = Path(tempfile.mkdtemp(prefix = f"{entry.name}.", dir = entry.parent))
+        for name, array in arrays.items():
+            np.save(tmp_entry/f"{name}.npy", np.asarray(array))
+        self._write_meta(tmp_entry, meta)
+        shutil.rmtree(entry, ignore_errors = True)
+        os.replace(tmp_entry, entry)
+        self.evict()
+
+    def clear(self, source:str|Path, kind:str|None = None):
+        """remove the entry of source.
+        """
+        shutil.rmtree(self.entry_dir(source, kind), ignore_errors = True)
+
+    def evict(self):
+        """remove least recently used entries until the total size is below self.max_bytes.
+        """
+        if self.cache_dir is None or self.max_bytes is None or not self.cache_dir.is_dir():
+            return
+        entries = [entry for entry in self.cache_dir.iterdir() if (entry/"meta.json").is_file()]
+        sizes = {entry: sum(file.stat().st_size for file in entry.iterdir()) for entry in entries}
+        total = sum(sizes.values())
+        for entry in sorted(entries, key = lambda entry: entry.stat().st_mtime):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors = True)
+            total -= sizes[entry]
+
+    @classmethod
+    def _file_meta(cls, file:str|Path)->dict:
+        """the path, size, mtime and content hash of a file stored in meta.json.
+        """
+        stat = os.stat(file)
+        return dict(source = str(Path(file).resolve()), size = stat.st_size, mtime_ns = stat.st_mtime_ns,
+                    hash = cls.content_hash(file))
+
+    @classmethod
+    def _is_unchanged(cls, file_meta:dict, file:str|Path)->bool:
+        """whether file is the same as that recorded in file_meta. mtime in file_meta is updated 
+        if only mtime is changed.
+        """
+        try:
+            stat = os.stat(file)
+        except FileNotFoundError:
+            return False
+        if file_meta.get("size") != stat.st_size:
+            return False
+        if file_meta.get("mtime_ns") != stat.st_mtime_ns:
+            if file_meta.get("hash") != cls.content_hash(file):
+                return False
+            file_meta["mtime_ns"] = stat.st_mtime_ns
+        return True
+
+    @staticmethod
+    def _write_meta(entry:Path, meta:dict):
+        with open(entry/"meta.json", "w") as fp:
+            json.dump(meta, fp)
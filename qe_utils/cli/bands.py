@@ -2,11 +2,13 @@ import click
 import numpy as np
 from qe_utils.pwx_in import PWxIn
 from qe_utils.bands import Filband, Filbandgnu
+from qe_utils.cli.profiling import profile_options
 
 # TODO: add plot band along kpath.
 
 @click.group()
 @click.argument("filband")
+@profile_options
 @click.pass_context
 def bands(ctx, filband:str):
     """
@@ -18,18 +20,28 @@ def bands(ctx, filband:str):
 @click.argument("energy_index", nargs = -1)
 @click.option("--mode", help = "all for all energy value, range for min and max", default = "range")
 @click.option("--show_kpoints",default = False, type =bool)
+@click.option("--emin", type = float, help = "the bottom of the energy window. If given, bands having states in the window are selected.")
+@click.option("--emax", type = float, help = "the top of the energy window. If given, bands having states in the window are selected.")
 @click.pass_context
-def band_info(ctx, energy_index:list|None, mode:str="range", show_kpoints:bool = False):
+def band_info(ctx, energy_index:tuple, mode:str="range", show_kpoints:bool = False, emin:float|None = None, emax:float|None = None):
     """get band information from filband generated by bands.x
+    
+    ENERGY_INDEX is "index1 index2 ..." or "start:stop[:step]". 
+    If it is not given, all bands (or bands in the energy window) are shown.
     """
     filband = ctx.obj
+    energy_index = " ".join(energy_index)
     if ":" in energy_index:
         energy_index = np.arange(*[int(num) for num in energy_index.split(":")])
-    else:
+    elif energy_index:
         try:
             energy_index = np.array([int(i) for i in energy_index.split()],dtype=int)
-        except:
-            ValueError("energy_index ({energy_index}) is invalid.")    
+        except ValueError:
+            raise click.BadParameter(f"energy_index ({energy_index}) is invalid.")
+    else:
+        energy_index = np.arange(filband.num_band)
+    if emin is not None or emax is not None:
+        energy_index = np.intersect1d(energy_index, filband.energy_index.bands(emin, emax))
         
     if show_kpoints:
         print("k points")
@@ -0,0 +1,34 @@
+"""profiling
+
+This module contains options of click groups to profile stages of readers by qe_utils.profiling.PROFILER.
+"""
+import click
+
+from qe_utils.profiling import PROFILER
+
+def _start_profile(ctx:click.Context, param:click.Parameter, value):
+    """enable PROFILER before the group reads files and report it when the group finishes.
+    """
+    if not value:
+        return
+    ctx.meta[f"qe_utils.{param.name}"] = value
+    if not PROFILER.enabled:
+        PROFILER.reset()
+        PROFILER.enable()
+        ctx.call_on_close(lambda: _finish_profile(ctx))
+
+def _finish_profile(ctx:click.Context):
+    PROFILER.disable()
+    if ctx.meta.get("qe_utils.profile"):
+        click.echo(PROFILER.report(), err = True)
+    if ctx.meta.get("qe_utils.profile_output"):
+        PROFILER.dump(ctx.meta["qe_utils.profile_output"])
+
+def profile_options(group):
+    """add --profile and --profile_output to a click group (or command).
+    """
+    group = click.option("--profile_output", is_eager = True, expose_value = False, callback = _start_profile,
+                         help = "the json file to which the time, calls and peak memory of stages of readers are written.")(group)
+    group = click.option("--profile", is_flag = True, is_eager = True, expose_value = False, callback = _start_profile,
+                         help = "print the time, calls and peak memory of stages of readers to stderr after the command.")(group)
+    return group
@@ -1,17 +1,27 @@
 import click
 import numpy as np
-import itertools
+from numpy.typing import NDArray
 
 from qe_utils.projwfc import ProjwfcOut
 from qe_utils.pwx_in import PWxIn
+from qe_utils.cache import ArrayCache
+from qe_utils.reducers import WindowSum
+from qe_utils.pdos import CONTRIBUTION_TYPES
+from qe_utils.cli.table import TableWriter, OUTPUT_FORMATS
+from qe_utils.cli.profiling import profile_options
     
 @click.group()
 @click.argument("projwfc_out")
 @click.argument("pw_in")
 @click.option("--fermi", help="the value of Fermi energy. If given, energy relative to the value is shown.")
 @click.option("--pdos_dir", default="./", help="the directory where the pdos files are stored.")
+@click.option("--cache/--no_cache", default=False, help="whether parsed projections are cached (by default, not cached).")
+@click.option("--cache_dir", help="the directory of the cache. If not given, the cache is stored next to PROJWFC_OUT.")
+@click.option("--cache_max_mb", type=float, help="the upper bound of the total size of the cache in cache_dir [MB].")
+@click.option("--filproj", help="the filproj file of projwfc.x. If given, projections are read from it.")
+@profile_options
 @click.pass_context
-def projwfc(ctx, projwfc_out:str, pw_in:str, fermi, pdos_dir):
+def projwfc(ctx, projwfc_out:str, pw_in:str, fermi, pdos_dir, cache:bool, cache_dir, cache_max_mb, filproj):
     """get information from the output of projwfc.x
     
       PROJWFC_OUT is the output file of projwfc.x\n
@@ -20,56 +30,176 @@ def projwfc(ctx, projwfc_out:str, pw_in:str, fermi, pdos_dir):
     if type(fermi) == str:
         fermi = float(fermi)
     pwxin = PWxIn.from_pwx_input(pw_in)
-    ctx.obj = ProjwfcOut(projwfc_out, pdos_dir = pdos_dir if pdos_dir else "./", fermi = fermi, pwxin = pwxin)
+    if cache:
+        cache = ArrayCache(cache_dir, max_bytes = int(cache_max_mb*1024**2) if cache_max_mb else None)
+    ctx.obj = ProjwfcOut(projwfc_out, pdos_dir = pdos_dir if pdos_dir else "./", fermi = fermi, pwxin = pwxin, cache = cache,
+                         filproj = filproj)
+
+def output_options(command):
+    """add --format and --output options to a command.
+    """
+    command = click.option("--output", "-o", help = "the output file. If not given, the output is printed (necessary for npy and npz).")(command)
+    command = click.option("--format", "output_format", default = "text", type = click.Choice(OUTPUT_FORMATS),
+                           help = """the output format (by default, text).
+                           csv and jsonl are tables with a row for each line of text, 
+                           npy is a structured array and npz has an array for each column.""")(command)
+    return command
+
+def table_writer(output_format:str, names:list[str], output:str|None, **kwargs)->TableWriter:
+    try:
+        return TableWriter(output_format, names, output, **kwargs)
+    except ValueError as err:
+        raise click.UsageError(str(err))
 
 @projwfc.command()
+@output_options
 @click.pass_context
-def kpoints(ctx):
+def kpoints(ctx, output_format:str, output:str|None):
     """show all kpoints
     """
     ctx.obj.read_projections()
-    print("ik, kpoints")
-    for ik, k in enumerate(ctx.obj.k):
-        print(f"{ik} {k}")
+    if output_format == "text" and output is None:
+        print("ik, kpoints")
+        for ik, k in enumerate(ctx.obj.k):
+            print(f"{ik} {k}")
+        return
+    with table_writer(output_format, ["ik", "kx", "ky", "kz"], output, header = "# ik, kpoints") as writer:
+        writer.write(np.arange(ctx.obj.nk), *np.asarray(ctx.obj.k).T)
 
 @projwfc.command()
+@output_options
 @click.pass_context
-def states(ctx):
+def states(ctx, output_format:str, output:str|None):
     """show relation between the pseudo-orbital index and its atomic center and quantum angular momentum numbers.
     """
     if ctx.obj.soc: NotImplementedError("soc case is not implemented.")
-    print("pso index: atom, position, azimuthal, magnetic")
-    for i, (iatom, l, m) in enumerate(zip(ctx.obj.iatom, ctx.obj.l, ctx.obj.m)):
-        atom = ctx.obj.pwxin.atom_positions[iatom][0]
-        x,y,z = ctx.obj.pwxin.atom_positions[iatom][1]
-        print(f"{i:3d}: {atom:2s} {x:.3f} {y:.3f} {z:.3f} {l} {m}")
+    iatom = np.asarray(ctx.obj.iatom)
+    atoms = np.array([name for name, _ in ctx.obj.pwxin.atom_positions])[iatom]
+    positions = np.array([position for _, position in ctx.obj.pwxin.atom_positions])[iatom]
+    with table_writer(output_format, ["index", "atom", "x", "y", "z", "l", "m"], output, 
+                      text_format = "%3d: %-2s %.3f %.3f %.3f %d %d", 
+                      header = "pso index: atom, position, azimuthal, magnetic") as writer:
+        writer.write(np.arange(ctx.obj.natomwfc), atoms, *positions.T, np.asarray(ctx.obj.l), np.asarray(ctx.obj.m))
     
     
 @projwfc.command()
 @click.option("--bands", help = "band indices.")
 @click.option("--kpoints", help="coordinates of the kpoint")
 @click.option("--atomwfcs", help="the indices of atomic wave functions for which the projections are shown")
-@click.option("--threshold", help = "threshold of projection to be printed.", type = float)
+@click.option("--threshold", help = "threshold of projection to be printed.", type = float, default = 0)
+@click.option("--emin", type = float, help = "the bottom of the energy window. If given, only states above it are printed.")
+@click.option("--emax", type = float, help = "the top of the energy window. If given, only states below it are printed.")
+@click.option("--stream", is_flag = True, help = "read k points one by one without keeping all projections in memory.")
+@output_options
 @click.pass_context
-def projections(ctx, kpoints, bands, atomwfcs, threshold:float = 0):
+def projections(ctx, kpoints, bands, atomwfcs, threshold:float = 0, emin:float|None = None, emax:float|None = None, 
+                stream:bool = False, output_format:str = "text", output:str|None = None):
     """print projection value of each orbital at band energies
     
     There are two formats for the `atomwfcs` option.
     The formats of the option are:
         1. "index1, index2, ..., indexn"
         2. "start:stop:[step]"
+    Projections are printed in the order of the given indices, and repeated indices are printed repeatedly.
     """
-    ctx.obj.read_projections()
     inputs = [kpoints, bands, atomwfcs]
     num_for_k_band_wfc = [ctx.obj.nk, ctx.obj.nbnd, ctx.obj.natomwfc]
     inputs = [convert_to_array(ipt) if ipt else np.arange(ntot) for ipt, ntot in zip(inputs, num_for_k_band_wfc)]
-    print("# k-index, band-index, wfc-index, energy, projection")
-    for ik, ibnd, iwf in itertools.product(*inputs):
-        ek = ctx.obj.ek[ik,ibnd]
-        proj_value = ctx.obj.proj[ik,ibnd,iwf]
-        if proj_value > threshold:
-            print(f"{ik:3d} {ibnd:3d} {iwf:3d}  {ek:+9.5f} {proj_value:.3f}")
+    writer = table_writer(output_format, ["ik", "ibnd", "iwfc", "energy", "projection"], output, 
+                          text_format = "%3d %3d %3d  %+9.5f %.3f", header = "# k-index, band-index, wfc-index, energy, projection")
+    with writer:
+        if stream:
+            kpoint_counts = np.bincount(inputs[0], minlength = ctx.obj.nk)
+            for ik, k, ek, proj_k in ctx.obj.iter_projections():
+                if kpoint_counts[ik]:
+                    in_window = (ek - ctx.obj.fermi >= (-np.inf if emin is None else emin)) & \
+                                (ek - ctx.obj.fermi <= (np.inf if emax is None else emax))
+                    ibnd, iwfc = select_projections(inputs[1][in_window[inputs[1]]], inputs[2], proj_k, threshold)
+                    for _ in range(kpoint_counts[ik]):
+                        writer.write(np.full(len(ibnd), ik), ibnd, iwfc, ek[ibnd], proj_k[ibnd, iwfc])
+            return
+        # states above threshold are looked up from the inverted index and printed in the order of inputs.
+        ik, ibnd, iwfc, weight = ctx.obj.orbital_index(threshold).select(np.unique(inputs[2]))
+        if emin is not None or emax is not None:
+            # states in the window are resolved through the sorted index over band energies.
+            in_window = np.zeros(ctx.obj.nk*ctx.obj.nbnd, dtype = bool)
+            in_window[ctx.obj.energy_index.window(emin, emax)] = True
+            selected = in_window[ik*ctx.obj.nbnd + ibnd]
+            ik, ibnd, iwfc, weight = ik[selected], ibnd[selected], iwfc[selected], weight[selected]
+        # each element is repeated for each position of its indices in inputs (and dropped if not in inputs).
+        columns, positions = [ik, ibnd, iwfc, weight], []
+        for axis, (selected, ntot) in enumerate(zip(inputs, num_for_k_band_wfc)):
+            repeat, position = index_positions(columns[axis], selected, ntot)
+            columns = [column[repeat] for column in columns]
+            positions = [position_i[repeat] for position_i in positions] + [position]
+        ik, ibnd, iwfc, weight = [column[np.lexsort(positions[::-1])] for column in columns]
+        writer.write(ik, ibnd, iwfc, ctx.obj.ek[ik, ibnd], weight)
+
+def index_positions(indices:NDArray, selected:NDArray, ntot:int)->tuple[NDArray, NDArray]:
+    """positions of indices in selected, which may have repeated indices.
+    
+    Returns
+    -------
+    tuple[NDArray, NDArray]
+        elements of indices repeated for each of their positions in selected, and the positions.
+    """
+    counts = np.bincount(selected, minlength = ntot)
+    order = np.argsort(selected, kind = "stable")
+    starts = np.cumsum(counts) - counts
+    repeat = np.repeat(np.arange(len(indices)), counts[indices])
+    first = np.cumsum(counts[indices]) - counts[indices]
+    offsets = np.arange(len(repeat)) - np.repeat(first, counts[indices])
+    return repeat, order[starts[indices[repeat]] + offsets]
+        
+def select_projections(bands, atomwfcs, proj_k, threshold:float = 0):
+    """band and atomic wave function indices of projections at a k point larger than threshold.
+    
+    Indices are in the order of itertools.product(bands, atomwfcs).
+    """
+    ibnd, iwfc = np.nonzero(proj_k[np.ix_(bands, atomwfcs)] > threshold)
+    return bands[ibnd], atomwfcs[iwfc]
     
+@projwfc.command()
+@click.option("--num", "-n", type = int, default = 3, help = "the number of orbitals shown for each state (by default, 3).")
+@click.option("--bands", help = "band indices.")
+@click.option("--kpoints", help="indices of k points.")
+@click.pass_context
+def top_orbs(ctx, num:int, bands, kpoints):
+    """print orbitals with the largest projections for each state (k, band).
+    
+    The formats of the options are the same as those of the projections command.
+    """
+    kpoints = convert_to_array(kpoints) if kpoints else np.arange(ctx.obj.nk)
+    bands = convert_to_array(bands) if bands else np.arange(ctx.obj.nbnd)
+    values, indices = ctx.obj.top_atom_proj(num, kpoints = kpoints, bands = bands)
+    print("# k-index, band-index, energy, (wfc-index, projection) * num")
+    for i, ik in enumerate(kpoints):
+        for j, ibnd in enumerate(bands):
+            orbitals = " ".join(f"{iwf:3d} {value:.3f}" for iwf, value in zip(indices[i,j], values[i,j]) if iwf >= 0)
+            print(f"{ik:3d} {ibnd:3d}  {ctx.obj.ek[ik,ibnd]:+9.5f} {orbitals}")
+
+@projwfc.command()
+@click.argument("num_wann", type = int)
+@click.option("--emin", type = float, help = "the bottom of the energy window.")
+@click.option("--emax", type = float, help = "the top of the energy window.")
+@click.option("--beam_width", type = int, default = 20, help = "the number of partial sets kept in the beam search (by default, 20). 1 is a greedy search.")
+@click.option("--num_results", type = int, default = 3, help = "the number of printed sets (by default, 3).")
+@click.option("--uniformity", type = float, default = 1.0, 
+              help = "the weight of the standard deviation of projectability over k points in scores (by default, 1.0).")
+@click.pass_context
+def wannier_projections(ctx, num_wann:int, emin:float|None, emax:float|None, beam_width:int, num_results:int, uniformity:float):
+    """search sets of atomic orbitals for NUM_WANN Wannier functions and print them as projections blocks of Wannier90.
+    
+    Sets are ranked by the mean - uniformity * std over k points of the projectability of states in the energy window.
+    """
+    candidates = ctx.obj.search_wannier_projections(num_wann, emin, emax, beam_width = beam_width, 
+                                                    num_results = num_results, uniformity = uniformity)
+    if not candidates:
+        print(f"no set of orbitals has {num_wann} orbitals.")
+    for candidate in candidates:
+        print(f"# score {candidate.score:.4f}: mean {candidate.mean:.4f}, std {candidate.std:.4f}")
+        print(candidate.projections_block(ctx.obj.pwxin))
+
 def convert_to_array(string:str):
     if ":" in string:
         return np.arange(*[int(num) for num in string.split(":")])
@@ -79,28 +209,89 @@ def convert_to_array(string:str):
 @projwfc.command()
 @click.option("--emin",type = float, help="the bottom of energy range")
 @click.option("--emax",type = float, help="the top of energy range")
-@click.option("--evaluation",default = "integral", 
+@click.option("--evaluation",default = "integral", type = click.Choice(list(CONTRIBUTION_TYPES)),
               help="""type of how to evaluate contribution of orbitals from pdos.
-              2 types of options are available (by default, integral):
+              5 types of options are available (by default, integral):
                 max: the maximum value of pdos in selected energy range
-                integral: integral of projected dos in selected energy range""")
+                integral: integral of projected dos in selected energy range
+                mean: the mean value of pdos in selected energy range
+                centroid: the weighted centroid of energies in selected energy range
+                band_center: the band center of pdos in selected energy range""")
+@click.option("--source", default = "pdos", type = click.Choice(["pdos", "projections"]),
+              help="""pdos: evaluate contributions from pdos files (by default).
+              projections: sum projectability of bands in selected energy range by streaming k points.
+              The evaluation option is ignored.""")
+@click.option("--window", multiple = True, 
+              help="""energy window "emin:emax". This option can be given multiple times.
+              If given, orbitals are sorted for each window by the integral (or mean if evaluation is mean) 
+              of pdos computed from the cumulative integral, and emin, emax are ignored.""")
+@click.option("--sliding", help="""sliding windows "width:step" in [emin, emax]. 
+              If given, orbitals are sorted for each window as the window option.""")
+@click.option("--group_by", help="""sort groups of orbitals by their summed pdos instead of orbitals.
+              element, atom, l or their combination separated by commas (e.g. "element,l").""")
+@output_options
 @click.pass_context
-def sort_orbs(ctx, emin:float, emax:float, evaluation:str):
+def sort_orbs(ctx, emin:float, emax:float, evaluation:str, source:str, window:tuple, sliding:str|None, group_by:str|None,
+              output_format:str = "text", output:str|None = None):
     """sort orbitals according to their contributions to bands in selected energy range.
     
     "the name of the output file of projwfc.x"
     "the name of the input file of pw.x corresponding to the input of projwfc.x"
     """
+    projout = ctx.obj
+    text = output_format == "text" and output is None
+    group_by = group_by.split(",") if group_by else None
+    # NOTE: labels of orbitals (or groups) need pdos files, which are not read for the projections source.
+    pdos_labels = lambda: projout.pdos.group_index(group_by)[0] if group_by else projout.orbitals
+    if window or sliding:
+        windows = [[float(energy) for energy in w.split(":")] for w in window]
+        if sliding:
+            if emin is None or emax is None:
+                raise click.UsageError("emin and emax are necessary for the sliding option.")
+            windows += projout.pdos.sliding_windows(emin, emax, *[float(value) for value in sliding.split(":")]).tolist()
+        orders, values = projout.scan_orbs_by_pdos_contribution(windows, "mean" if evaluation == "mean" else "integral",
+                                                                group_by = group_by)
+        labels = pdos_labels()
+        if not text:
+            windows = np.repeat(np.asarray(windows, dtype = np.float64), orders.shape[1], axis = 0)
+            write_sorted_orbs(output_format, output, windows, orders.ravel(), labels, values.ravel())
+            return
+        for (wmin, wmax), order, value in zip(windows, orders, values):
+            print(f"energy range is {wmin}:{wmax}")
+            for i, v in zip(order, value):
+                print(f"{labels[i]} {v}")
+        return
     if not emin or not emax:
         energy_range = None
     else:
         energy_range = [emin, emax]
-        print("energy range is {emin}:{emax}")
-    projout = ctx.obj
-    result = projout.sort_orbs_by_pdos_contribution(energy_range=energy_range, contribution_type= evaluation)
+        if text:
+            print(f"energy range is {emin}:{emax}")
+    window_columns = lambda num: np.tile(np.array(energy_range if energy_range else [np.nan, np.nan], dtype = np.float64), (num, 1))
+    if source == "projections":
+        window_sum, = projout.reduce(WindowSum(*energy_range) if energy_range else WindowSum())
+        order = np.argsort(-window_sum, kind = "stable")
+        if not text:
+            labels = [f"{iatom} {l} {m}" for iatom, l, m in zip(projout.iatom, projout.l, projout.m)]
+            write_sorted_orbs(output_format, output, window_columns(len(order)), order, labels, window_sum[order])
+            return
+        print("pso index: atom, azimuthal, magnetic, summed projectability")
+        for i in order:
+            print(f"{i:3d}: {projout.iatom[i]} {projout.l[i]} {projout.m[i]} {window_sum[i]:.3f}")
+        return
+    result = projout.sort_orbs_by_pdos_contribution(energy_range=energy_range, contribution_type= evaluation, group_by = group_by)
+    labels = pdos_labels()
+    if not text:
+        write_sorted_orbs(output_format, output, window_columns(len(result[0])), np.asarray(result[0]), labels, np.asarray(result[1]))
+        return
     for i, value in zip(result[0],result[1]):
-        print(f"{projout.orbitals[i]} {value}")
+        print(f"{labels[i]} {value}")
+        
+def write_sorted_orbs(output_format:str, output:str|None, windows:NDArray, indices:NDArray, labels:list, values:NDArray):
+    """write sorted orbitals (or groups) as a table of (emin, emax, index, label, value).
+    """
+    with table_writer(output_format, ["emin", "emax", "index", "label", "value"], output) as writer:
+        writer.write(windows[:,0], windows[:,1], indices, np.array([str(labels[i]) for i in indices]), values.astype(np.float64))
                 
 if __name__ == "__main__":
-    projwfc()
-    
\ No newline at end of file
+    projwfc()
\ No newline at end of file
@@ -0,0 +1,142 @@
+"""table
+
+This module contains a writer of tables printed by commands in several formats.
+
+Rows are formatted by a single %-formatting of a chunk of rows instead of a python loop over rows,
+and binary formats (npy, npz) are written directly from the arrays.
+"""
+import sys
+import json
+import itertools
+import numpy as np
+from numpy.typing import NDArray
+
+OUTPUT_FORMATS = ["text", "csv", "jsonl", "npy", "npz"]
+
+class TableWriter:
+    """write a table given in chunks of columns.
+
+    Formats are
+        text : rows formatted by text_format (a %-format of a row) with header lines starting with "#".
+        csv  : comma separated values with a line of names.
+        jsonl: a json object for each row.
+        npy  : a structured array.
+        npz  : an array for each column.
+    Chunks are written at once for text formats and collected until close for binary formats.
+
+    Example
+    -------
+    >>> with TableWriter("csv", ["ik", "energy"]) as writer:
+    ...     writer.write(ik, energy)
+    """
+    def __init__(self, format:str, names:list[str], output:str|None = None, text_format:str|None = None,
+                 header:str|None = None, chunk_rows:int = 1 << 16):
+        """
+        Parameters
+        ----------
+        format : str
+            one of OUTPUT_FORMATS.
+        names : list[str]
+            the names of columns.
+        output : str | None, optional
+            the output file, by default None (stdout). It is necessary for binary formats.
+        text_format : str | None, optional
+            %-format of a row for the text format, by default None (values separated by spaces)
+        header : str | None, optional
+            the header of the text format, by default None
+        chunk_rows : int, optional
+            the number of rows formatted at once, by default 2**16
+        """
+        if format not in OUTPUT_FORMATS:
+            raise ValueError(f"format, {format} is invalid.")
+        if format in ["npy", "npz"] and output is None:
+            raise ValueError(f"output file is necessary for {format} format.")
+        self.format = format
+        self.names = names
+        self.output = output
+        self.text_format = text_format
+        self.chunk_rows = chunk_rows
+        self._chunks:list[list[NDArray]] = []
+        self._fp = None
+        if format in ["npy", "npz"]:
+            return
+        self._fp = open(output, "w") if output else sys.stdout
+        if format == "text" and header:
+            self._fp.write(f"{header}\n")
+        elif format == "csv":
+            self._fp.write(",".join(names) + "\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, *columns):
+        """write a chunk of rows.
+
+        Parameters
+        ----------
+        columns : NDArray
+            columns of the same length in the order of names.
+        """
+        columns = [np.asarray(column) for column in columns]
+        if self._fp is None:
+            self._chunks.append(columns)
+            return
+        for start in range(0, len(columns[0]), self.chunk_rows):
+            self._fp.write(self._format_rows([column[start:start + self.chunk_rows] for column in columns]))
+
+    def close(self):
+        """write collected chunks of binary formats and close the output file.
+        """
+        if self.format in ["npy", "npz"]:
+            columns = [np.concatenate(chunk) for chunk in zip(*self._chunks)] if self._chunks else \
+                [np.zeros(0)]*len(self.names)
+            if self.format == "npz":
+                np.savez(self.output, **dict(zip(self.names, columns)))
+            else:
+                table = np.zeros(len(columns[0]), dtype = [(name, column.dtype) for name, column in zip(self.names, columns)])
+                for name, column in zip(self.names, columns):
+                    table[name] = column
+                np.save(self.output, table)
+        elif self._fp is not sys.stdout:
+            self._fp.close()
+        else:
+            self._fp.flush()
+
+    def _format_rows(self, columns:list[NDArray])->str:
+        """format rows by a single %-formatting.
+        """
+        num_rows = len(columns[0])
+        if num_rows == 0:
+            return ""
+        if self.format == "jsonl" and any(column.dtype.kind == "f" and not np.all(np.isfinite(column)) for column in columns):
+            # nan and inf are written as json.dumps does.
+            return "".join(json.dumps(dict(zip(self.names, row))) + "\n" for row in zip(*[column.tolist() for column in columns]))
+        formats, values = [], []
+        for column in columns:
+            if column.dtype.kind in "iub":
+                formats.append("%d")
+                values.append(column.astype(np.int64).tolist())
+            elif column.dtype.kind == "f":
+                # repr of python float is the shortest string read back to the same value.
+                formats.append("%r")
+                values.append(column.tolist())
+            else:
+                formats.append("%s")
+                values.append([self._quote(str(value)) for value in column.tolist()])
+        if self.format == "text":
+            row_format = self.text_format if self.text_format else " ".join(formats)
+        elif self.format == "csv":
+            row_format = ",".join(formats)
+        else:
+            row_format = "{" + ", ".join(f"{json.dumps(name)}: {fmt}" for name, fmt in zip(self.names, formats)) + "}"
+        return ((row_format + "\n")*num_rows) % tuple(itertools.chain.from_iterable(zip(*values)))
+
+    def _quote(self, value:str)->str:
+        if self.format == "jsonl":
+            return json.dumps(value)
+        if self.format == "csv" and any(char in value for char in ',"\n'):
+            return '"' + value.replace('"', '""') + '"'
+        return value
@@ -0,0 +1,123 @@
+"""fixed_width
+
+This module contains converters of fields of Fortran formats (iN, fN.M and eN.M) into numbers.
+
+Fields are given as arrays of characters (uint8) whose last axis is the width of fields,
+e.g. strided views of a memory-mapped file, and are converted by numpy for each position of
+characters without per-value python work and without copying the characters.
+"""
+import numpy as np
+from numpy.typing import NDArray
+
+_POWERS_OF_10 = 10.0**np.arange(23) # powers of 10 exact in float64.
+_MAX_EXACT_INTEGER = 2**53 # integers up to this are exact in float64.
+
+def parse_reals(chars:np.ndarray, point:int|None = None, check:bool = True)->NDArray:
+    """convert right-aligned real fields (Fortran fN.M or eN.M format) into floats.
+
+    Digits of the mantissa are accumulated as an integer for each position of characters and
+    scaled by a power of 10 by one division (or multiplication), which is correctly rounded and
+    gives the same value as float(). Fields whose mantissa or power of 10 is not exact in float64
+    are converted by float().
+
+    Parameters
+    ----------
+    chars : np.ndarray
+        (..., width) characters of fields.
+    point : int | None, optional
+        the position of the decimal point in fields, by default None (that in the first field)
+    check : bool, optional
+        whether characters other than digits, " ", "+" and "-" are checked, by default True.
+        Set False if characters are already checked (e.g. by bytes.translate) since the check costs
+        about a third of the conversion.
+
+    Returns
+    -------
+    NDArray
+        (...) values of fields.
+
+    Raises
+    ------
+    ValueError
+        if fields have decimal points (or exponents) at other positions,
+        or characters other than digits, " ", "+" and "-" (if check is True).
+    """
+    shape, width = chars.shape[:-1], chars.shape[-1]
+    if chars.size == 0:
+        return np.zeros(shape)
+    first = bytes(chars[(0,)*len(shape)])
+    point = first.find(b".") if point is None else point
+    exp = first.upper().find(b"E")
+    mantissa_end = exp if exp >= 0 else width
+    if point < 0 or np.any(chars[..., point] != ord(".")) or (exp >= 0 and np.any(chars[..., exp] | 0x20 != ord("e"))):
+        raise ValueError("unexpected real field.")
+    # 19 digits do not overflow uint64.
+    mantissa_positions = [j for j in range(mantissa_end) if j != point]
+    mantissa, negative, invalid = _accumulate_digits(chars, mantissa_positions, np.uint64, check)
+    power = point + 1 - mantissa_end
+    if exp >= 0:
+        exponent, exponent_negative, exponent_invalid = _accumulate_digits(chars, range(exp + 1, width), np.int64, check)
+        invalid |= exponent_invalid
+        power = power + np.where(exponent_negative, -exponent, exponent)
+    if check and np.any(invalid):
+        raise ValueError("unexpected real field.")
+    # one of the two operations is by 1.0 and exact.
+    value = mantissa/_POWERS_OF_10[np.clip(-power, 0, 22)]*_POWERS_OF_10[np.clip(power, 0, 22)]
+    np.negative(value, out = value, where = negative)
+    inexact = np.abs(power) > 22
+    if len(mantissa_positions) > 15:
+        inexact = inexact | (mantissa > _MAX_EXACT_INTEGER)
+    if np.any(inexact):
+        inexact = np.broadcast_to(inexact, shape)
+        value[inexact] = np.ascontiguousarray(chars[inexact]).view(f"S{width}").ravel().astype(np.float64)
+    return value
+
+def parse_ints(chars:np.ndarray)->NDArray:
+    """convert right-aligned integer fields (Fortran iN format) into integers.
+
+    Parameters
+    ----------
+    chars : np.ndarray
+        (..., width) characters of fields.
+
+    Returns
+    -------
+    NDArray
+        (...) values of fields.
+
+    Raises
+    ------
+    ValueError
+        if fields have characters other than digits, " ", "+" and "-".
+    """
+    value, negative, invalid = _accumulate_digits(chars, range(chars.shape[-1]), np.int64, True)
+    if np.any(invalid):
+        raise ValueError("unexpected integer field.")
+    np.negative(value, out = value, where = negative)
+    return value
+
+def _accumulate_digits(chars:np.ndarray, positions, dtype, check:bool)->tuple[NDArray, NDArray, NDArray]:
+    """accumulate digits at positions of fields into integers.
+
+    Characters other than digits count as 0.
+
+    Returns
+    -------
+    tuple[NDArray, NDArray, NDArray]
+        integers, whether fields have "-" and whether fields have characters other than 
+        digits, " ", "+" and "-" (always False if check is False).
+    """
+    value = np.zeros(chars.shape[:-1], dtype = dtype)
+    negative = np.zeros(chars.shape[:-1], dtype = bool)
+    invalid = np.zeros(chars.shape[:-1], dtype = bool)
+    for j in positions:
+        column = chars[..., j]
+        digit = column - np.uint8(ord("0"))
+        is_digit = digit < 10
+        value *= 10
+        value += np.where(is_digit, digit, 0)
+        minus = column == ord("-")
+        negative |= minus
+        if check:
+            invalid |= ~is_digit & ~minus & (column != ord(" ")) & (column != ord("+"))
+    return value, negative, invalid
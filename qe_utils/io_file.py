@@ -4,6 +4,7 @@ import os
 import copy
 from collections import OrderedDict
 from typing import Dict, Any
+from qe_utils.profiling import profiled
 
 NestedDict = Dict[str, Dict[str, str]]
 NPROC = 22 #TODO :move this to file containing global variables.
@@ -47,6 +48,7 @@ class IOFiles:
         self._get_unique_dirs()
               
     @classmethod
+    @profiled("IOFiles.from_toml")
     def from_toml(cls,toml_file,**kwargs):
         io_dict = cls._read_toml(toml_file)
         io_dict, nproc = cls._read_and_pop_root_dir(io_dict)
@@ -95,6 +97,7 @@ class IOFiles:
             print("  Furthermore, filband parameter must be given in bandsx block.") 
         
         
+    @profiled("IOFiles.make_run_script")
     def make_run_script(self, caltype_list: list|None = None):
         """make a job script of QuantumEspresso.
         """
@@ -1,4 +1,5 @@
 import re
+from qe_utils.profiling import profiled
 class NameList:
     """read namelist from file.
     
@@ -11,6 +12,7 @@ class NameList:
         self.file = file
         self.read()
         
+    @profiled("NameList.read")
     def read(self):
         self.namelist = dict() #namelist[card_name] = dict(key1->value1,...)
         non_namelist_lines = None #lines which are not cards.
@@ -0,0 +1,516 @@
+"""pdos
+
+This module contains a class to hold projected dos files written by projwfc.x
+
+All "{prefix}.pdos_atm#{atom}({element})_wfc#{wfc}({l})" files in a directory are
+loaded once into one array so that plotting and sorting orbitals do not read files again.
+"""
+import os
+import re
+import numpy as np
+from numpy.typing import NDArray
+from pathlib import Path
+from typing import Callable
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from qe_utils.sparse_proj import SparseProjections
+from qe_utils.profiling import PROFILER, profiled
+from qe_utils.fixed_width import parse_reals
+
+PDOS_FILE_PATTERN = r"\.pdos_atm#([0-9]+)\((.*)\)_wfc#([0-9]+)\((.*)\)"
+
+# keys of group_by and the corresponding metadata of PdosSet.
+GROUP_KEYS = {"element": "atom_names", "atom": "atom_indices", "l": "angular"}
+
+# broadening functions of delta functions. x = (E - e)/degauss.
+SMEARINGS = {
+    "gaussian": lambda x: np.exp(-x**2)/np.sqrt(np.pi),
+    "lorentzian": lambda x: 1/(np.pi*(1 + x**2)),
+}
+
+def _parse_fixed_width_table(data:bytes, start:int = 0):
+    """convert a block of lines of right-aligned real fields from data[start:] into a 2D array.
+    
+    The fields are found from the first line. Raises ValueError if lines have other layouts.
+    """
+    width = data.find(b"\n", start) + 1 - start
+    if width <= 1 or (len(data) - start) % width:
+        raise ValueError("lines do not have the same length.")
+    if data[start:].translate(None, b"0123456789 .eE+-\n"):
+        raise ValueError("unexpected characters in real fields.")
+    lines = np.frombuffer(data, dtype = np.uint8, offset = start).reshape(-1, width)
+    if np.any(lines[:, -1] != ord("\n")):
+        raise ValueError("lines do not have the same length.")
+    first = data[start:start + width - 1]
+    bounds = [match.end() for match in re.finditer(rb"\S+", first)]
+    fields = list(zip([0] + bounds[:-1], bounds))
+    table = np.empty([len(lines), len(fields)])
+    table[:, 0] = parse_reals(lines[:, fields[0][0]:fields[0][1]], check = False)
+    field_widths = {end - begin for begin, end in fields[1:]}
+    if len(field_widths) == 1:
+        # fields after energy have the same width and are converted at once.
+        field_width = field_widths.pop()
+        block = lines[:, fields[1][0]:fields[-1][1]].reshape(len(lines), len(fields) - 1, field_width)
+        table[:, 1:] = parse_reals(block, check = False)
+    else:
+        for i, (begin, end) in enumerate(fields[1:], start = 1):
+            table[:, i] = parse_reals(lines[:, begin:end], check = False)
+    return table
+
+def _simpson(y:NDArray, x:NDArray):
+    """scipy.integrate.simpson along the last axis.
+    
+    NOTE: scipy is imported at the first call not to slow down importing this module.
+    """
+    from scipy.integrate import simpson
+    return simpson(y, x = x, axis = -1)
+
+def _first_moment(dos:NDArray, energies:NDArray):
+    """int E dos(E) dE / int dos(E) dE along the last axis. 0 if the denominator is 0."""
+    norm = _simpson(dos, energies)
+    moment = _simpson(dos*energies, energies)
+    return np.divide(moment, norm, out = np.zeros(np.shape(norm)), where = norm != 0)
+
+def _centroid(dos:NDArray, energies:NDArray):
+    """sum_E E dos(E) / sum_E dos(E) along the last axis. 0 if the denominator is 0."""
+    weight = dos.sum(axis = -1)
+    return np.divide(dos @ energies, weight, out = np.zeros(np.shape(weight)), where = weight != 0)
+
+# contribution types: func(dos, energies) -> contributions reduced along the last (energy) axis.
+CONTRIBUTION_TYPES = {
+    "max": lambda dos, energies: dos.max(axis = -1),
+    "integral": _simpson,
+    "mean": lambda dos, energies: dos.mean(axis = -1),
+    "centroid": _centroid,
+    "band_center": _first_moment,
+}
+
+@profiled("pdos.find_pdos_files")
+def find_pdos_files(pdos_dir:str|Path):
+    """find pdos files in a directory.
+
+    NOTE: the order is that of os.listdir.
+
+    Parameters
+    ----------
+    pdos_dir : str | Path
+        the directory where pdos files are stored.
+
+    Returns
+    -------
+    tuple[list[str], list[re.Match]]
+        file names and matches of PDOS_FILE_PATTERN
+        whose groups are atom index, atom name, wfc index and angular momentum.
+    """
+    files, matches = [], []
+    for file in os.listdir(pdos_dir):
+        match = re.search(PDOS_FILE_PATTERN, file)
+        if not match: continue
+        files.append(file)
+        matches.append(match)
+    return files, matches
+
+@profiled("pdos.read_pdos_file")
+def read_pdos_file(file:str|Path):
+    """read a pdos file.
+    
+    projwfc.x writes the numeric block of pdos files with fixed-width fields (f8.3 for energy 
+    and e11.3 for dos), so the block is converted by numpy on the whole buffer without 
+    splitting lines. The result is the same as that of np.loadtxt, which is used if 
+    the block does not have the fixed-width layout.
+
+    Parameters
+    ----------
+    file : str | Path
+        the pdos file.
+
+    Returns
+    -------
+    NDArray
+        (n_energy, n_columns) including energy.
+    """
+    with open(file, "rb") as fp:
+        data = fp.read()
+    start = 0
+    while data.startswith(b"#", start): # skip header lines
+        start = data.find(b"\n", start) + 1
+    if not data.endswith(b"\n"):
+        data += b"\n"
+    try:
+        return _parse_fixed_width_table(data, start)
+    except ValueError:
+        with PROFILER.stage("pdos.loadtxt"):
+            return np.loadtxt(str(file), ndmin = 2)
+
+@profiled("pdos.read_pdos_files")
+def read_pdos_files(pdos_dir:str|Path, files:list[str], max_workers:int|None = None, executor:str = "thread"):
+    """read pdos files concurrently by read_pdos_file.
+
+    Parameters
+    ----------
+    pdos_dir : str | Path
+        the directory where pdos files are stored.
+    files : list[str]
+        names of pdos files.
+    max_workers : int | None, optional
+        the upper bound of the number of workers, by default None (min(8, os.cpu_count())).
+        If 1, files are read serially.
+    executor : str, optional
+        "thread" or "process", by default "thread".
+        numpy releases the GIL in the conversion, so threads also work in parallel.
+
+    Returns
+    -------
+    list[NDArray]
+        tables of the files.
+    """
+    if executor not in ["thread", "process"]:
+        raise ValueError(f"executor, {executor} is invalid.")
+    paths = [str(Path(pdos_dir)/file) for file in files]
+    max_workers = min(8, os.cpu_count() or 1) if max_workers is None else max_workers
+    if max_workers <= 1 or len(paths) <= 1:
+        return [read_pdos_file(path) for path in paths]
+    pool = ThreadPoolExecutor if executor == "thread" else ProcessPoolExecutor
+    with pool(max_workers = max_workers) as pool_executor:
+        return list(pool_executor.map(read_pdos_file, paths, chunksize = 1 if executor == "thread" else 16))
+
+def vectorized(func:Callable):
+    """mark a user-defined contribution function as vectorized.
+    
+    A vectorized function is called once as func(dos, energies) -> (n_orbitals,) values
+    where dos is (n_orbitals, n_energy) in the energy range and energies are relative to the Fermi energy.
+    Other functions are called for each orbital as func(dos_in_energy_range) -> float value.
+    
+    Example
+    -------
+    >>> @vectorized
+    ... def weight_below_fermi(dos, energies):
+    ...     return dos[:, energies < 0].sum(axis = -1)
+    """
+    func.vectorized = True
+    return func
+
+def broadened_dos(ek:NDArray, proj:NDArray|SparseProjections, energies:NDArray, degauss:float, 
+                  smearing:str = "gaussian", k_weights:NDArray|None = None, max_elements:int = 1 << 24):
+    """projected and total dos from energies and projections of bands.
+    
+        pdos_i(E) = sum_{k,n} w_k delta(E - e_nk) |<phi_i|psi_nk>|^2
+        dos(E)    = sum_{k,n} w_k delta(E - e_nk)
+    where delta is broadened by SMEARINGS[smearing]. k points are processed in chunks so that 
+    the (n_energy, n_states) matrix of delta functions has at most max_elements elements.
+
+    Parameters
+    ----------
+    ek : NDArray
+        (nk, nbnd) energies of bands.
+    proj : NDArray | SparseProjections
+        (nk, nbnd, natomwfc) projections.
+    energies : NDArray
+        (n_energy,) the energy grid in the same unit as ek.
+    degauss : float
+        the broadening width in the same unit as ek.
+    smearing : str, optional
+        "gaussian" or "lorentzian", by default "gaussian"
+    k_weights : NDArray | None, optional
+        (nk,) weights of k points, by default None (uniform weights whose sum is 2 as wk of pw.x for nspin = 1)
+    max_elements : int, optional
+        the upper bound of the size of the matrix of delta functions, by default 2**24
+
+    Returns
+    -------
+    tuple[NDArray, NDArray]
+        (n_energy, natomwfc) pdos and (n_energy,) dos.
+    """
+    if smearing not in SMEARINGS:
+        raise ValueError(f"smearing, {smearing} is invalid.")
+    nk, nbnd = ek.shape
+    natomwfc = proj.shape[2]
+    k_weights = np.full(nk, 2/nk) if k_weights is None else np.asarray(k_weights, dtype = np.float64)
+    pdos = np.zeros([len(energies), natomwfc])
+    dos = np.zeros(len(energies))
+    chunk_size = max(1, max_elements//max(1, len(energies)*nbnd))
+    for start in range(0, nk, chunk_size):
+        kpoints = np.arange(start, min(start + chunk_size, nk))
+        weights = np.repeat(k_weights[kpoints], nbnd)/degauss
+        delta = SMEARINGS[smearing]((energies[:,None] - ek[kpoints].ravel()[None,:])/degauss)*weights
+        proj_chunk = proj.select(kpoints = kpoints).todense() if isinstance(proj, SparseProjections) else proj[kpoints]
+        pdos += delta @ proj_chunk.reshape(-1, natomwfc)
+        dos += delta.sum(axis = 1)
+    return pdos, dos
+
+class PdosSet:
+    """projected dos of all pdos files in a directory.
+
+    Attributes
+    ----------
+    pdos_dir: Path
+        the directory where pdos files are stored.
+    files: list[str]
+        names of pdos files.
+    energies: NDArray
+        (n_energy,) the energy grid shared by all files.
+    data: NDArray
+        (n_files, n_energy, n_columns) columns of the files except energy, i.e., ldos, pdos(m=1), pdos(m=2), ...
+        Files with fewer columns (e.g. s orbitals) are padded with zeros.
+    n_columns: NDArray
+        (n_files,) the number of columns of each file except energy.
+    atom_indices, atom_names, wfc_indices, angular: NDArray
+        (n_files,) metadata parsed from the file names. Indices are those in the file names (Fortran index).
+    total: NDArray | None
+        (n_energy, 2) total dos and the sum of pdos like the pdos_tot file if they are computed, otherwise None.
+    """
+    def __init__(self, pdos_dir:str|Path, files:list[str], energies:NDArray, data:NDArray, n_columns:NDArray,
+                 total:NDArray|None = None):
+        self.pdos_dir = Path(pdos_dir)
+        self.total = total
+        self.files = list(files)
+        self.energies = energies
+        self.data = data
+        self.n_columns = np.asarray(n_columns, dtype = int)
+        matches = [re.search(PDOS_FILE_PATTERN, file) for file in self.files]
+        self.atom_indices = np.array([int(match.group(1)) for match in matches], dtype = int)
+        self.atom_names = np.array([match.group(2) for match in matches], dtype = str)
+        self.wfc_indices = np.array([int(match.group(3)) for match in matches], dtype = int)
+        self.angular = np.array([match.group(4) for match in matches], dtype = str)
+
+    @classmethod
+    @profiled("PdosSet.from_dir")
+    def from_dir(cls, pdos_dir:str|Path, files:list[str]|None = None, max_workers:int|None = None):
+        """load pdos files in a directory.
+
+        Parameters
+        ----------
+        pdos_dir : str | Path
+            the directory where pdos files are stored.
+        files : list[str] | None, optional
+            names of pdos files, by default None (found by find_pdos_files)
+        max_workers : int | None, optional
+            the upper bound of the number of threads to read files, by default None (see read_pdos_files).
+
+        Returns
+        -------
+        PdosSet
+        """
+        if files is None:
+            files = find_pdos_files(pdos_dir)[0]
+        return cls.read(pdos_dir, files, max_workers = max_workers)
+
+    @classmethod
+    def read(cls, pdos_dir:str|Path, files:list[str], max_workers:int|None = None):
+        """read pdos files by read_pdos_files.
+
+        Parameters
+        ----------
+        pdos_dir : str | Path
+            the directory where pdos files are stored.
+        files : list[str]
+            names of pdos files.
+        max_workers : int | None, optional
+            the upper bound of the number of threads, by default None (see read_pdos_files).
+
+        Raises
+        ------
+        ValueError
+            if energy grids of the files are different.
+        """
+        if not files:
+            return cls(pdos_dir, [], np.zeros(0), np.zeros([0, 0, 0]), np.zeros(0))
+        tables = read_pdos_files(pdos_dir, files, max_workers = max_workers)
+        energies = tables[0][:,0]
+        n_columns = np.array([table.shape[1] - 1 for table in tables])
+        data = np.zeros([len(files), len(energies), n_columns.max()])
+        for i, table in enumerate(tables):
+            if not np.array_equal(table[:,0], energies):
+                raise ValueError(f"the energy grid of {files[i]} is different from that of {files[0]}.")
+            data[i, :, :n_columns[i]] = table[:,1:]
+        return cls(pdos_dir, files, energies, data, n_columns)
+
+    def contributions(self, energy_range:list|None = None, contribution_type:str|Callable = "max", 
+                      fermi:float = 0, column:int = 0, group_by = None):
+        """contributions of files (orbitals) to dos in an energy range.
+        
+        Contribution types (see CONTRIBUTION_TYPES) are
+            "max"        : the maximum value of dos in the range.
+            "integral"   : the integral of dos in the range by Simpson's rule.
+            "mean"       : the mean value of dos in the range.
+            "centroid"   : the weighted centroid of energies in the range, sum E dos(E) / sum dos(E).
+            "band_center": the band center in the range, int E dos(E) dE / int dos(E) dE by Simpson's rule.
+        All orbitals are evaluated at once along the energy axis. A user-defined function is 
+        called for each orbital unless it is marked by vectorized.
+
+        Parameters
+        ----------
+        energy_range : list | None, optional
+            [emin, emax] relative to fermi, by default None (the whole grid)
+        contribution_type : str | Callable, optional
+            the type of contributions, by default "max"
+        fermi : float, optional
+            the Fermi energy, by default 0
+        column : int, optional
+            the column of self.data, by default 0 (ldos)
+        group_by : optional
+            if given, contributions of groups (see self.group_index) are evaluated from their summed dos.
+
+        Returns
+        -------
+        NDArray
+            (n_files,) or (n_groups,) contributions.
+        """
+        energies = self.energies - fermi
+        dos = self.data[:, :, column] if group_by is None else self.group_index(group_by)[1] @ self.data[:, :, column]
+        if energy_range:
+            window = (energy_range[0] <= energies) & (energies <= energy_range[1])
+            energies, dos = energies[window], dos[:, window]
+        if callable(contribution_type):
+            if getattr(contribution_type, "vectorized", False):
+                return np.asarray(contribution_type(dos, energies), dtype = np.float64)
+            return np.array([contribution_type(dos_i) for dos_i in dos], dtype = np.float64)
+        if contribution_type not in CONTRIBUTION_TYPES:
+            raise ValueError(f"contribution_type, {contribution_type} is invalid.")
+        if len(energies) == 0:
+            return np.zeros(len(dos))
+        return CONTRIBUTION_TYPES[contribution_type](dos, energies)
+
+    def prefix_index(self, column:int = 0):
+        """cumulative sums of dos on the energy grid, made once for each column.
+        
+        With them, the integral (or mean) of dos of all files in any window of the grid is 
+        a difference of two columns.
+
+        Returns
+        -------
+        tuple[NDArray, NDArray]
+            (n_files, n_energy) cumulative integrals by the trapezoidal rule and
+            (n_files, n_energy + 1) cumulative sums whose first column is 0.
+        """
+        if not hasattr(self, "_prefix_index"):
+            self._prefix_index = {}
+        if column not in self._prefix_index:
+            from scipy.integrate import cumulative_trapezoid
+            dos = self.data[:, :, column]
+            cumulative_integral = cumulative_trapezoid(dos, x = self.energies, axis = -1, initial = 0)
+            cumulative_sum = np.zeros([len(dos), len(self.energies) + 1])
+            np.cumsum(dos, axis = -1, out = cumulative_sum[:, 1:])
+            self._prefix_index[column] = (cumulative_integral, cumulative_sum)
+        return self._prefix_index[column]
+
+    def scan(self, windows:NDArray, contribution_type:str = "integral", fermi:float = 0, column:int = 0, group_by = None):
+        """contributions of files (orbitals) for many energy windows by self.prefix_index.
+        
+        Contribution types are
+            "integral": the integral of dos on grid points in a window by the trapezoidal rule.
+            "mean"    : the mean value of dos on grid points in a window.
+        NOTE: "integral" can be slightly different from that of self.contributions using Simpson's rule.
+
+        Parameters
+        ----------
+        windows : NDArray
+            (n_windows, 2) [emin, emax] relative to fermi. See also sliding_windows.
+        contribution_type : str, optional
+            "integral" or "mean", by default "integral"
+        fermi : float, optional
+            the Fermi energy, by default 0
+        column : int, optional
+            the column of self.data, by default 0 (ldos)
+        group_by : optional
+            if given, contributions of groups (see self.group_index) are evaluated.
+            They are sums of those of files since both types are linear in dos.
+
+        Returns
+        -------
+        tuple[NDArray, NDArray]
+            (n_windows, n_files) or (n_windows, n_groups) orders in descending contributions and the sorted contributions.
+        """
+        if contribution_type not in ["integral", "mean"]:
+            raise ValueError(f"contribution_type, {contribution_type} is invalid for scan.")
+        windows = np.asarray(windows, dtype = np.float64).reshape(-1, 2)
+        cumulative_integral, cumulative_sum = self.prefix_index(column)
+        energies = self.energies - fermi
+        # grid points in a window are [start, stop).
+        start = np.searchsorted(energies, windows[:, 0], side = "left")
+        stop = np.searchsorted(energies, windows[:, 1], side = "right")
+        num_points = np.maximum(stop - start, 0)
+        if contribution_type == "integral":
+            last = np.maximum(stop - 1, start).clip(max = max(len(energies) - 1, 0))
+            first = start.clip(max = max(len(energies) - 1, 0))
+            contributions = np.where(num_points > 1, cumulative_integral[:, last] - cumulative_integral[:, first], 0).T
+        else:
+            stop = np.maximum(stop, start)
+            contributions = ((cumulative_sum[:, stop] - cumulative_sum[:, start])/np.maximum(num_points, 1)).T
+        if group_by is not None:
+            contributions = contributions @ self.group_index(group_by)[1].T
+        orders = np.argsort(contributions, axis = 1)[:, ::-1] # the same order as sort_orbs_by_pdos_contribution.
+        return orders, np.take_along_axis(contributions, orders, axis = 1)
+
+    @staticmethod
+    def sliding_windows(emin:float, emax:float, width:float, step:float):
+        """windows of width in [emin, emax] shifted by step.
+
+        Returns
+        -------
+        NDArray
+            (n_windows, 2) [emin, emax] of windows.
+        """
+        num_windows = int(np.floor((emax - emin - width)/step + 1e-9)) + 1
+        starts = emin + step*np.arange(max(num_windows, 0))
+        return np.stack([starts, starts + width], axis = 1)
+
+    def group_index(self, by):
+        """the matrix summing files into groups.
+        
+        by is one of
+            "element", "atom" or "l"        : files with the same element, atom index or angular momentum.
+            a list of them, e.g. ["atom", "l"]: files with the same combination of them.
+            dict {site name: atom indices}  : user-defined sites. Indices are those in the file names.
+                                              Files of atoms not in any site are not summed.
+            a sequence of labels of files    : files with the same label.
+
+        Returns
+        -------
+        tuple[list, NDArray]
+            labels of groups (sorted except for sites) and (n_groups, n_files) matrix whose element is 1 
+            if the file is in the group, otherwise 0.
+        """
+        if isinstance(by, dict):
+            labels = list(by)
+            matrix = np.array([np.isin(self.atom_indices, atoms) for atoms in by.values()], dtype = np.float64)
+            return labels, matrix.reshape(len(labels), len(self.files))
+        keys = [by] if isinstance(by, str) else list(by)
+        if keys and all(isinstance(key, str) and key in GROUP_KEYS for key in keys):
+            file_labels = list(zip(*[getattr(self, GROUP_KEYS[key]).tolist() for key in keys]))
+            if len(keys) == 1:
+                file_labels = [label[0] for label in file_labels]
+        elif isinstance(by, str):
+            raise ValueError(f"group_by, {by} is invalid.")
+        else:
+            file_labels = keys
+        if len(file_labels) != len(self.files):
+            raise ValueError("the number of labels is not that of files.")
+        labels = sorted(set(file_labels))
+        group = {label: i for i, label in enumerate(labels)}
+        matrix = np.zeros([len(labels), len(self.files)])
+        matrix[[group[label] for label in file_labels], np.arange(len(self.files))] = 1
+        return labels, matrix
+
+    def grouped(self, by):
+        """dos summed over files in each group by one matrix product.
+
+        Parameters
+        ----------
+        by :
+            see self.group_index
+
+        Returns
+        -------
+        tuple[list, NDArray]
+            labels of groups and (n_groups, n_energy, n_columns) summed data.
+            NOTE: only the ldos (column 0) is meaningful if files of different l are summed.
+        """
+        labels, matrix = self.group_index(by)
+        return labels, np.tensordot(matrix, self.data, axes = 1)
+
+    @property
+    def ldos(self)->NDArray:
+        """(n_files, n_energy) ldos of each file.
+        """
+        return self.data[:,:,0]
@@ -0,0 +1,221 @@
+"""profiling
+
+This module contains a lightweight profiler recording wall time, the number of calls and
+the peak of allocated memory (by tracemalloc) of named stages of readers.
+
+The profiler is disabled by default, and stages cost only a check of PROFILER.enabled then.
+Stages may be nested. The peak memory of a stage is the largest memory allocated during the stage
+above the memory allocated at its start, and is recorded only for stages in the main thread.
+
+Example
+-------
+>>> PROFILER.enable()
+>>> ProjwfcOut("projwfc.out").read_projections()
+>>> print(PROFILER.report())
+"""
+import json
+import time
+import functools
+import threading
+import tracemalloc
+from pathlib import Path
+from contextlib import nullcontext
+from typing import Callable, Iterable
+
+_NULL_CONTEXT = nullcontext()
+
+class StageStats:
+    """statistics of a stage.
+
+    Attributes
+    ----------
+    calls: int
+        the number of runs of the stage.
+    time: float
+        the total wall time of runs in seconds.
+    peak_memory: int | None
+        the largest peak memory of runs in bytes (None if memory is not traced).
+    """
+    def __init__(self):
+        self.calls = 0
+        self.time = 0.0
+        self.peak_memory:int|None = None
+
+    def to_dict(self)->dict:
+        return dict(calls = self.calls, time = self.time, peak_memory = self.peak_memory)
+
+class _Stage:
+    """a context manager recording a run of a stage into a profiler.
+    """
+    __slots__ = ("profiler", "name", "start", "start_memory", "max_memory", "trace")
+
+    def __init__(self, profiler:"Profiler", name:str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        profiler = self.profiler
+        self.trace = profiler.memory and tracemalloc.is_tracing() and threading.current_thread() is threading.main_thread()
+        if self.trace:
+            current, peak = tracemalloc.get_traced_memory()
+            stack = profiler._memory_stack
+            if stack:
+                # the peak before this stage belongs to the outer stage.
+                stack[-1].max_memory = max(stack[-1].max_memory, peak)
+            tracemalloc.reset_peak()
+            self.start_memory = self.max_memory = current
+            stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        elapsed = time.perf_counter() - self.start
+        profiler = self.profiler
+        peak_memory = None
+        stack = profiler._memory_stack
+        # the stack is cleared if the profiler is disabled during the stage.
+        if self.trace and stack and stack[-1] is self:
+            _, peak = tracemalloc.get_traced_memory()
+            self.max_memory = max(self.max_memory, peak)
+            stack.pop()
+            if stack:
+                stack[-1].max_memory = max(stack[-1].max_memory, self.max_memory)
+            peak_memory = self.max_memory - self.start_memory
+        profiler._record(self.name, elapsed, peak_memory)
+        return False
+
+class Profiler:
+    """record statistics of named stages.
+
+    Attributes
+    ----------
+    enabled: bool
+        whether stages are recorded.
+    memory: bool
+        whether peak memory of stages is recorded by tracemalloc.
+    stats: dict[str, StageStats]
+        statistics of stages in the order of their first runs.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.memory = False
+        self.stats:dict[str, StageStats] = {}
+        self._memory_stack:list[_Stage] = []
+        self._started_tracing = False
+        self._lock = threading.Lock()
+
+    def enable(self, memory:bool = True):
+        """start recording stages.
+
+        Parameters
+        ----------
+        memory : bool, optional
+            whether peak memory is recorded, by default True.
+            tracemalloc is started if it is not tracing, which slows down allocations.
+        """
+        self.enabled = True
+        self.memory = memory
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    def disable(self):
+        """stop recording stages. Recorded statistics are kept.
+        """
+        self.enabled = False
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        self._memory_stack.clear()
+
+    def reset(self):
+        """remove recorded statistics.
+        """
+        with self._lock:
+            self.stats = {}
+
+    def stage(self, name:str):
+        """a context manager recording the block as a run of a stage.
+
+        Parameters
+        ----------
+        name : str
+            the name of the stage, by convention "{class or module}.{stage}".
+        """
+        if not self.enabled:
+            return _NULL_CONTEXT
+        return _Stage(self, name)
+
+    def _record(self, name:str, elapsed:float, peak_memory:int|None):
+        with self._lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = StageStats()
+            stats.calls += 1
+            stats.time += elapsed
+            if peak_memory is not None:
+                stats.peak_memory = peak_memory if stats.peak_memory is None else max(stats.peak_memory, peak_memory)
+
+    def to_dict(self)->dict[str, dict]:
+        """statistics of stages as dicts of calls, time (s) and peak_memory (bytes).
+        """
+        return {name: stats.to_dict() for name, stats in self.stats.items()}
+
+    def report(self)->str:
+        """a table of statistics of stages.
+        """
+        lines = ["{:<36s} {:>8s} {:>12s} {:>12s} {:>12s}".format("stage", "calls", "time [s]", "mean [ms]", "peak [MiB]")]
+        for name, stats in self.stats.items():
+            peak = "-" if stats.peak_memory is None else f"{stats.peak_memory/2**20:12.3f}"
+            lines.append("{:<36s} {:>8d} {:12.4f} {:12.4f} {:>12s}".format(name, stats.calls, stats.time,
+                                                                            1e3*stats.time/stats.calls, peak))
+        return "\n".join(lines)
+
+    def dump(self, file:str|Path):
+        """write statistics of stages to a json file.
+        """
+        with open(file, "w") as fp:
+            json.dump(self.to_dict(), fp, indent = 2)
+
+PROFILER = Profiler()
+
+def stage(name:str):
+    """a context manager recording the block as a run of a stage of PROFILER.
+
+    Example
+    -------
+    >>> with stage("Filband.read"):
+    ...     read()
+    """
+    return PROFILER.stage(name)
+
+def profiled(name:str):
+    """a decorator recording calls of a function as runs of a stage of PROFILER.
+    """
+    def decorator(func:Callable):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not PROFILER.enabled:
+                return func(*args, **kwargs)
+            with _Stage(PROFILER, name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def profiled_iter(iterable:Iterable, name:str):
+    """an iterator recording each step of iterable (e.g. a generator) as a run of a stage of PROFILER.
+
+    If PROFILER is disabled, iterable is returned as it is.
+    """
+    if not PROFILER.enabled:
+        return iterable
+    return _profiled_iter(iter(iterable), name)
+
+def _profiled_iter(iterator, name:str):
+    while True:
+        with _Stage(PROFILER, name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
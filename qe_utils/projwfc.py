@@ -8,15 +8,24 @@ intuition about initial guess of Wannierization.
 
 import os
 import numpy as np
-import scipy.integrate as integrate
+from numpy.typing import NDArray
 import re
 import tomllib
 import itertools
+import mmap
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
-import matplotlib.pyplot as plt
 from typing import Iterable, Callable
 
 from qe_utils.pwx_in import PWxIn
+from qe_utils.bands import EnergyIndex
+from qe_utils.cache import ArrayCache
+from qe_utils.sparse_proj import SparseProjections, OrbitalIndex
+from qe_utils.pdos import PdosSet, find_pdos_files, broadened_dos
+from qe_utils.wannier import ProjectionSearch
+from qe_utils.profiling import PROFILER, profiled, profiled_iter
+from qe_utils.fixed_width import parse_reals, parse_ints
 
 class ProjwfcIn:  #TODO: make a super class for reading input.
     """parse projwfc.x input files.
@@ -49,31 +58,123 @@ class ProjwfcOut:
     """treat information in output files of projwfc.x
     #TODO: test this works for all output files.
     
+    Nothing is read in the constructor. Attributes are computed at the first access by stages
+        header     : problem sizes and atomic states (or all arrays in the cache) by self._read
+        projections: self.k, self.ek and self.proj by self.read_projections
+        pdos_files : names of pdos files in pdos_dir by self.get_pdos_files
+        labels     : self.orbitals and self.pdos_labels by self.get_relation_orbital_vs_pdosfile
+    and names of stages which ran are appended to self.stages when they succeed.
+    If a stage fails, it runs again at the next access.
+    
     Attributes
     ----------
     nkstot: int
         the total number of k points for all spins
+    stages: list[str]
+        stages which ran in order.
     """
+    # attribute -> the stage computing it.
+    _lazy_stages = {
+        **{name: "header" for name in ["natomwfc", "nbnd", "nkstot", "npwx", "nkb", "_nk", "start_projection_block", 
+                                       "start_projection_offset", "iatom", "wfc", "elements", "_l", "_m", "_j", "_m_j", "proj_read",
+                                       "_lowdin_charges", "_spilling_parameter"]},
+        **{name: "projections" for name in ["k", "ek", "proj"]},
+        **{name: "pdos_files" for name in ["pdos_files", "atom_indices", "atom_names", "wfc_indices", "angular"]},
+        **{name: "labels" for name in ["_orbitals", "pdos_labels"]},
+    }
+    
     def __init__(self, projwfc_out_file:str, pdos_dir = "./",
                  fermi:float|None = None,
                  pwxin:PWxIn|None = None,
-                 nproc:int|None = int,
+                 nproc:int|None = None,
+                 engine:str = "bulk",
+                 cache:ArrayCache|bool|None = None,
+                 sparse:bool = False,
+                 filproj:str|None = None,
                  ):
+        """
+        Parameters
+        ----------
+        projwfc_out_file : str
+            the output file of projwfc.x
+        pdos_dir : str, optional
+            the directory where pdos files are stored, by default "./"
+        fermi : float | None, optional
+            the Fermi energy, by default None
+        pwxin : PWxIn | None, optional
+            PWxIn corresponding to outdir/prefix in the input of projwfc.x, by default None
+        nproc : int | None, optional
+            the number of processes to parse k blocks, by default None (serial).
+        engine : str, optional
+            the parser of projections, by default "bulk".
+            "bulk" parses the projection section as bytes with numpy (by self.read_all in 
+            serial, which also reads Lowdin charges in the same pass) and
+            "regex" parses each line with regular expressions.
+            If "bulk" fails to parse the file, "regex" is used instead.
+        cache : ArrayCache | bool | None, optional
+            cache of parsed arrays, by default None (not cached).
+            If True, ArrayCache() storing arrays next to projwfc_out_file is used.
+            If a valid cache exists, the output file is not parsed.
+        sparse : bool, optional
+            whether self.proj is stored as SparseProjections, by default False.
+            Only projectability printed by projwfc.x are stored, so that memory 
+            scales with the number of printed values instead of nk*nbnd*natomwfc.
+        filproj : str | None, optional
+            the filproj file written by projwfc.x, by default None.
+            If the file exists, projections are read from it by self.read_filproj
+            instead of parsing the projections in projwfc_out_file.
+        """
+        self._running_stages:set[str] = set()
+        self.stages:list[str] = []
         self.fermi = fermi
         self.pwxin = pwxin
+        self.nproc = nproc # the number of processes to parse k blocks. serial if None or 1.
+        if engine not in ["bulk", "regex"]:
+            raise ValueError(f"engine, {engine} is invalid.")
+        self.engine = engine
         if not os.path.isfile(projwfc_out_file):
             raise FileNotFoundError("projwfc output file, {} is not found.".format(projwfc_out_file))
         self.projwfc_out_file = projwfc_out_file
         self.pdos_dir = pdos_dir
         
-        self.proj_read = False
-        
-        self._read()
-        self.get_pdos_files()
-        self.get_relation_orbital_vs_pdosfile()
+        self.cache = ArrayCache() if cache is True else (cache if cache else None)
+        self.sparse = sparse
+        self.filproj = filproj
         # TODO: add methods to check collinear
         self.non_collin = False
         
+    def __getattr__(self, name:str):
+        """run the stage computing name at the first access. See the docstring of this class.
+        """
+        stage = type(self)._lazy_stages.get(name)
+        # a stage succeeds only once. Attributes which the stage did not set (or sets later) are missing as usual.
+        if stage is None or "stages" not in self.__dict__ or stage in self.stages or stage in self._running_stages:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+        if stage == "header":
+            with self._running("header"), PROFILER.stage("ProjwfcOut.header"):
+                self.proj_read = False
+                if not self._load_cache():
+                    self._read()
+        elif stage == "projections":
+            self.read_projections()
+        elif stage == "pdos_files":
+            self.get_pdos_files()
+        elif stage == "labels":
+            self.get_relation_orbital_vs_pdosfile()
+        return object.__getattribute__(self, name)
+    
+    @contextmanager
+    def _running(self, stage:str):
+        """run stage in the with block, which is appended to self.stages if the block succeeds.
+        """
+        self._running_stages.add(stage)
+        try:
+            yield
+        finally:
+            self._running_stages.discard(stage)
+        if stage not in self.stages:
+            self.stages.append(stage)
+        
     @property
     def fermi(self):
         return self._fermi
@@ -102,25 +203,198 @@ class ProjwfcOut:
     
     @nk.setter
     def nk(self, nkstot:int):
-        """since nkstot = 2*total_k, it is divided by 2.
+        """projwfc.x prints one k block for each of nkstot k points (for all spins).
         """
-        self._nk = int(nkstot/2)
+        self._nk = int(nkstot)
         
+    @profiled("ProjwfcOut.read_header")
     def _read(self):
-        """parse the output of projwfc.x
+        """parse the header of the output of projwfc.x
         
-        FIXME: judge block from line may be ugly. 
+        Projections are read by read_projections. 
         """
         with open(self.projwfc_out_file) as fp:
-            for line_index, line in enumerate(fp):
-                if "Problem Sizes" in line:
-                    self.read_problem_size(fp)
-                if "Atomic states used for projection" in line:
-                    # self.projection_block_line is the index of line where "k = ..." first appears in the file.
-                    self.start_projection_block = line_index + self.natomwfc + 9 # 5 for problem size and 4 for additional lines
-                    self.read_atomic_states(fp)
-                # TODO: read Lowdin Charges
+            self._read_header(fp)
+            
+    def _read_header(self, fp):
+        """read Problem Sizes and Atomic states and stop before the first k block.
+        
+        FIXME: judge block from line may be ugly. 
+        """
+        line_index = 0
+        # fp is read by readline (not by iteration) so that fp.tell() is available.
+        while line := fp.readline():
+            if "Problem Sizes" in line:
+                self.read_problem_size(fp)
+            if "Atomic states used for projection" in line:
+                # self.projection_block_line is the index of line where "k = ..." first appears in the file.
+                self.start_projection_block = line_index + self.natomwfc + 9 # 5 for problem size and 4 for additional lines
+                self.read_atomic_states(fp)
+                # the byte offset after the atomic states, from which read_all reads k blocks.
+                self.start_projection_offset = fp.tell()
+                break
+            line_index += 1
+                
+    @profiled("ProjwfcOut.read_all")
+    def read_all(self, chunk_size:int = 1 << 24):
+        """parse all sections of the output of projwfc.x in one sequential read.
+        
+        The file is read as
+            header      : Problem Sizes and Atomic states by lines (only if they are not parsed yet).
+            projections : chunks of chunk_size bytes from self.start_projection_offset. Complete k blocks in each chunk are 
+                          parsed by _parse_projection_bytes and the last incomplete block
+                          is carried over to the next chunk.
+            lowdin      : Lowdin Charges and Spilling Parameter by lines.
+        If the projections cannot be parsed, ValueError is raised and the two-pass 
+        path (self._read and self._read_projections) should be used instead.
+
+        Parameters
+        ----------
+        chunk_size : int, optional
+            the size of a chunk of the projection section, by default 16 MiB
+        """
+        # the header is parsed (or loaded from the cache) only once.
+        offset = self.start_projection_offset
+        with open(self.projwfc_out_file, "rb") as fp:
+            fp.seek(offset)
+            self._init_projections()
+            ik = 0
+            buffer = bytearray()
+            state = "projections"
+            while state == "projections":
+                chunk = fp.read(chunk_size)
+                # search "Lowdin Charges" only around the new chunk.
+                search_start = max(0, len(buffer) - len(b"Lowdin Charges"))
+                buffer += chunk
+                end = buffer.find(b"Lowdin Charges", search_start)
+                if end >= 0:
+                    last, state = end, "lowdin"
+                elif not chunk:
+                    last, state = len(buffer), "lowdin"
+                else:
+                    # the last k block may continue in the next chunk.
+                    last = buffer.rfind(b"\n k = ") + 1
+                start = buffer.find(b" k = ", 0, last)
+                if start >= 0:
+                    with memoryview(buffer) as view:
+                        k, ek, proj = _parse_projection_bytes(view[start:last], None, 
+                                                              self.nbnd, self.natomwfc, self.sparse)
+                    if ik + len(k) > self.nk:
+                        raise ValueError(f"the number of k blocks exceeds nkstot ({self.nk}).")
+                    self._store_projections(ik, k, ek, proj)
+                    ik += len(k)
+                # the buffer keeps only the incomplete k block (or the Lowdin charges).
+                del buffer[:last]
+            if ik != self.nk:
+                raise ValueError(f"the number of k blocks ({ik}) is not nkstot ({self.nk}).")
+            self._finalize_projections()
+            self.proj_read = True
+            self.read_lowdin_charges(itertools.chain(buffer.decode().splitlines(), (line.decode() for line in fp)))
+            
+    def read_lowdin_charges(self, lines:Iterable[str]):
+        """read Lowdin Charges and Spilling Parameter.
+        
+        Lines of an atom such as
+            Atom #   1: total charge =   3.9509, p =  3.0398, pz=  0.9822, px=  1.0300, py=  1.0275, 
+        are merged into self.lowdin_charges[0] = {"total charge": 3.9509, "p": 3.0398, "pz": 0.9822, ...}.
+
+        Parameters
+        ----------
+        lines : Iterable[str]
+            lines from "Lowdin Charges" (or before it) to the end of the file.
+        """
+        self._lowdin_charges = {}
+        self._spilling_parameter = None
+        for line in lines:
+            if "Atom #" in line:
+                atom, values = line.split(":", 1)
+                charges = self._lowdin_charges.setdefault(int(atom.split("#")[1]) - 1, {}) # Fortran index to python index
+                for key, value in re.findall(r"([A-Za-z][\w\- ]*?)\s*=\s*(-?[0-9.]+)", values):
+                    charges[key] = float(value)
+            elif "Spilling Parameter" in line:
+                self._spilling_parameter = float(line.split(":")[1])
+                break
+            
+    @property
+    def lowdin_charges(self)->dict[int, dict[str, float]]:
+        """Lowdin charges of each atom (python index) read from the end of the file.
+        """
+        if not hasattr(self, "_lowdin_charges"):
+            with open(self.projwfc_out_file, "rb") as fp, mmap.mmap(fp.fileno(), 0, access = mmap.ACCESS_READ) as mm:
+                start = mm.rfind(b"Lowdin Charges")
+                lines = mm[start:].decode().splitlines() if start >= 0 else []
+            self.read_lowdin_charges(lines)
+        return self._lowdin_charges
+    
+    @property
+    def spilling_parameter(self)->float|None:
+        """Spilling Parameter. None if it is not printed.
+        """
+        self.lowdin_charges
+        return self._spilling_parameter
                     
+    # attributes stored in the cache. 
+    _cached_sizes = ["natomwfc", "nbnd", "nkstot", "npwx", "nkb", "start_projection_block", "start_projection_offset"]
+    _cached_arrays = ["iatom", "wfc", "elements", "l", "m", "j", "m_j", "k", "ek", "proj"]
+    
+    @profiled("ProjwfcOut.load_cache")
+    def _load_cache(self):
+        """load parsed arrays from self.cache.
+
+        Returns
+        -------
+        bool
+            whether arrays are loaded from the cache.
+        """
+        if not self.cache:
+            return False
+        cached = self.cache.load(self.projwfc_out_file, dependencies = self._cache_dependencies())
+        if cached is None:
+            return False
+        arrays, sizes = cached
+        for name in self._cached_sizes:
+            setattr(self, name, sizes[name])
+        if "lowdin_charges" in sizes:
+            self._lowdin_charges = {iatom: charges for iatom, charges in sizes["lowdin_charges"]}
+            self._spilling_parameter = sizes["spilling_parameter"]
+        self.nk = self.nkstot
+        for name, array in arrays.items():
+            if name.startswith("proj_"):
+                continue
+            # l, m, j, m_j are properties whose values are stored in _l, _m, ...
+            setattr(self, f"_{name}" if name in ["l", "m", "j", "m_j"] else name, array)
+        if "proj_value" in arrays:
+            self.proj = SparseProjections(*[arrays[f"proj_{name}"] for name in ["ik", "ibnd", "iwfc", "value"]],
+                                          (self.nk, self.nbnd, self.natomwfc), sort = False)
+            if not self.sparse:
+                self.proj = self.proj.todense()
+        elif self.sparse:
+            self.proj = SparseProjections.from_dense(self.proj)
+        self.proj_read = True
+        return True
+    
+    @profiled("ProjwfcOut.save_cache")
+    def _save_cache(self):
+        """save parsed arrays to self.cache.
+        """
+        if not self.cache:
+            return
+        arrays = {name: getattr(self, name) for name in self._cached_arrays 
+                  if name not in ["j", "m_j"] or self.soc}
+        if self.sparse:
+            del arrays["proj"]
+            arrays.update({f"proj_{name}": getattr(self.proj, name) for name in ["ik", "ibnd", "iwfc", "value"]})
+        data = {name: getattr(self, name) for name in self._cached_sizes}
+        if hasattr(self, "_lowdin_charges"):
+            data["lowdin_charges"] = [[iatom, charges] for iatom, charges in self._lowdin_charges.items()]
+            data["spilling_parameter"] = self._spilling_parameter
+        self.cache.save(self.projwfc_out_file, arrays, data, dependencies = self._cache_dependencies())
+    
+    def _cache_dependencies(self)->list[str]:
+        """files other than projwfc_out_file from which cached arrays are obtained (filproj if it exists).
+        """
+        return [self.filproj] if self.filproj and os.path.isfile(self.filproj) else []
+                
     def read_problem_size(self,fp):
         """read Problem Sizes block.
 
@@ -135,7 +409,7 @@ class ProjwfcOut:
         self.npwx     = int(fp.readline().split()[2])
         self.nkb      = int(fp.readline().split()[2])
         
-        self.nk = self.nkstot # automatically divided by 2. See the setter of nk
+        self.nk = self.nkstot # See the setter of nk
                 
     def read_atomic_states(self,fp):
         """ read correspondance between states and orbits.
@@ -146,12 +420,19 @@ class ProjwfcOut:
             _description_
         """
         self.iatom = np.zeros(self.natomwfc,dtype=int)
+        self.wfc = np.zeros(self.natomwfc,dtype=int) # the index of the atomic wave function of the atom (Fortran index).
+        self.elements = np.zeros(self.natomwfc,dtype="<U3")
         
         fp.readline()
         fp.readline()
         for istate in range(self.natomwfc): #istate is state in output file - 1 
             #TODO: check that space in line appears at same position in any case.
-            line = fp.readline().split()
+            line = fp.readline()
+            match = re.search(r"\((.{1,3})\), wfc\s*([0-9]+)", line)
+            if match:
+                self.elements[istate] = match.group(1).strip()
+                self.wfc[istate] = int(match.group(2))
+            line = line.split()
             
             self.iatom[istate] = int(line[4]) - 1 # Fortran index to python index
             self.l[istate] = int(re.search(r"[0-9\.]+",line[9]).group())
@@ -168,49 +449,398 @@ class ProjwfcOut:
                                           {} 
                                           is not implemented.""".format(line))
                 
-    def read_projections(self):
+    @profiled("ProjwfcOut.read_projections")
+    def read_projections(self, kpoints:Iterable[int]|None = None, bands:Iterable[int]|None = None):
         """read projections.
         This method must be executed once to obtain the projections of bands.
+        
+        If kpoints or bands are given, only the projections of them are read from the file 
+        by self.read_kpoints without reading the others.
+
+        Parameters
+        ----------
+        kpoints : Iterable[int] | None, optional
+            indices of k points, by default None (all k points)
+        bands : Iterable[int] | None, optional
+            indices of bands, by default None (all bands)
+
+        Returns
+        -------
+        NDArray | SparseProjections
+            projections whose shape is (num_kpoints, num_bands, natomwfc)
         """
+        if kpoints is not None or bands is not None:
+            if self.proj_read:
+                return self.get_projections(kpoints = kpoints, bands = bands)
+            return self.read_kpoints(kpoints, bands)[2]
         if not self.proj_read:
-            with open(self.projwfc_out_file) as fp:
-                self._read_projections(fp, self.start_projection_block)
+            with self._running("projections"):
+                if self.filproj and os.path.isfile(self.filproj):
+                    try:
+                        self.read_filproj()
+                    except ValueError as e:
+                        print(f"warning: {e} projections are read from {self.projwfc_out_file}.")
+                if not self.proj_read and self.engine == "bulk":
+                    try:
+                        if self.nproc and self.nproc > 1:
+                            self._read_projections_bulk()
+                        else:
+                            self.read_all()
+                    except ValueError as e:
+                        print(f"warning: {e} projections are read by the regex parser.")
+                if not self.proj_read:
+                    with open(self.projwfc_out_file) as fp:
+                        self._read_projections(fp, self.start_projection_block)
+                self._save_cache()
         return self.proj
+    
+    @profiled("ProjwfcOut.read_projections_bulk")
+    def _read_projections_bulk(self):
+        """read projectability from the projection section of the file at once.
         
-    def _read_projections(self, fp, start_index:int|None = None):
-        """read projectability for each k and e(k).
+        The section from the first " k = " line to "Lowdin Charges" is read as bytes 
+        and parsed by _parse_projection_bytes without per-line python work.
+        If self.nproc > 1, the section is split at k lines and parsed in a process pool.
+        """
+        with open(self.projwfc_out_file, "rb") as fp:
+            data = fp.read()
+        start, end = _find_projection_section(data)
+        section = memoryview(data)[start:end]
+        if self.nproc and self.nproc > 1:
+            self._init_projections()
+            kpos = _find_kpoint_lines(np.frombuffer(section, dtype=np.uint8))
+            if len(kpos) != self.nk:
+                raise ValueError(f"the number of k blocks ({len(kpos)}) is not nkstot ({self.nk}).")
+            bounds = np.append(kpos[::max(1, -(-len(kpos)//(4*self.nproc)))], len(section))
+            with ProcessPoolExecutor(max_workers=self.nproc) as executor:
+                futures = [executor.submit(_parse_projection_bytes, bytes(section[bounds[i]:bounds[i+1]]), 
+                                           None, self.nbnd, self.natomwfc, self.sparse) for i in range(len(bounds) - 1)]
+                ik = 0
+                for future in futures:
+                    k, ek, proj = future.result()
+                    self._store_projections(ik, k, ek, proj)
+                    ik += len(k)
+            self._finalize_projections()
+        else:
+            self.k, self.ek, self.proj = _parse_projection_bytes(section, self.nk, self.nbnd, self.natomwfc, self.sparse)
+        self.proj_read = True
         
-        NOTE: by fp.readline()
+    def iter_projections(self):
+        """iterate over k points and yield projections at each k point.
         
-        This method first read a block containing the projectability of bands at a k point.
-        Then each k block are read in more detail and the projectability of each k point
-        are obtained in multiprocess calculations.
+        If projections are not read yet, k blocks are read one by one by self._get_kblocks,
+        so that memory does not depend on the number of k points.
+
+        Yields
+        ------
+        tuple[int, NDArray, NDArray, NDArray]
+            ik, k point, energies (nbnd,) and projections (nbnd, natomwfc) at the k point.
+        """
+        if self.proj_read:
+            for ik in range(self.nk):
+                proj_k = self.proj.select(kpoints = [ik]).todense()[0] if self.sparse else self.proj[ik]
+                yield ik, self.k[ik], self.ek[ik], proj_k
+            return
+        with open(self.projwfc_out_file) as fp:
+            kblocks = self._get_kblocks(itertools.islice(fp, self.start_projection_block, None))
+            for ik, kblock in enumerate(kblocks):
+                try:
+                    k, ek, proj = _parse_projection_bytes("".join(kblock).encode(), 1, self.nbnd, self.natomwfc)
+                    k, ek, proj = k[0], ek[0], proj[0]
+                except ValueError:
+                    k, ek, proj = self._get_projectability_at_a_kpoint(kblock)
+                yield ik, k, ek, proj
+                
+    def reduce(self, *reducers):
+        """compute aggregates of projections by streaming k points.
+        
+        See qe_utils.reducers for available reducers.
+
+        Parameters
+        ----------
+        reducers : Reducer
+            reducers updated at each k point.
+
+        Returns
+        -------
+        list
+            results of the reducers.
+        """
+        for reducer in reducers:
+            reducer.setup(self)
+        for ik, k, ek, proj_k in self.iter_projections():
+            for reducer in reducers:
+                reducer.update(ik, k, ek, proj_k)
+        return [reducer.result() for reducer in reducers]
+    
+    @property
+    def kpoint_index(self):
+        """byte offsets of k blocks and band headers in the output of projwfc.x.
+        
+        dict with keys
+            kpoints : (nk + 1,) offsets of " k = " lines and the end of the projection section.
+            bands   : (nk, nbnd) offsets of "==== e(...) = ... eV ====" lines.
+        The index is made by one pass of the file and stored in self.cache if it is given.
+        """
+        if not hasattr(self, "_kpoint_index"):
+            cached = self.cache.load(self.projwfc_out_file, kind = "kindex") if self.cache else None
+            if cached is None:
+                self._kpoint_index = self.build_kpoint_index()
+                if self.cache:
+                    self.cache.save(self.projwfc_out_file, self._kpoint_index, kind = "kindex")
+            else:
+                self._kpoint_index = cached[0]
+        return self._kpoint_index
+    
+    def build_kpoint_index(self, chunk_size:int = 1 << 26):
+        """make the byte-offset index of k blocks and band headers by one pass of the file.
+
+        Parameters
+        ----------
+        chunk_size : int, optional
+            the size of a chunk of the file scanned at once, by default 64 MiB
+
+        Returns
+        -------
+        dict
+            see self.kpoint_index
+        """
+        with open(self.projwfc_out_file, "rb") as fp, mmap.mmap(fp.fileno(), 0, access = mmap.ACCESS_READ) as mm:
+            start, end = _find_projection_section(mm)
+            kpoints, bands = [], []
+            for chunk_start in range(start, end, chunk_size):
+                # 8 bytes overlap to find patterns on chunk boundaries.
+                chunk = np.frombuffer(mm[chunk_start:min(chunk_start + chunk_size + 8, end)], dtype = np.uint8)
+                kpos = _find_kpoint_lines(chunk)
+                hpos = np.flatnonzero(chunk[:-1] == ord("("))
+                hpos = hpos[(hpos >= 6) & (chunk[hpos - 1] == ord("e"))]
+                # " k = " starts 1 byte before "k" and "==== e(" starts 6 bytes before "(".
+                kpoints.append(kpos[kpos - 1 < chunk_size] - 1 + chunk_start)
+                bands.append(hpos[hpos - 6 < chunk_size] - 6 + chunk_start)
+        kpoints = np.unique(np.concatenate(kpoints)) if kpoints else np.zeros(0, dtype = np.int64)
+        bands = np.unique(np.concatenate(bands)) if bands else np.zeros(0, dtype = np.int64)
+        if len(kpoints) != self.nk or len(bands) != self.nk*self.nbnd:
+            raise ValueError(f"the numbers of k blocks ({len(kpoints)}) and bands ({len(bands)}) are inconsistent with nkstot and nbnd.")
+        return dict(kpoints = np.append(kpoints, end), bands = bands.reshape(self.nk, self.nbnd))
+    
+    @profiled("ProjwfcOut.read_kpoints")
+    def read_kpoints(self, kpoints:Iterable[int]|None = None, bands:Iterable[int]|None = None):
+        """read k points, energies and projections of selected k points and bands.
+        
+        Blocks of selected k points and bands are taken from the memory-mapped file 
+        by self.kpoint_index and only they are parsed.
+
+        Parameters
+        ----------
+        kpoints : Iterable[int] | None, optional
+            indices of k points, by default None (all k points)
+        bands : Iterable[int] | None, optional
+            indices of bands, by default None (all bands)
+
+        Returns
+        -------
+        tuple[NDArray, NDArray, NDArray | SparseProjections]
+            k points, energies and projections whose shapes are 
+            (num_kpoints, 3), (num_kpoints, num_bands), (num_kpoints, num_bands, natomwfc).
+            Projections are SparseProjections if self.sparse is True (then indices in bands must be unique).
+        """
+        kpoints = np.arange(self.nk) if kpoints is None else np.asarray(kpoints, dtype = int).ravel()
+        band_indices = np.arange(self.nbnd) if bands is None else np.asarray(bands, dtype = int).ravel()
+        index = self.kpoint_index
+        with open(self.projwfc_out_file, "rb") as fp, mmap.mmap(fp.fileno(), 0, access = mmap.ACCESS_READ) as mm:
+            pieces = []
+            for ik in kpoints:
+                if bands is None:
+                    pieces.append(mm[index["kpoints"][ik]:index["kpoints"][ik + 1]])
+                    continue
+                # the k line and the selected band blocks.
+                band_end = np.append(index["bands"][ik, 1:], index["kpoints"][ik + 1])
+                pieces.append(mm[index["kpoints"][ik]:index["bands"][ik, 0]])
+                pieces += [mm[index["bands"][ik, ibnd]:band_end[ibnd]] for ibnd in band_indices]
+        k, ek, proj = _parse_projection_bytes(b"".join(pieces), len(kpoints), self.nbnd, self.natomwfc, self.sparse)
+        if self.sparse:
+            return k, ek[:, band_indices], proj.select(bands = None if bands is None else band_indices)
+        return k, ek[:, band_indices], proj[:, band_indices]
+    
+    @profiled("ProjwfcOut.read_filproj")
+    def read_filproj(self, filproj:str|None = None):
+        """read projections from the filproj file written by projwfc.x.
+        
+        The file consists of the header of the calculation, a line of natomwfc, nkstot and nbnd, 
+        a line of noncolin and lspinorb, and blocks of atomic states
+            nwfc, atom, element, label, n, l, m (or j, m_j)   (2i5,a3,3x,a2,...)
+            ik, ibnd, projectability                          (2i8,f20.10) for all k points and bands
+        Each block is read at once by fixed-width numpy conversion. The sizes and the states are
+        checked with those in projwfc_out_file. The file does not contain k points and energies, 
+        so they are read from band headers of projwfc_out_file by self.kpoint_index.
+        
+        NOTE: projectability in the file is not rounded nor cut by the threshold of the output.
+
+        Parameters
+        ----------
+        filproj : str | None, optional
+            the filproj file, by default None (self.filproj)
+        """
+        filproj = self.filproj if filproj is None else filproj
+        with open(filproj, "rb") as fp:
+            data = fp.read()
+        sizes = f"{self.natomwfc:8d}{self.nkstot:8d}{self.nbnd:8d}".encode()
+        start = data.find(b"\n" + sizes + b"\n")
+        if start < 0:
+            raise ValueError(f"natomwfc, nkstot and nbnd in {filproj} are not those in {self.projwfc_out_file}.")
+        pos = data.find(b"\n", start + len(sizes) + 2) + 1 # skip the line of noncolin and lspinorb.
+        
+        row = 37 # (2i8,f20.10) and a newline
+        nrows = self.nkstot*self.nbnd
+        proj = np.zeros([self.natomwfc, nrows])
+        iatom, l, m = [np.zeros(self.natomwfc, dtype = int) for _ in range(3)]
+        for istate in range(self.natomwfc):
+            end = data.find(b"\n", pos)
+            line = data[pos:end].decode()
+            iatom[istate] = int(line[5:10]) - 1 # Fortran index to python index
+            quantum_numbers = line[13:].split() # label, n, l, m (and spin) or label, n, l, j, m_j
+            l[istate] = int(quantum_numbers[2])
+            m[istate] = 0 if self.soc else int(quantum_numbers[3])
+            block = np.frombuffer(data, dtype = np.uint8, count = nrows*row, offset = end + 1).reshape(nrows, row)
+            if np.any(block[:, -1] != ord("\n")) or int(bytes(block[-1, :8])) != self.nkstot or int(bytes(block[-1, 8:16])) != self.nbnd:
+                raise ValueError(f"the block of state {istate + 1} in {filproj} is broken.")
+            proj[istate] = parse_reals(block[:, 16:36])
+            pos = end + 1 + nrows*row
+        if not (np.array_equal(iatom, self.iatom) and np.array_equal(l, self.l) and (self.soc or np.array_equal(m, self.m))):
+            raise ValueError(f"atomic states in {filproj} are not those in {self.projwfc_out_file}.")
+        
+        index = self.kpoint_index
+        with open(self.projwfc_out_file, "rb") as fp:
+            self.k = np.zeros([self.nk, 3])
+            self.ek = np.zeros([self.nk, self.nbnd])
+            for ik, offset in enumerate(index["kpoints"][:-1]):
+                fp.seek(offset)
+                # " k = ",3f14.10
+                self.k[ik] = parse_reals(np.frombuffer(fp.read(47)[5:], dtype = np.uint8).reshape(3, 14))
+            bands = index["bands"].ravel()
+            # "==== e(",i4,") = ",f11.5
+            for chunk in range(0, len(bands), 1 << 16):
+                offsets = bands[chunk:chunk + (1 << 16)]
+                fp.seek(offsets[0])
+                buf = np.frombuffer(fp.read(offsets[-1] - offsets[0] + 26), dtype = np.uint8)
+                self.ek.ravel()[chunk:chunk + len(offsets)] = parse_reals(buf[(offsets - offsets[0] + 15)[:,None] + np.arange(11)])
+        proj = np.ascontiguousarray(proj.reshape(self.natomwfc, self.nk, self.nbnd).transpose(1, 2, 0))
+        self.proj = SparseProjections.from_dense(proj) if self.sparse else proj
+        self.proj_read = True
         
+    def _init_projections(self):
+        """allocate self.k, self.ek and self.proj before storing parsed k blocks.
+        """
+        self.k = np.zeros([self.nk, 3])
+        self.ek = np.zeros([self.nk, self.nbnd])
+        if self.sparse:
+            self._sparse_parts = []
+            self.proj = None
+        else:
+            self.proj = np.zeros([self.nk, self.nbnd, self.natomwfc])
+            
+    def _store_projections(self, ik:int, k, ek, proj):
+        """store parsed k blocks from the ik-th k point.
+
+        Parameters
+        ----------
+        ik : int
+            the index of the first k point of the k blocks.
+        k, ek : NDArray
+            k points and energies of the k blocks.
+        proj : NDArray | SparseProjections
+            projectability of the k blocks.
+        """
+        self.k[ik:ik + len(k)] = k
+        self.ek[ik:ik + len(k)] = ek
+        if not self.sparse:
+            self.proj[ik:ik + len(k)] = proj
+            return
+        if not isinstance(proj, SparseProjections):
+            proj = SparseProjections.from_dense(proj)
+        self._sparse_parts.append((proj.ik + ik, proj.ibnd, proj.iwfc, proj.value))
+        
+    def _finalize_projections(self):
+        """make self.proj from stored sparse parts.
+        """
+        if self.sparse:
+            self.proj = SparseProjections.concatenate(self._sparse_parts, (self.nk, self.nbnd, self.natomwfc))
+            del self._sparse_parts
         
+    @profiled("ProjwfcOut.read_projections_regex")
+    def _read_projections(self, fp, start_index:int|None = None, chunk_size:int|None = None):
+        """read projectability for each k and e(k).
         
-        projwfc.x also outputs the energy at k points but it is NOT read for improving performance.
+        NOTE: by fp.readline()
         
+        This method first read a block containing the projectability of bands at a k point.
+        Then each k block are read in more detail. If self.nproc > 1, chunks of k blocks are 
+        parsed in multiprocess calculations and the results are written into self.k, self.ek
+        and self.proj. The results are the same as those of the serial calculation.
 
         Parameters
         ----------
         fp : _type_
             _description_
+        start_index : int | None, optional
+            the index of the line where the first k block starts, by default None
+        chunk_size : int | None, optional
+            the number of k blocks sent to a process at once, by default None.
+            If None, it is determined from self.nk and self.nproc.
         """
         # skip already read lines. 
         if start_index:
             tmp_fp = itertools.islice(fp, self.start_projection_block, None)
         else:
             tmp_fp = fp
-        self.k = np.zeros([self.nk, 3])
-        self.ek = np.zeros([self.nk, self.nbnd])
-        self.proj = np.zeros([self.nk, self.nbnd, self.natomwfc])
-        kblocks = self._get_kblocks(tmp_fp)
-        for ik, kblock in enumerate(kblocks): # TODO: execute parallel calculation.
-            try:
-                self.k[ik], self.ek[ik], self.proj[ik] = self._get_projectability_at_a_kpoint(kblock)
-            except:
-                raise Exception(f"ik:{ik}, kblocks:{kblock[0]}")
+        self._init_projections()
+        kblocks = profiled_iter(self._get_kblocks(tmp_fp), "ProjwfcOut.kblocks")
+        if self.nproc and self.nproc > 1:
+            self._read_projections_parallel(kblocks, chunk_size)
+        else:
+            for ik, kblock in enumerate(kblocks):
+                try:
+                    k, ek, proj = self._get_projectability_at_a_kpoint(kblock)
+                except:
+                    raise Exception(f"ik:{ik}, kblocks:{kblock[0]}")
+                self._store_projections(ik, k[None], ek[None], proj[None])
+        self._finalize_projections()
         self.proj_read = True
+        
+    def _read_projections_parallel(self, kblocks, chunk_size:int|None = None):
+        """parse k blocks with a process pool of self.nproc processes.
+        
+        The number of chunks sent to the pool at once is bounded by 2*self.nproc 
+        so that lines of the whole file are not kept in memory.
+
+        Parameters
+        ----------
+        kblocks : Iterable[list[str]]
+            k blocks obtained by self._get_kblocks.
+        chunk_size : int | None, optional
+            the number of k blocks in a chunk, by default None
+        """
+        if not chunk_size:
+            chunk_size = min(max(1, self.nk // (4*self.nproc)), 64)
+        pending = {}
+        
+        def store(done):
+            for future in done:
+                ik = pending.pop(future)
+                self._store_projections(ik, *future.result())
+        
+        with ProcessPoolExecutor(max_workers=self.nproc) as executor:
+            ik = 0
+            while True:
+                chunk = list(itertools.islice(kblocks, chunk_size))
+                if not chunk:
+                    break
+                if len(pending) >= 2*self.nproc:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    store(done)
+                pending[executor.submit(_parse_kblocks, chunk, self.nbnd, self.natomwfc, ik)] = ik
+                ik += len(chunk)
+            store(list(pending))
 
     def _get_kblocks(self, fp):
         """get lines containing projectability for each kpoint.
@@ -222,22 +852,21 @@ class ProjwfcOut:
         fp : _type_
             file pointer.
         """
-        self.k = np.zeros([self.nk,3])
-        ik = 0
-        inside_block = False
+        block_lines = None
         for line in fp:
-            if line in "Lowdin Charges:":
+            if "Lowdin Charges" in line:
                 break
-            if not inside_block and "k = " in line:
-                ik += 1
-                inside_block = True
-                block_lines = []  # 新しいブロックの開始
-            elif "k = " in line:
-                inside_block = False
-                yield block_lines # for true calculation.
-            if inside_block:
+            if "k = " in line:
+                # the start of a new block is the end of the previous block.
+                if block_lines is not None:
+                    yield block_lines
+                block_lines = []
+            if block_lines is not None:
                 block_lines.append(line)
+        if block_lines:
+            yield block_lines
       
+    @profiled("ProjwfcOut.parse_kblock")
     def _get_projectability_at_a_kpoint(self, kblock_lines:list[str]):
         """read the projectability of the bands at each k block.
 
@@ -245,50 +874,15 @@ class ProjwfcOut:
         ----------
         kblock_lines : list[str]
             lines of the block at a k point including projectability of each line.
-        ik : int
-            the index of the k point.
             
         Returns
         -------
         NDArray :
             the projectability of bands at a kpoint 
         """
-        iline = 0 # the first line is " k = ..." and it is neglected.
-        ibnd = 0
-        proj_per_k = np.zeros([self.nbnd, self.natomwfc]) # projectability of bands at a kpoint.
-        energy_per_k = np.zeros([self.nbnd])
-
-        match = re.search(r"k *= *(-*[0-9\.]+) +(-*[0-9\.]+) +(-*[0-9\.]+)", kblock_lines[iline])
-        
-        k = np.array([float(match.group(i+1)) for i in range(3)])
-        while True:
-            # an iteration of this while block is for a band.
-            iline += 1
-            # ==== e( number) = energy eV ==== line
-            match = re.search(r"==== e\( *([0-9]+)\) = *(-*[\.0-9]+) eV ====", kblock_lines[iline]) # "==== e\( *([0-9]+)\) = *(-*[\.0-9]+) eV ===="
-            energy_per_k[int(match.group(1))-1] = float(match.group(2))
-            
-            # the first line of projection includes " *psi *= *", and it is removed here.
-            kblock_lines[iline+1] = re.sub(r"^ *psi *= *","", kblock_lines[iline+1])
-            
-            while True:
-                # This block is for from a line just below # "==== e( number) = energy eV ==== " to "|psi|^2 = .*"
-                iline += 1
-                if "|psi|^2" in kblock_lines[iline]:
-                    break
-                # NOTE: the format in the output of projwfc.x is 
-                #       "projectability*[#the index of a pseudo atomic orbital]+projectability*[#the index of a pseudo atomic orbital]"
-                #       re.sub convert this into [projectability, the orbital index, projectability, the orbital index, ...]
-                line = re.sub(r"\*\[# *|\]"," ", kblock_lines[iline]).split()
-                proj_per_k[ibnd,[int(val) - 1 for val in line[1::2]]] = [float(val) for val in line[0::2]] 
-                # int(val) - 1 is due to Fortran count.
-            if iline == len(kblock_lines) - 2: # the last |psi|^2 appears at len(kblock_lines) - 2
-                # reach the last line.
-                break
-            ibnd += 1 # the end of a band block.
-            
-        return k, energy_per_k, proj_per_k
+        return _get_projectability_at_a_kpoint(kblock_lines, self.nbnd, self.natomwfc)
                 
+    @profiled("ProjwfcOut.labels")
     def get_relation_orbital_vs_pdosfile(self):
         """get the correspondence between orbitals and pdos file names.
         
@@ -299,47 +893,73 @@ class ProjwfcOut:
         pwxin : PWxIn
             PWxIn corresponding to outdir/prefix in the input of projwfc.x
         """
-        self.orbitals:list[tuple[str,Iterable|int,str]] = []
-        for name in self.pdos_files:
-            match = re.search(r".*atm#([0-9]+)\((.*)\).*#([0-9]+\([spd]\))", name)
-            atom_num = int(match.group(1))
-            # the index of the file -> (element, position or atom index, angular momentum (for no soc))
-            self.orbitals.append((match.group(1), 
-                                          self.pwxin.atom_positions[atom_num - 1] if self.pwxin else atom_num,
-                                          match.group(3)))
-        # For plot label
-        if self.pwxin:
-            self.pdos_labels = [f"{orbital[1][0]}_{str(orbital[1][1][0])}_{str(orbital[1][1][1])}_{str(orbital[1][1][2])}_{orbital[2]}" for orbital in self.orbitals]
-        else:
-            self.pdos_labels = self.pdos_files
+        with self._running("labels"):
+            orbitals:list[tuple[str,Iterable|int,str]] = []
+            for name in self.pdos_files:
+                match = re.search(r".*atm#([0-9]+)\((.*)\).*#([0-9]+\([spd]\))", name)
+                atom_num = int(match.group(1))
+                # the index of the file -> (element, position or atom index, angular momentum (for no soc))
+                orbitals.append((match.group(1), 
+                                 self.pwxin.atom_positions[atom_num - 1] if self.pwxin else atom_num,
+                                 match.group(3)))
+            self.orbitals = orbitals
+            # For plot label
+            if self.pwxin:
+                self.pdos_labels = [f"{orbital[1][0]}_{str(orbital[1][1][0])}_{str(orbital[1][1][1])}_{str(orbital[1][1][2])}_{orbital[2]}" for orbital in self.orbitals]
+            else:
+                self.pdos_labels = self.pdos_files
                 
+    @profiled("ProjwfcOut.pdos_files")
     def get_pdos_files(self):
         """get pdos files from a directory.
         
         Execute this method after the "read" method.
+        The files are loaded into self.pdos when it is accessed first.
 
         """
-        print("warning: soc case is not implemented.")
-        self.atom_indices = []
-        self.atom_names = []
-        self.wfc_indices = []
-        self.angular = []
-        self.pdos_files = []
-        for file in os.listdir(self.pdos_dir):
-            match = re.search(r"\.pdos_atm#([0-9]+)\((.*)\)_wfc#([0-9]+)\((.*)\)", file)
-            # match.group[0] = atom index [1] = atom_name 
-            if not match: continue
-            self.atom_indices.append(match.group(1))
-            self.atom_names.append(match.group(2))
-            self.wfc_indices.append(match.group(3))
-            self.angular.append(match.group(4))
-            self.pdos_files.append(file) 
+        with self._running("pdos_files"):
+            print("warning: soc case is not implemented.")
+            self.pdos_files, matches = find_pdos_files(self.pdos_dir)
+            self.atom_indices = []
+            self.atom_names = []
+            self.wfc_indices = []
+            self.angular = []
+            for match in matches:
+                # match.group[0] = atom index [1] = atom_name 
+                self.atom_indices.append(match.group(1))
+                self.atom_names.append(match.group(2))
+                self.wfc_indices.append(match.group(3))
+                self.angular.append(match.group(4))
+        if hasattr(self, "_pdos"):
+            del self._pdos
+            
+    @property
+    def pdos(self)->PdosSet:
+        """pdos of self.pdos_files loaded at the first access.
+        
+        Files are read by qe_utils.pdos.read_pdos_files with at most self.nproc threads.
+        If self.cache is given, the loaded arrays are also stored in it as the "pdos" entry of 
+        projwfc_out_file, which depends on the pdos files.
+        """
+        if not hasattr(self, "_pdos"):
+            dependencies = [Path(self.pdos_dir)/file for file in self.pdos_files]
+            cached = self.cache.load(self.projwfc_out_file, kind = "pdos", dependencies = dependencies) if self.cache else None
+            if cached is None:
+                self._pdos = PdosSet.from_dir(self.pdos_dir, self.pdos_files, max_workers = self.nproc)
+                if self.cache:
+                    self.cache.save(self.projwfc_out_file, {name: getattr(self._pdos, name) for name in ["energies", "data", "n_columns"]},
+                                    kind = "pdos", dependencies = dependencies)
+            else:
+                arrays = cached[0]
+                self._pdos = PdosSet(self.pdos_dir, self.pdos_files, arrays["energies"], arrays["data"], arrays["n_columns"])
+        return self._pdos
             
     def plot_pdos(self, 
                   savefig:str|None = None, 
                   show_plt:bool = False, 
                   show_legend:bool = True,
-                  xlim:list|None = [-5,5]
+                  xlim:list|None = [-5,5],
+                  group_by = None,
                   ):
         """plot projected dos.
 
@@ -355,17 +975,24 @@ class ProjwfcOut:
             even though this parameter is True, by default False
         xlim : list | None, optional
             xlim of the figure, by default [-5,5]
+        group_by : optional
+            if given, the pdos summed in each group is plotted, by default None.
+            e.g. "element", "atom", "l", ["element", "l"] or {site name: atom indices}. See PdosSet.group_index.
         """
         # TODO: return correspondence between label colors and orbitals.
-        if not hasattr(self, "file_names"): self.get_pdos_files()
+        if group_by is None:
+            ldos_list, labels = self.pdos.ldos, self.pdos_labels
+        else:
+            labels, grouped = self.pdos.grouped(group_by)
+            ldos_list, labels = grouped[:,:,0], [str(label) for label in labels]
+        import matplotlib.pyplot as plt # imported here not to slow down importing this module.
         fig, ax = plt.subplots()
-        for i, (file, label) in enumerate(zip(self.pdos_files, self.pdos_labels)):
-            data = np.loadtxt(str(Path(self.pdos_dir)/file))
-            ax.plot(data[:,0] - self.fermi, data[:,1], label= label) # FIXME: this does not work in general condition.
+        for ldos, label in zip(ldos_list, labels):
+            ax.plot(self.pdos.energies - self.fermi, ldos, label= label) # FIXME: this does not work in general condition.
         ax.set_xlabel("energy")
         ax.set_ylabel("pdos")
         if xlim: ax.set_xlim(xlim)
-        if show_legend and len(self.pdos_labels) < 6: 
+        if show_legend and len(labels) < 6: 
             # FIXME: if too many orbitals are given, the legend is too difficult to see.
             ax.legend() 
         if savefig:
@@ -374,14 +1001,21 @@ class ProjwfcOut:
     
     def sort_orbs_by_pdos_contribution(self, 
                                        energy_range:list|None = None, 
-                                       contribution_type:str|Callable = "max"):
+                                       contribution_type:str|Callable = "max",
+                                       group_by = None):
         """sort orbitals by contributions to the projected dos in the selected energy range.
         
         Contribution types are
             "max": The max value of the pdos of orbitals
-            # TODO: calculate pdos integral value to judge contribution
+            "integral": The integral of the pdos of orbitals
+            "mean": The mean value of the pdos of orbitals
+            "centroid": The weighted centroid of energies, sum E pdos(E) / sum pdos(E)
+            "band_center": The band center, int E pdos(E) dE / int pdos(E) dE
+        The pdos of all orbitals are evaluated at once by PdosSet.contributions.
         You can also pass a user-defined function to contribution_type;
             func(dos_in_energy_range)-> float value
+        or a function marked by qe_utils.pdos.vectorized;
+            func(dos_in_energy_range (n_orbitals, n_energy), energies) -> (n_orbitals,) values
         to sort orbitals. Be carful that the larger an orbital contributes to bands,
         the larger returned value of func is.
 
@@ -392,108 +1026,334 @@ class ProjwfcOut:
             The zero point of energy is the Fermi energy of the system if it is given in the contstructor.
         contribution_type : str | function, optional
             the type to judge how orbitals contribute to bands, by default "max"
+        group_by : optional
+            if given, groups of orbitals are sorted by their summed pdos, by default None.
+            The order is that of labels in self.pdos.group_index(group_by)[0].
         
         Returns
         -------
         tuple[np.array,np.array]
-            order of orbitals and contribution value of them
+            order of orbitals (or groups) and contribution value of them
         """
-        orb_contribution = np.zeros(len(self.pdos_files))
-        initial_data = np.loadtxt(str(Path(self.pdos_dir)/self.pdos_files[0]))
-        
-        # get index corresponding to energy_range
-        if energy_range:
-            index = np.where((energy_range[0] <= (initial_data[:,0] - self.fermi)) & ((initial_data[:,0] - self.fermi) <= energy_range[1]))[0]
-        else:
-            index = np.ones(initial_data[:,0].shape[0], dtype = bool)
-        energy_points = initial_data[index,0]
-        
-        # get function to evaluate contribution of each orbital from 
-        if callable(contribution_type):
-            contribution_func = contribution_type
-        elif contribution_type == "max":
-            contribution_func = np.max
-        elif contribution_type == "integral":
-            contribution_func = lambda dos: integrate.simpson(dos, 
-                                                              x = energy_points,
-                                                              dx = energy_points[1] - energy_points[0])
-            
-        # evaluate orbital contributions from projected dos in selected energy range.
-        for i, file in enumerate(self.pdos_files):
-            data = np.loadtxt(str(Path(self.pdos_dir)/file))
-            # TODO: check the pdos format of QE to judge whether the line below is valid in any case.
-            orb_contribution[i] = contribution_func(data[index,1]) # NOTE: ldos is used for contribution evaluation.
-            
+        # TODO: check the pdos format of QE to judge whether ldos is valid in any case.
+        orb_contribution = self.pdos.contributions(energy_range, contribution_type, fermi = self.fermi, 
+                                                   group_by = group_by) # NOTE: ldos is used for contribution evaluation.
         orb_order = np.argsort(orb_contribution)[::-1] # orb_order[0] maximally contributes the bands
         return orb_order, orb_contribution[orb_order]
         
+    def compute_pdos(self, degauss:float, delta_e:float = 0.01, emin:float|None = None, emax:float|None = None,
+                     smearing:str = "gaussian", k_weights:NDArray|None = None, prefix:str = "pwscf"):
+        """compute pdos from the projections with broadening and use it as self.pdos.
+        
+        The energy grid is made as projwfc.x; emin - 3*degauss to emax + 3*degauss with the step delta_e
+        where emin and emax are the minimum and maximum of band energies by default. 
+        The pdos of states are collected to files of (atom, wfc) named as the output of projwfc.x, so that
+        plot_pdos and sort_orbs_by_pdos_contribution use the computed pdos. See qe_utils.pdos.broadened_dos.
+        
+        NOTE: energies are in eV.
+
+        Parameters
+        ----------
+        degauss : float
+            the broadening width [eV].
+        delta_e : float, optional
+            the step of the energy grid [eV], by default 0.01
+        emin, emax : float | None, optional
+            the range of the energy grid [eV], by default None (see above)
+        smearing : str, optional
+            "gaussian" or "lorentzian", by default "gaussian"
+        k_weights : NDArray | None, optional
+            (nk,) weights of k points, by default None (uniform weights whose sum is 2)
+        prefix : str, optional
+            the prefix of the names of files, by default "pwscf"
+
+        Returns
+        -------
+        PdosSet
+            the computed pdos, which is also set to self.pdos.
+        """
+        if self.soc:
+            raise NotImplementedError("soc case is not implemented.")
+        self.read_projections()
+        emin = (self.ek.min() if emin is None else emin) - 3*degauss
+        emax = (self.ek.max() if emax is None else emax) + 3*degauss
+        energies = emin + delta_e*np.arange(int(np.rint((emax - emin)/delta_e + 0.500001)) + 1)
+        pdos, dos = broadened_dos(self.ek, self.proj, energies, degauss, smearing, k_weights)
+        
+        # file -> states in the order of first appearance.
+        file_states:dict[str, list[int]] = {}
+        for istate in range(self.natomwfc):
+            file = f"{prefix}.pdos_atm#{self.iatom[istate] + 1}({self.elements[istate]})_wfc#{self.wfc[istate]}({'spdf'[self.l[istate]]})"
+            file_states.setdefault(file, []).append(istate)
+        files, states = list(file_states), list(file_states.values())
+        n_columns = np.array([len(indices) + 1 for indices in states])
+        data = np.zeros([len(files), len(energies), n_columns.max()])
+        for i, indices in enumerate(states):
+            indices = sorted(indices, key = lambda istate: self.m[istate])
+            data[i, :, 0] = pdos[:, indices].sum(axis = 1) # ldos
+            data[i, :, 1:len(indices) + 1] = pdos[:, indices]
+        self._pdos = PdosSet(self.pdos_dir, files, energies, data, n_columns, 
+                             total = np.stack([dos, pdos.sum(axis = 1)], axis = 1))
+        self.pdos_files = files
+        self.atom_indices = [str(index) for index in self._pdos.atom_indices]
+        self.atom_names = self._pdos.atom_names.tolist()
+        self.wfc_indices = [str(index) for index in self._pdos.wfc_indices]
+        self.angular = self._pdos.angular.tolist()
+        self.get_relation_orbital_vs_pdosfile()
+        return self._pdos
+        
+    def scan_orbs_by_pdos_contribution(self, windows:NDArray, contribution_type:str = "integral", group_by = None):
+        """sort orbitals by contributions to the projected dos for each of energy windows.
+        
+        The cumulative integral of the pdos is made once by PdosSet.prefix_index, 
+        so that the contributions for a window are obtained without integrating the pdos again.
+        See PdosSet.scan for details.
+
+        Parameters
+        ----------
+        windows : NDArray
+            (n_windows, 2) [emin, emax] relative to the Fermi energy.
+            PdosSet.sliding_windows makes windows sliding in an energy range.
+        contribution_type : str, optional
+            "integral" or "mean", by default "integral"
+        group_by : optional
+            if given, groups of orbitals are sorted (see sort_orbs_by_pdos_contribution), by default None.
+
+        Returns
+        -------
+        tuple[NDArray, NDArray]
+            (n_windows, n_orbitals) orders of orbitals (or groups) and contribution values of them.
+        """
+        return self.pdos.scan(windows, contribution_type, fermi = self.fermi, group_by = group_by)
+        
     def convert_label(self):
         raise NotImplementedError
     
     def read_filband(self):
         raise NotImplementedError("read_filband is not implemented.")
     
-    def get_projections(self, kpoints:list[int]|None = None, bands:list[int]|None = None, atomwfcs:list[int]|None = None):
+    @property
+    def energy_index(self)->EnergyIndex:
+        """sorted index over self.ek - self.fermi for energy window queries.
+        """
+        self.read_projections()
+        index = getattr(self, "_energy_index", None)
+        if index is None or index.source is not self.ek or index.fermi != self.fermi:
+            index = EnergyIndex(self.ek - self.fermi)
+            index.source, index.fermi = self.ek, self.fermi
+            self._energy_index = index
+        return index
+    
+    def get_projections(self, kpoints:list[int]|None = None, bands:list[int]|None = None, atomwfcs:list[int]|None = None,
+                        energy_window:tuple[float|None, float|None]|None = None):
         """get projections based on k points, bands and orbitals.
         
+        If energy_window = (emin, emax) is given, only states (k, band) with emin <= e - fermi <= emax 
+        (and in kpoints and bands if given) are selected through self.energy_index.
+
         Returns
         -------
-        NDArray
-            projections whose shape is (num_kpoints, num_bands, num_natomorbs)
-        """
-        if not kpoints:
-            kpoints = np.arange(self.nk)
-        if not bands:
-            bands = np.arange(self.nbnd)
-        if not atomwfcs:
-            atomwfcs = np.arange(self.natomwfc)
+        NDArray | SparseProjections
+            projections whose shape is (num_kpoints, num_bands, num_natomorbs).
+            SparseProjections if self.sparse is True.
+            If energy_window is given, a dense array whose shape is (num_states, num_natomorbs)
+            where states are self.energy_index.states(*energy_window) sorted by (k, band).
+        """
+        if energy_window is not None:
+            ik, ibnd = self.energy_index.states(*energy_window)
+            selected = np.ones(len(ik), dtype = bool)
+            for indices, selection, ntot in zip([ik, ibnd], [kpoints, bands], [self.nk, self.nbnd]):
+                if selection is not None:
+                    mask = np.zeros(ntot, dtype = bool)
+                    mask[selection] = True
+                    selected &= mask[indices]
+            return self.get_state_projections(ik[selected], ibnd[selected], atomwfcs)
+        if self.sparse:
+            return self.proj.select(kpoints, bands, atomwfcs)
+        kpoints = np.arange(self.nk) if kpoints is None else np.asarray(kpoints)
+        bands = np.arange(self.nbnd) if bands is None else np.asarray(bands)
+        atomwfcs = np.arange(self.natomwfc) if atomwfcs is None else np.asarray(atomwfcs)
         return self.proj[kpoints[:,None,None], bands[None,:,None], atomwfcs[None,None,:]]
             
-    def sort_atom_proj(self, **get_projections_kwargs):
+    def get_state_projections(self, ik:NDArray, ibnd:NDArray, atomwfcs:list[int]|None = None)->NDArray:
+        """get projections of states (ik, ibnd), e.g. states of self.energy_index.states(emin, emax).
+
+        Parameters
+        ----------
+        ik, ibnd : NDArray
+            (num_states,) indices of k points and bands (python index) of states.
+        atomwfcs : list[int] | None, optional
+            indices of atomic wave functions, by default None (all)
+
+        Returns
+        -------
+        NDArray
+            a dense array whose shape is (num_states, num_natomorbs) also if self.sparse is True.
+        """
+        atomwfcs = np.arange(self.natomwfc) if atomwfcs is None else np.asarray(atomwfcs)
+        if not self.sparse:
+            return self.proj[ik[:,None], ibnd[:,None], atomwfcs[None,:]]
+        # gather stored elements of the states from the CSR-like pointer.
+        pointer = self.proj.state_pointer()
+        states = ik*self.nbnd + ibnd
+        counts = pointer[states + 1] - pointer[states]
+        elements = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts - pointer[states], counts)
+        wfc_map = np.full(self.natomwfc, -1)
+        wfc_map[atomwfcs] = np.arange(len(atomwfcs))
+        rows, columns = np.repeat(np.arange(len(states)), counts), wfc_map[self.proj.iwfc[elements]]
+        proj = np.zeros([len(states), len(atomwfcs)])
+        proj[rows[columns >= 0], columns[columns >= 0]] = self.proj.value[elements][columns >= 0]
+        return proj
+            
+    def sort_atom_proj(self, dense:bool = False, **get_projections_kwargs):
         """sort projection value for atomwfc at each (k,e(k))
         
         NOTE: indices is that in the outputs of projwfc.x - 1.
+        
+        If self.sparse is True, only nonzero projections are sorted and the last axis is as long as 
+        the maximum number of nonzero projections in a state. The remaining elements are padded 
+        with 0 and -1.
+
+        Parameters
+        ----------
+        dense : bool, optional
+            whether the last axis is padded to num_natomorbs if self.sparse is True, by default False.
+            Then values are the same as those of the dense case and indices are different only for zero projections.
 
         Returns
         -------
         tuple[NDArray]
-            sorted_value and index for atomic wave functions.
+            sorted_value and index for atomic wave functions whose shapes are (num_kpoints, num_bands, num_natomorbs)
+            (or (num_kpoints, num_bands, max_nonzero) if self.sparse is True and dense is False).
         """
         selected_proj = self.get_projections(**get_projections_kwargs) if get_projections_kwargs else self.proj
+        if self.sparse:
+            return selected_proj.sort_states(width = selected_proj.shape[2] if dense else None)
         sorted_indices = np.argsort(selected_proj, axis = 2)[:,:,::-1] # from large value to small
         return np.take_along_axis(selected_proj, sorted_indices, axis=2), sorted_indices
     
+    def top_atom_proj(self, n:int, kpoints:list[int]|None = None, bands:list[int]|None = None, 
+                      atomwfcs:list[int]|None = None, max_elements:int = 1 << 22):
+        """the n largest projection values for atomwfc at each (k,e(k)).
+        
+        Unlike sort_atom_proj, only the n largest values are selected by np.argpartition and sorted, 
+        and k points are processed in chunks of at most max_elements projections, 
+        so that the memory used in addition to the outputs is bounded.
+        If a state has fewer than n atomic wave functions (or nonzero projections if self.sparse is True),
+        the remaining elements are padded with 0 and -1.
+        
+        NOTE: indices is that in the outputs of projwfc.x - 1 (not in atomwfcs).
+
+        Parameters
+        ----------
+        n : int
+            the number of atomic wave functions for each state.
+        kpoints, bands, atomwfcs : list[int] | None, optional
+            selected indices as get_projections, by default None (all)
+        max_elements : int, optional
+            the upper bound of the number of projections in a chunk, by default 2**22
+
+        Returns
+        -------
+        tuple[NDArray, NDArray]
+            (num_kpoints, num_bands, n) values in descending order and indices of atomic wave functions.
+        """
+        self.read_projections()
+        kpoints = np.arange(self.nk) if kpoints is None else np.asarray(kpoints)
+        bands = np.arange(self.nbnd) if bands is None else np.asarray(bands)
+        atomwfcs = np.arange(self.natomwfc) if atomwfcs is None else np.asarray(atomwfcs)
+        values = np.zeros([len(kpoints), len(bands), n])
+        indices = np.full([len(kpoints), len(bands), n], -1)
+        width = min(n, len(atomwfcs))
+        chunk_size = max(1, max_elements//max(1, len(bands)*len(atomwfcs)))
+        for start in range(0, len(kpoints), chunk_size):
+            chunk = slice(start, start + chunk_size)
+            proj = self.get_projections(kpoints[chunk], bands, atomwfcs)
+            if self.sparse:
+                proj = proj.todense()
+            top = np.argpartition(-proj, width - 1, axis = 2)[:,:,:width] if width < len(atomwfcs) else \
+                np.broadcast_to(np.arange(width), proj.shape[:2] + (width,))
+            top_values = np.take_along_axis(proj, top, axis = 2)
+            order = np.argsort(-top_values, axis = 2, kind = "stable")
+            values[chunk,:,:width] = np.take_along_axis(top_values, order, axis = 2)
+            indices[chunk,:,:width] = atomwfcs[np.take_along_axis(top, order, axis = 2)]
+        if self.sparse:
+            # zero projections are not stored in SparseProjections.
+            indices[values == 0] = -1
+        return values, indices
+    
     def get_zero_projections(self, **get_projections_kwargs):
         """get indices of orbitals whose projections to bands are zero.
 
         Returns
         -------
-        _type_
-            _description_
+        tuple[NDArray]
+            indices of k points, bands and orbitals as np.where.
         """
         selected_proj = self.get_projections(**get_projections_kwargs) if get_projections_kwargs else self.proj
+        if self.sparse:
+            return selected_proj.zero_indices()
         return np.where(selected_proj == 0)
     
-    def extract_atom_bands(self, ik, istates, threshold:float = 0.1):
+    def search_wannier_projections(self, num_wann:int, emin:float|None = None, emax:float|None = None, **search_kwargs):
+        """search sets of shells of atomic orbitals as initial projections of Wannierization.
+        
+        See qe_utils.wannier.ProjectionSearch.search for search_kwargs.
+
+        Parameters
+        ----------
+        num_wann : int
+            the number of Wannier functions.
+        emin, emax : float | None, optional
+            the energy window relative to the Fermi energy, by default None (no bound)
+
+        Returns
+        -------
+        list[ProjectionSet]
+            sets in descending order of scores. Use ProjectionSet.projections_block(self.pwxin) for Wannier90.
+        """
+        return ProjectionSearch(self, emin, emax).search(num_wann, **search_kwargs)
+    
+    def orbital_index(self, threshold:float = 0.1)->OrbitalIndex:
+        """inverted index from atomic wave functions to states (k, band) whose projectability exceeds threshold.
+        
+        The index is built once for each threshold after reading projections.
+        
+        Parameters
+        ----------
+        threshold : float, optional
+            threshold of projectability, by default 0.1
+
+        Returns
+        -------
+        OrbitalIndex
+        """
+        self.read_projections()
+        if not hasattr(self, "_orbital_indices"):
+            self._orbital_indices:dict[float, OrbitalIndex] = {}
+        if threshold not in self._orbital_indices:
+            self._orbital_indices[threshold] = OrbitalIndex(self.proj, threshold)
+        return self._orbital_indices[threshold]
+    
+    def extract_atom_bands(self, ik:int, istates:Iterable[int], threshold:float = 0.1):
         """extract band indices atomic wave function projectability exceed threshold.
         
         Parameters
         ----------
-        ik : _type_
-            _description_
-        istates : bool
-            _description_
+        ik : int
+            the index of the k point.
+        istates : Iterable[int]
+            indices of atomic wave functions.
+        threshold : float, optional
+            threshold of projectability, by default 0.1
 
         Returns
         -------
-        _type_
-            _description_
+        list[NDArray]
+            band indices for each state in istates.
         """
-        bands = [[] for i in range(istates)]
-        for istate in istates:
-            # FIXME: for loop can be removed using numpy functions?
-            bands[istate] = np.where(self.proj[ik,:, istate] > threshold)
-        return bands
+        index = self.orbital_index(threshold)
+        return [index.lookup(istate, ik)[1] for istate in istates]
     
     @property
     def j(self):
@@ -522,4 +1382,200 @@ class ProjwfcOut:
     @property
     def soc(self):
         return hasattr(self, "_m_j")
-    
\ No newline at end of file
+    
+def _get_projectability_at_a_kpoint(kblock_lines:list[str], nbnd:int, natomwfc:int):
+    """read the projectability of the bands at a k block.
+    
+    This is a module-level function so that it can be sent to other processes.
+
+    Parameters
+    ----------
+    kblock_lines : list[str]
+        lines of the block at a k point including projectability of each line.
+    nbnd : int
+        the number of bands.
+    natomwfc : int
+        the number of atomic wave functions.
+        
+    Returns
+    -------
+    tuple[NDArray, NDArray, NDArray] :
+        k point, energies of bands and the projectability of bands at the k point.
+    """
+    iline = 0 # the first line is " k = ..." and it is neglected.
+    ibnd = 0
+    proj_per_k = np.zeros([nbnd, natomwfc]) # projectability of bands at a kpoint.
+    energy_per_k = np.zeros([nbnd])
+
+    match = re.search(r"k *= *(-*[0-9\.]+) +(-*[0-9\.]+) +(-*[0-9\.]+)", kblock_lines[iline])
+    
+    k = np.array([float(match.group(i+1)) for i in range(3)])
+    while True:
+        # an iteration of this while block is for a band.
+        iline += 1
+        # ==== e( number) = energy eV ==== line
+        match = re.search(r"==== e\( *([0-9]+)\) = *(-*[\.0-9]+) eV ====", kblock_lines[iline]) # "==== e\( *([0-9]+)\) = *(-*[\.0-9]+) eV ===="
+        energy_per_k[int(match.group(1))-1] = float(match.group(2))
+        
+        # the first line of projection includes " *psi *= *", and it is removed here.
+        kblock_lines[iline+1] = re.sub(r"^ *psi *= *","", kblock_lines[iline+1])
+        
+        while True:
+            # This block is for from a line just below # "==== e( number) = energy eV ==== " to "|psi|^2 = .*"
+            iline += 1
+            if "|psi|^2" in kblock_lines[iline]:
+                break
+            # NOTE: the format in the output of projwfc.x is 
+            #       "projectability*[#the index of a pseudo atomic orbital]+projectability*[#the index of a pseudo atomic orbital]"
+            #       re.sub convert this into [projectability, the orbital index, projectability, the orbital index, ...]
+            line = re.sub(r"\*\[# *|\]"," ", kblock_lines[iline]).split()
+            proj_per_k[ibnd,[int(val) - 1 for val in line[1::2]]] = [float(val) for val in line[0::2]] 
+            # int(val) - 1 is due to Fortran count.
+        if iline == len(kblock_lines) - 2: # the last |psi|^2 appears at len(kblock_lines) - 2
+            # reach the last line.
+            break
+        ibnd += 1 # the end of a band block.
+        
+    return k, energy_per_k, proj_per_k
+
+def _parse_kblocks(kblocks:list[list[str]], nbnd:int, natomwfc:int, ik_start:int = 0):
+    """parse a chunk of k blocks. This function is executed in worker processes.
+
+    Parameters
+    ----------
+    kblocks : list[list[str]]
+        k blocks obtained by ProjwfcOut._get_kblocks.
+    nbnd : int
+        the number of bands.
+    natomwfc : int
+        the number of atomic wave functions.
+    ik_start : int, optional
+        the index of the first k block in the chunk, used for error messages, by default 0
+
+    Returns
+    -------
+    tuple[NDArray, NDArray, NDArray]
+        k points, energies and projectability of the k blocks in the chunk.
+    """
+    k = np.zeros([len(kblocks), 3])
+    ek = np.zeros([len(kblocks), nbnd])
+    proj = np.zeros([len(kblocks), nbnd, natomwfc])
+    for i, kblock in enumerate(kblocks):
+        try:
+            k[i], ek[i], proj[i] = _get_projectability_at_a_kpoint(kblock, nbnd, natomwfc)
+        except:
+            raise Exception(f"ik:{ik_start + i}, kblocks:{kblock[0]}")
+    return k, ek, proj
+
+def _find_projection_section(data:bytes|mmap.mmap):
+    """find the byte range of the projection section in the output of projwfc.x.
+
+    Parameters
+    ----------
+    data : bytes | mmap.mmap
+        the content of the output file of projwfc.x
+
+    Returns
+    -------
+    tuple[int, int]
+        the offset of the first " k = " line and that of "Lowdin Charges" (or the end of data).
+    """
+    states = data.find(b"Atomic states used for projection")
+    if states < 0:
+        raise ValueError("Atomic states used for projection is not found.")
+    start = data.find(b" k = ", states)
+    if start < 0:
+        raise ValueError("no k block is found.")
+    end = data.find(b"Lowdin Charges", start)
+    return start, end if end >= 0 else len(data)
+
+def _find_kpoint_lines(buf:np.ndarray):
+    """offsets of "k" in " k = " lines of the projection section."""
+    kpos = np.flatnonzero(buf[:-2] == ord("k"))
+    return kpos[(buf[kpos + 1] == ord(" ")) & (buf[kpos + 2] == ord("="))]
+
+def _tokenize_projections(section):
+    """tokenize the projection section of the output of projwfc.x without regular expressions.
+    
+    The section is read as a uint8 array and fields are taken by their fixed widths in 
+    the Fortran formats of projwfc.x;
+        k lines          : ' k = ',3f14.10
+        band headers     : '==== e(',i4,') = ',f11.5,' eV ==== '
+        projection pairs : f5.3,'*[#',i4,']+'
+    A '(' is only in band headers and a '*' is only in projection pairs in this section.
+
+    Parameters
+    ----------
+    section : bytes | memoryview | NDArray
+        the projection section from the first " k = " line.
+
+    Returns
+    -------
+    tuple[NDArray, ...]
+        k points (nk, 3), the k index and band index (from 0) of each band header, 
+        the energy of each band header, the band header index of each pair,
+        the orbital index (from 0) of each pair, and the projectability of each pair.
+    """
+    buf = np.frombuffer(section, dtype=np.uint8)
+    kpos = _find_kpoint_lines(buf)
+    hpos = np.flatnonzero(buf == ord("("))
+    ppos = np.flatnonzero(buf == ord("*"))
+    if (len(kpos) == 0 or len(hpos) == 0 or hpos[0] < kpos[0] or hpos[-1] + 20 > len(buf)
+        or (len(ppos) > 0 and (ppos[0] < hpos[0] or ppos[-1] + 8 > len(buf)))):
+        raise ValueError("unexpected format of projections.")
+    if not (np.all(buf[hpos - 1] == ord("e")) and np.all(buf[hpos + 5] == ord(")"))
+            and np.all(buf[hpos + 7] == ord("="))
+            and np.all(buf[ppos - 4] == ord(".")) and np.all(buf[ppos + 1] == ord("["))
+            and np.all(buf[ppos + 2] == ord("#")) and np.all(buf[ppos + 7] == ord("]"))):
+        raise ValueError("unexpected format of projections.")
+    
+    k = parse_reals(buf[kpos[:,None] + np.arange(4, 46)].reshape(-1, 3, 14))
+    k_of_band = np.searchsorted(kpos, hpos) - 1
+    ibnd = parse_ints(buf[hpos[:,None] + np.arange(1, 5)]) - 1 # Fortran index to python index
+    energy = parse_reals(buf[hpos[:,None] + np.arange(9, 20)])
+    
+    band_of_pair = np.searchsorted(hpos, ppos) - 1
+    iwfc = parse_ints(buf[ppos[:,None] + np.arange(3, 7)]) - 1 # Fortran index to python index
+    # f5.3 is "d.ddd". integer/1000 is the same double as float("d.ddd").
+    digits = buf[ppos[:,None] + np.array([-5, -3, -2, -1])].astype(np.int64) - ord("0")
+    if np.any((digits < 0) | (digits > 9)):
+        raise ValueError("unexpected projectability field in projections.")
+    coef = (digits @ np.array([1000, 100, 10, 1])) / 1000.0
+    return k, k_of_band, ibnd, energy, band_of_pair, iwfc, coef
+
+@profiled("projwfc.parse_projection_bytes")
+def _parse_projection_bytes(section, nk:int|None, nbnd:int, natomwfc:int, sparse:bool = False):
+    """parse the projection section into k points, energies and projectability.
+
+    Parameters
+    ----------
+    section : bytes | memoryview
+        the projection section (or its part starting at a " k = " line).
+    nk : int | None
+        the number of k blocks. If None, it is the number of k lines in section.
+    nbnd : int
+        the number of bands.
+    natomwfc : int
+        the number of atomic wave functions.
+    sparse : bool, optional
+        whether projectability is returned as SparseProjections, by default False
+
+    Returns
+    -------
+    tuple[NDArray, NDArray, NDArray|SparseProjections]
+        k points, energies and projectability whose shapes are (nk, 3), (nk, nbnd), (nk, nbnd, natomwfc)
+    """
+    k_points, k_of_band, ibnd, energy, band_of_pair, iwfc, coef = _tokenize_projections(section)
+    if nk is None:
+        nk = len(k_points)
+    if len(k_points) != nk:
+        raise ValueError(f"the number of k blocks ({len(k_points)}) is not nkstot ({nk}).")
+    if np.any(ibnd >= nbnd) or np.any(iwfc >= natomwfc) or np.any(iwfc < 0) or np.any(ibnd < 0):
+        raise ValueError("band or orbital index exceeds nbnd or natomwfc.")
+    ek = np.zeros([nk, nbnd])
+    ek[k_of_band, ibnd] = energy
+    if sparse:
+        return k_points, ek, SparseProjections(k_of_band[band_of_pair], ibnd[band_of_pair], iwfc, coef, (nk, nbnd, natomwfc))
+    proj = np.zeros([nk, nbnd, natomwfc])
+    proj[k_of_band[band_of_pair], ibnd[band_of_pair], iwfc] = coef
+    return k_points, ek, proj
@@ -4,6 +4,7 @@ import numpy as np
 from collections import OrderedDict
 from importlib import resources
 from qe_utils.namelist import NameList
+from qe_utils.profiling import profiled
 from typing import Dict, Any
 
 class PWxIn:
@@ -62,6 +63,7 @@ class PWxIn:
             self.check_and_sort_namelists()        
             
     @classmethod
+    @profiled("PWxIn.from_pwx_input")
     def from_pwx_input(cls, pwx_input):
         """read data of a pw.x input file
 
@@ -245,6 +247,7 @@ class PWxIn:
         return namelist.namelist, card_dict
     
     @classmethod
+    @profiled("PWxIn.parse_card_string")
     def parse_card_string(cls, card_string:str):
         """parse a string containing card sections.
 
@@ -0,0 +1,172 @@
+"""reducers
+
+This module contains reducers of projections streamed by ProjwfcOut.iter_projections.
+
+A reducer receives the projections at one k point at a time, so that aggregates are
+computed without keeping the (nk, nbnd, natomwfc) projection array in memory.
+
+Example
+-------
+>>> window_sum, top = projwfcout.reduce(WindowSum(-2, 2), TopN(5, -2, 2))
+"""
+import numpy as np
+from numpy.typing import NDArray
+
+class Reducer:
+    """base class of reducers.
+
+    Subclasses implement update and result.
+    """
+    def setup(self, projwfcout):
+        """called by ProjwfcOut.reduce before streaming.
+
+        Parameters
+        ----------
+        projwfcout : ProjwfcOut
+        """
+        self.nbnd = projwfcout.nbnd
+        self.natomwfc = projwfcout.natomwfc
+        self.fermi = projwfcout.fermi
+
+    def update(self, ik:int, k:NDArray, ek:NDArray, proj_k:NDArray):
+        """accumulate the projections at a k point.
+
+        Parameters
+        ----------
+        ik : int
+            the index of the k point.
+        k : NDArray
+            the k point.
+        ek : NDArray
+            (nbnd,) energies of bands.
+        proj_k : NDArray
+            (nbnd, natomwfc) projections.
+        """
+        raise NotImplementedError
+
+    def result(self):
+        raise NotImplementedError
+
+class WindowSum(Reducer):
+    """per-orbital projectability summed over bands in an energy window and k points.
+
+    The zero point of energy is the Fermi energy given to ProjwfcOut.
+    """
+    def __init__(self, emin:float|None = None, emax:float|None = None):
+        self.emin = -np.inf if emin is None else emin
+        self.emax = np.inf if emax is None else emax
+
+    def setup(self, projwfcout):
+        super().setup(projwfcout)
+        self.sum = np.zeros(self.natomwfc)
+        self.num_states = 0 # the number of (k, band) in the window.
+
+    def update(self, ik, k, ek, proj_k):
+        in_window = (self.emin <= ek - self.fermi) & (ek - self.fermi <= self.emax)
+        self.sum += proj_k[in_window].sum(axis = 0)
+        self.num_states += int(np.count_nonzero(in_window))
+
+    def result(self):
+        """
+        Returns
+        -------
+        NDArray
+            (natomwfc,) summed projectability.
+        """
+        return self.sum
+
+class MaxWeight(Reducer):
+    """the maximum weight of each orbital (or atom) over all (k, band).
+
+    If by = "atom", weights of orbitals on the same atom are summed before taking the maximum.
+    """
+    def __init__(self, by:str = "orbital"):
+        if by not in ["orbital", "atom"]:
+            raise ValueError(f"by, {by} is invalid.")
+        self.by = by
+
+    def setup(self, projwfcout):
+        super().setup(projwfcout)
+        if self.by == "atom":
+            self.iatom = np.asarray(projwfcout.iatom)
+            self.max = np.zeros(self.iatom.max() + 1)
+        else:
+            self.max = np.zeros(self.natomwfc)
+
+    def update(self, ik, k, ek, proj_k):
+        if self.by == "atom":
+            weight = np.zeros([proj_k.shape[0], len(self.max)])
+            np.add.at(weight, (slice(None), self.iatom), proj_k)
+        else:
+            weight = proj_k
+        np.maximum(self.max, weight.max(axis = 0), out = self.max)
+
+    def result(self):
+        """
+        Returns
+        -------
+        NDArray
+            (natomwfc,) or (natom,) maximum weights.
+        """
+        return self.max
+
+class Histogram(Reducer):
+    """histogram of band energies weighted by the projectability of each orbital.
+
+    This is a rough projected dos without broadening.
+    """
+    def __init__(self, bins:NDArray|int = 100, energy_range:tuple|None = None):
+        """
+        Parameters
+        ----------
+        bins : NDArray | int, optional
+            bin edges or the number of bins in energy_range, by default 100
+        energy_range : tuple | None, optional
+            (emin, emax) relative to the Fermi energy. It is necessary if bins is int.
+        """
+        if np.ndim(bins) == 0:
+            if energy_range is None:
+                raise ValueError("energy_range must be given if bins is int.")
+            bins = np.linspace(*energy_range, int(bins) + 1)
+        self.bins = np.asarray(bins, dtype = np.float64)
+
+    def setup(self, projwfcout):
+        super().setup(projwfcout)
+        self.hist = np.zeros([self.natomwfc, len(self.bins) - 1])
+
+    def update(self, ik, k, ek, proj_k):
+        ibin = np.searchsorted(self.bins, ek - self.fermi, side = "right") - 1
+        # the right edge of the last bin is included like np.histogram.
+        ibin[ek - self.fermi == self.bins[-1]] = len(self.bins) - 2
+        in_range = (ibin >= 0) & (ibin < len(self.bins) - 1)
+        np.add.at(self.hist.T, ibin[in_range], proj_k[in_range])
+
+    def result(self):
+        """
+        Returns
+        -------
+        tuple[NDArray, NDArray]
+            (natomwfc, nbins) histograms and bin edges.
+        """
+        return self.hist, self.bins
+
+class TopN(WindowSum):
+    """orbitals whose summed projectability in an energy window is the n largest.
+    """
+    def __init__(self, n:int, emin:float|None = None, emax:float|None = None):
+        super().__init__(emin, emax)
+        self.n = n
+
+    def result(self):
+        """
+        Returns
+        -------
+        tuple[NDArray, NDArray]
+            indices of orbitals in descending order and their summed projectability.
+        """
+        n = min(self.n, len(self.sum))
+        # orbitals tied with the n-th largest value are kept so that smaller indices are taken first.
+        nth = -np.partition(-self.sum, n - 1)[n - 1]
+        candidates = np.flatnonzero(self.sum >= nth)
+        top = candidates[np.argsort(-self.sum[candidates], kind = "stable")][:n]
+        return top, self.sum[top]
@@ -0,0 +1,239 @@
+"""sparse_proj
+
+This module contains a sparse representation of projections of bands onto atomic wave functions.
+
+projwfc.x prints only projectability above its threshold, so most of the elements
+of the (nk, nbnd, natomwfc) projection array are zero. SparseProjections stores only
+the printed elements in the COO format.
+"""
+import numpy as np
+from numpy.typing import NDArray
+
+class SparseProjections:
+    """projections in the COO format.
+
+    Elements are sorted by (ik, ibnd, iwfc).
+
+    Attributes
+    ----------
+    ik: NDArray
+        k indices of nonzero elements.
+    ibnd: NDArray
+        band indices of nonzero elements.
+    iwfc: NDArray
+        indices of atomic wave functions of nonzero elements.
+    value: NDArray
+        projectability of nonzero elements.
+    shape: tuple[int, int, int]
+        (nk, nbnd, natomwfc)
+    """
+    def __init__(self, ik:NDArray, ibnd:NDArray, iwfc:NDArray, value:NDArray, shape:tuple, sort:bool = True):
+        self.shape = tuple(int(n) for n in shape)
+        self.ik = np.asarray(ik, dtype = np.int64)
+        self.ibnd = np.asarray(ibnd, dtype = np.int64)
+        self.iwfc = np.asarray(iwfc, dtype = np.int64)
+        self.value = np.asarray(value, dtype = np.float64)
+        if sort:
+            order = np.argsort(self.flat_index(), kind = "stable")
+            self.ik, self.ibnd, self.iwfc, self.value = self.ik[order], self.ibnd[order], self.iwfc[order], self.value[order]
+
+    @classmethod
+    def from_dense(cls, proj:NDArray):
+        """make SparseProjections from a dense (nk, nbnd, natomwfc) array.
+        """
+        ik, ibnd, iwfc = np.nonzero(proj)
+        return cls(ik, ibnd, iwfc, proj[ik, ibnd, iwfc], proj.shape, sort = False)
+
+    @classmethod
+    def concatenate(cls, parts:list, shape:tuple):
+        """concatenate SparseProjections (or (ik, ibnd, iwfc, value) tuples) whose elements do not overlap.
+        """
+        parts = [(part.ik, part.ibnd, part.iwfc, part.value) if isinstance(part, cls) else part for part in parts]
+        if not parts:
+            return cls(*[np.zeros(0)]*4, shape)
+        return cls(*[np.concatenate([part[i] for part in parts]) for i in range(4)], shape)
+
+    @property
+    def nnz(self):
+        """the number of stored elements.
+        """
+        return len(self.value)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def dtype(self):
+        return self.value.dtype
+
+    def flat_index(self):
+        """the index of each element in the flattened dense array.
+        """
+        return (self.ik*self.shape[1] + self.ibnd)*self.shape[2] + self.iwfc
+
+    def state_pointer(self):
+        """pointer to elements of each state (k, band) like indptr of the CSR format.
+
+        Elements of the state (ik, ibnd) are [pointer[ik*nbnd + ibnd], pointer[ik*nbnd + ibnd + 1]).
+        """
+        return np.searchsorted(self.ik*self.shape[1] + self.ibnd, np.arange(self.shape[0]*self.shape[1] + 1))
+
+    def todense(self):
+        """convert to a dense (nk, nbnd, natomwfc) array.
+        """
+        proj = np.zeros(self.shape)
+        proj[self.ik, self.ibnd, self.iwfc] = self.value
+        return proj
+
+    def select(self, kpoints:NDArray|None = None, bands:NDArray|None = None, atomwfcs:NDArray|None = None):
+        """select elements as proj[kpoints[:,None,None], bands[None,:,None], atomwfcs[None,None,:]] of a dense array.
+
+        Repeated indices in kpoints, bands and atomwfcs repeat elements as the dense array.
+
+        Returns
+        -------
+        SparseProjections
+            whose shape is (len(kpoints), len(bands), len(atomwfcs))
+        """
+        shape = list(self.shape)
+        indices = [self.ik, self.ibnd, self.iwfc]
+        value = self.value
+        for axis, selected in enumerate([kpoints, bands, atomwfcs]):
+            if selected is None:
+                continue
+            selected = np.asarray(selected, dtype = np.int64)
+            # positions of each index in selected are order[start:stop].
+            order = np.argsort(selected, kind = "stable")
+            start = np.searchsorted(selected[order], indices[axis], side = "left")
+            counts = np.searchsorted(selected[order], indices[axis], side = "right") - start
+            elements = np.repeat(np.arange(len(value)), counts)
+            offsets = np.arange(len(elements)) - np.repeat(np.cumsum(counts) - counts, counts)
+            indices = [index[elements] for index in indices]
+            indices[axis] = order[start[elements] + offsets]
+            value = value[elements]
+            shape[axis] = len(selected)
+        return SparseProjections(*indices, value, shape)
+
+    def sort_states(self, width:int|None = None):
+        """sort projectability of each state (k, band) in descending order.
+
+        Parameters
+        ----------
+        width : int | None, optional
+            the length of the last axis of returned arrays, which is at least the maximum 
+            number of stored elements in a state, by default None (the maximum number)
+
+        Returns
+        -------
+        tuple[NDArray, NDArray]
+            sorted values and indices of atomic wave functions whose shapes are (nk, nbnd, width).
+            The remaining elements are padded with 0 and -1, respectively.
+        """
+        nk, nbnd, _ = self.shape
+        state = self.ik*nbnd + self.ibnd
+        order = np.lexsort((-self.value, state))
+        state = state[order]
+        counts = np.bincount(state, minlength = nk*nbnd)
+        max_count = int(counts.max()) if self.nnz else 0
+        if width is None:
+            width = max_count
+        elif width < max_count:
+            raise ValueError(f"width, {width} is smaller than the number of elements in a state, {max_count}.")
+        rank = np.arange(self.nnz) - (np.cumsum(counts) - counts)[state]
+        values = np.zeros([nk*nbnd, width])
+        indices = np.full([nk*nbnd, width], -1)
+        values[state, rank] = self.value[order]
+        indices[state, rank] = self.iwfc[order]
+        return values.reshape(nk, nbnd, width), indices.reshape(nk, nbnd, width)
+
+    def zero_indices(self):
+        """indices of zero elements, which are the same as np.where(dense == 0).
+
+        A (nbnd, natomwfc) mask is made for each k point, so that the dense array is not made.
+        """
+        nk, nbnd, natomwfc = self.shape
+        kpointer = np.searchsorted(self.ik, np.arange(nk + 1))
+        result = [[], [], []]
+        for ik in range(nk):
+            mask = np.ones([nbnd, natomwfc], dtype = bool)
+            elements = slice(kpointer[ik], kpointer[ik + 1])
+            mask[self.ibnd[elements], self.iwfc[elements]] = self.value[elements] == 0
+            ibnd, iwfc = np.nonzero(mask)
+            result[0].append(np.full(len(ibnd), ik))
+            result[1].append(ibnd)
+            result[2].append(iwfc)
+        return tuple(np.concatenate(indices) if indices else np.zeros(0, dtype = np.int64) for indices in result)
+
+class OrbitalIndex:
+    """inverted index from atomic wave functions to states (k, band) whose projectability exceeds threshold.
+
+    Elements are grouped by atomic wave functions like the CSC format, and those of each
+    atomic wave function are sorted by (ik, ibnd). Thus, states with a large weight of an
+    atomic wave function are obtained by a slice.
+
+    Attributes
+    ----------
+    pointer: NDArray
+        (natomwfc + 1,) elements of the atomic wave function iwfc are [pointer[iwfc], pointer[iwfc + 1]).
+    ik: NDArray
+        k indices of elements.
+    ibnd: NDArray
+        band indices of elements.
+    weight: NDArray
+        projectability of elements.
+    threshold: float
+        only projectability larger than threshold is stored.
+    shape: tuple[int, int, int]
+        (nk, nbnd, natomwfc)
+    """
+    def __init__(self, proj:NDArray|SparseProjections, threshold:float = 0.1):
+        self.threshold = threshold
+        self.shape = tuple(int(n) for n in proj.shape)
+        if isinstance(proj, SparseProjections):
+            above = proj.value > threshold
+            ik, ibnd, iwfc, weight = proj.ik[above], proj.ibnd[above], proj.iwfc[above], proj.value[above]
+        else:
+            ik, ibnd, iwfc = np.nonzero(proj > threshold)
+            weight = proj[ik, ibnd, iwfc]
+        # elements are sorted by (ik, ibnd, iwfc), so a stable sort keeps the order of (ik, ibnd).
+        order = np.argsort(iwfc, kind = "stable")
+        self.ik, self.ibnd, self.weight = ik[order], ibnd[order], weight[order]
+        self.pointer = np.searchsorted(iwfc[order], np.arange(self.shape[2] + 1))
+
+    def __len__(self):
+        return len(self.weight)
+
+    def lookup(self, iwfc:int, ik:int|None = None):
+        """states where the projectability of iwfc exceeds threshold.
+
+        Parameters
+        ----------
+        iwfc : int
+            the index of the atomic wave function.
+        ik : int | None, optional
+            the index of the k point, by default None (all k points)
+
+        Returns
+        -------
+        tuple[NDArray, NDArray, NDArray]
+            k indices, band indices and projectability.
+        """
+        start, stop = self.pointer[iwfc], self.pointer[iwfc + 1]
+        if ik is not None:
+            start, stop = start + np.searchsorted(self.ik[start:stop], [ik, ik + 1])
+        return self.ik[start:stop], self.ibnd[start:stop], self.weight[start:stop]
+
+    def select(self, atomwfcs:NDArray|None = None):
+        """elements of atomwfcs.
+
+        Returns
+        -------
+        tuple[NDArray, NDArray, NDArray, NDArray]
+            k indices, band indices, indices of atomic wave functions and projectability.
+        """
+        atomwfcs = np.arange(self.shape[2]) if atomwfcs is None else np.asarray(atomwfcs, dtype = np.int64)
+        counts = self.pointer[atomwfcs + 1] - self.pointer[atomwfcs]
+        # indices of elements of atomwfcs without a python loop over atomic wave functions.
+        elements = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts - self.pointer[atomwfcs], counts)
+        return self.ik[elements], self.ibnd[elements], np.repeat(atomwfcs, counts), self.weight[elements]
@@ -0,0 +1,244 @@
+"""wannier
+
+This module contains a search of sets of atomic orbitals used as initial projections of Wannierization.
+
+Orbitals are grouped by shells (atom, wfc), each of which has 2l+1 orbitals. A set of shells is
+evaluated by the projectability of states in an energy window onto the orbitals of the set,
+    coverage_k = sum_{n in window} sum_{i in set} |<phi_i|psi_nk>|^2 / (the number of states in window at k),
+and the score of the set is mean_k(coverage_k) - uniformity*std_k(coverage_k).
+
+Example
+-------
+>>> search = ProjectionSearch(projwfcout, emin = -3, emax = 2)
+>>> candidates = search.search(num_wann = 5)
+>>> print(candidates[0].projections_block(projwfcout.pwxin))
+"""
+import numpy as np
+from numpy.typing import NDArray
+
+BOHR_TO_ANGSTROM = 0.529177210903
+
+class ProjectionSet:
+    """a set of shells of atomic orbitals and its projectability.
+
+    Attributes
+    ----------
+    shells: list[tuple[int, str, int, int]]
+        (atom index (python index), element, l, radial index r (1 for the lowest shell of l in the atom)) of shells.
+    orbitals: NDArray
+        indices of atomic wave functions in the set (python index).
+    coverage: NDArray
+        (nk,) mean projectability of states in the window at each k point.
+        NaN at k points without states in the window.
+    score: float
+        mean(coverage) - uniformity*std(coverage).
+    """
+    def __init__(self, shells:list[tuple], orbitals:NDArray, coverage:NDArray, score:float):
+        self.shells = shells
+        self.orbitals = orbitals
+        self.coverage = coverage
+        self.score = score
+
+    @property
+    def num_wann(self):
+        return len(self.orbitals)
+
+    @property
+    def mean(self):
+        return float(np.nanmean(self.coverage))
+
+    @property
+    def std(self):
+        return float(np.nanstd(self.coverage))
+
+    def projections_block(self, pwxin = None, atom_names:list[str]|None = None)->str:
+        """the projections block of the input of Wannier90.
+
+        If all atoms of an element have the same shells in the set, the shells are written for the element
+        (e.g. "V:l=2"), otherwise for the position of each atom (e.g. "f=0.5,0.5,0.5:l=2"),
+        which needs pwxin.
+
+        Parameters
+        ----------
+        pwxin : PWxIn | None, optional
+            the input of pw.x for the positions of atoms, by default None
+        atom_names : list[str] | None, optional
+            elements of all atoms, by default None (obtained from pwxin or shells)
+
+        Returns
+        -------
+        str
+        """
+        if atom_names is None:
+            atom_names = [name for name, _ in pwxin.atom_positions] if pwxin else None
+        atom_shells:dict[int, list[tuple[int, int]]] = {}
+        for iatom, _, l, r in self.shells:
+            atom_shells.setdefault(iatom, []).append((l, r))
+        names = {iatom: element for iatom, element, _, _ in self.shells}
+        lines = ["begin projections"]
+        written = set()
+        for iatom, shells in atom_shells.items():
+            element = names[iatom]
+            same_atoms = [i for i, name in enumerate(atom_names) if name == element] if atom_names else None
+            if same_atoms and all(sorted(atom_shells.get(i, [])) == sorted(shells) for i in same_atoms):
+                if element in written:
+                    continue
+                written.add(element)
+                site = element
+            else:
+                site = self._site(iatom, pwxin)
+            for l, r in shells:
+                lines.append(f"{site}:l={l}" + (f":r={r}" if r > 1 else ""))
+        lines.append("end projections")
+        return "\n".join(lines)
+
+    @staticmethod
+    def _site(iatom:int, pwxin)->str:
+        """the position of an atom in the format of the projections block.
+        """
+        if pwxin is None:
+            raise ValueError("pwxin is necessary to write the positions of atoms.")
+        position = pwxin.atom_positions[iatom][1]
+        unit = pwxin.card_dict["ATOMIC_POSITIONS"].get("options", "alat").strip("{}()").lower()
+        if unit == "crystal":
+            return "f=" + ",".join(f"{x:.6f}" for x in position)
+        elif unit == "angstrom":
+            return "c=" + ",".join(f"{x:.6f}" for x in position)
+        elif unit == "bohr":
+            return "c=" + ",".join(f"{x*BOHR_TO_ANGSTROM:.6f}" for x in position)
+        elif unit == "alat":
+            alat = ProjectionSet._alat(pwxin)
+            return "c=" + ",".join(f"{x*alat:.6f}" for x in position)
+        raise NotImplementedError(f"positions in {unit} unit are not implemented.")
+
+    @staticmethod
+    def _alat(pwxin)->float:
+        """the lattice parameter in angstrom from celldm(1) (bohr) or A (angstrom) of &SYSTEM.
+        """
+        system = {key.replace(" ", "").lower(): value for key, value in pwxin.namelist_dict.get("&SYSTEM", {}).items()}
+        if "celldm(1)" in system:
+            return float(system["celldm(1)"].lower().replace("d", "e"))*BOHR_TO_ANGSTROM
+        elif "a" in system:
+            return float(system["a"].lower().replace("d", "e"))
+        raise ValueError("celldm(1) or A is necessary to write positions in alat unit.")
+
+    def __str__(self):
+        shells = " ".join(f"{iatom + 1}{element}:l={l}" + (f":r={r}" if r > 1 else "")
+                          for iatom, element, l, r in self.shells)
+        return f"{self.score:.4f} (mean {self.mean:.4f}, std {self.std:.4f}) {shells}"
+
+class ProjectionSearch:
+    """search sets of shells of atomic orbitals with large and uniform projectability in an energy window.
+
+    Projectability of states in the window summed over orbitals of each shell at each k point is
+    computed once, so that the projectability of a set is a sum of precomputed vectors.
+
+    Attributes
+    ----------
+    shells: list[tuple[int, str, int, int]]
+        (atom index, element, l, radial index) of shells.
+    shell_orbitals: list[NDArray]
+        indices of atomic wave functions of each shell.
+    partial_sums: NDArray
+        (num_shells, nk) projectability of states in the window onto each shell divided by num_states.
+    num_states: NDArray
+        (nk,) the number of states in the window at each k point.
+    """
+    def __init__(self, projwfcout, emin:float|None = None, emax:float|None = None):
+        """
+        Parameters
+        ----------
+        projwfcout : ProjwfcOut
+        emin, emax : float | None, optional
+            the energy window relative to the Fermi energy, by default None (no bound)
+        """
+        if projwfcout.soc:
+            raise NotImplementedError("soc case is not implemented.")
+        ik, ibnd = projwfcout.energy_index.states(emin, emax)
+        proj = projwfcout.get_state_projections(ik, ibnd)
+        self.num_states = np.bincount(ik, minlength = projwfcout.nk)
+        orbital_sums = np.zeros([projwfcout.nk, projwfcout.natomwfc])
+        np.add.at(orbital_sums, ik, proj)
+
+        self.shells, self.shell_orbitals = [], []
+        keys = list(zip(projwfcout.iatom, projwfcout.wfc))
+        for key in dict.fromkeys(keys):
+            iatom, wfc = key
+            orbitals = np.array([i for i, other in enumerate(keys) if other == key])
+            l = int(projwfcout.l[orbitals[0]])
+            # shells with the same l in the atom are distinguished by the radial index.
+            r = 1 + sum(1 for atom, _, other_l, _ in self.shells if atom == iatom and other_l == l)
+            self.shells.append((int(iatom), str(projwfcout.elements[orbitals[0]]).strip(), l, r))
+            self.shell_orbitals.append(orbitals)
+        self.shell_sizes = np.array([len(orbitals) for orbitals in self.shell_orbitals])
+        with np.errstate(invalid = "ignore", divide = "ignore"):
+            self.partial_sums = np.stack([orbital_sums[:, orbitals].sum(axis = 1) for orbitals in self.shell_orbitals])/self.num_states
+        self.partial_sums[:, self.num_states == 0] = np.nan
+
+    def scores(self, sums:NDArray, uniformity:float = 1.0)->NDArray:
+        """scores of sets from their projectability.
+
+        Parameters
+        ----------
+        sums : NDArray
+            (..., nk) projectability of sets at each k point.
+        uniformity : float, optional
+            the weight of the standard deviation over k points, by default 1.0
+        """
+        return np.nanmean(sums, axis = -1) - uniformity*np.nanstd(sums, axis = -1)
+
+    def search(self, num_wann:int, beam_width:int = 20, num_results:int = 5, uniformity:float = 1.0)->list[ProjectionSet]:
+        """beam search of sets of shells whose number of orbitals is num_wann.
+
+        Sets are grown by adding one shell at a time, and beam_width partial sets with the highest scores
+        are kept at each step. If beam_width = 1, this is a greedy search.
+
+        Parameters
+        ----------
+        num_wann : int
+            the number of Wannier functions (orbitals in a set).
+        beam_width : int, optional
+            the number of partial sets kept at each step, by default 20
+        num_results : int, optional
+            the number of returned sets, by default 5
+        uniformity : float, optional
+            the weight of the standard deviation over k points in scores, by default 1.0
+
+        Returns
+        -------
+        list[ProjectionSet]
+            sets in descending order of scores.
+        """
+        num_shells = len(self.shells)
+        beams = [(frozenset(), 0, np.zeros(self.partial_sums.shape[1]))]
+        complete:dict[frozenset, NDArray] = {}
+        while beams:
+            candidates:dict[frozenset, tuple[int, NDArray]] = {}
+            for members, size, sums in beams:
+                addable = np.array([i for i in range(num_shells)
+                                    if i not in members and size + self.shell_sizes[i] <= num_wann], dtype = int)
+                if len(addable) == 0:
+                    continue
+                new_sums = sums[None,:] + self.partial_sums[addable]
+                for i, new_sum in zip(addable, new_sums):
+                    new_members = members | {int(i)}
+                    if size + self.shell_sizes[i] == num_wann:
+                        complete[new_members] = new_sum
+                    elif new_members not in candidates:
+                        candidates[new_members] = (size + self.shell_sizes[i], new_sum)
+            if not candidates:
+                break
+            members = list(candidates)
+            scores = self.scores(np.stack([candidates[m][1] for m in members]), uniformity)
+            beams = [(members[i], *candidates[members[i]]) for i in np.argsort(-scores, kind = "stable")[:beam_width]]
+        if not complete:
+            return []
+        members = list(complete)
+        scores = self.scores(np.stack([complete[m] for m in members]), uniformity)
+        results = []
+        for i in np.argsort(-scores, kind = "stable")[:num_results]:
+            shells = sorted(members[i])
+            results.append(ProjectionSet([self.shells[j] for j in shells],
+                                         np.concatenate([self.shell_orbitals[j] for j in shells]),
+                                         complete[members[i]], float(scores[i])))
+        return results
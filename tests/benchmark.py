@@ -0,0 +1,270 @@
+"""benchmark
+
+This module contains a benchmark of readers of qe_utils on synthetic files of several sizes.
+
+Each reader is timed (the best of repeats by time.perf_counter) and memory-profiled
+(the peak of memory allocated during a run by tracemalloc), and results are written as JSON
+so that results of two versions are compared.
+
+Example
+-------
+$ python -m tests.benchmark --sizes small,medium --output new.json --compare old.json
+"""
+import gc
+import sys
+import json
+import time
+import platform
+import subprocess
+import tempfile
+import tracemalloc
+from pathlib import Path
+from typing import Callable
+import click
+import numpy as np
+
+from tests.synthetic import write_projwfc_out, write_filband, write_pdos_dir, write_pwx_input
+
+# size -> the parameters of generators. If "files" is given, only the files are generated.
+SIZES = {
+    "tiny"  : dict(nk = 4, nbnd = 8, natom = 2, ne = 50),
+    "small" : dict(nk = 20, nbnd = 20, natom = 4, ne = 500),
+    "medium": dict(nk = 200, nbnd = 60, natom = 16, ne = 2000),
+    "large" : dict(nk = 1000, nbnd = 200, natom = 50, ne = 5000),
+    # 10^5 k points x 500 bands (about 440 MiB) for the reader of filband.
+    "bands" : dict(nk = 100000, nbnd = 500, natom = 2, ne = 50, files = ["filband"]),
+}
+FILE_KINDS = ["projwfc_out", "filband", "filband_gnu", "pdos_dir", "pwx_input"]
+# the regex engine is too slow to run for large sizes.
+REGEX_SIZES = ["tiny", "small", "medium"]
+# modules whose import times are measured.
+IMPORTED_MODULES = ["qe_utils.projwfc", "qe_utils.bands", "qe_utils.pwx_in", "qe_utils.cli.projwfc",
+                    "qe_utils.cli.bands", "qe_utils.cli.write_plotband", "qe_utils.cli.command_script"]
+
+def make_files(directory:str|Path, size:str)->dict[str, Path]:
+    """write synthetic files of a size in a directory.
+
+    Returns
+    -------
+    dict[str, Path]
+        "projwfc_out", "filband", "filband_gnu", "pdos_dir" and "pwx_input".
+    """
+    directory = Path(directory)
+    params = SIZES[size]
+    kinds = params.get("files", FILE_KINDS)
+    files = dict(projwfc_out = directory/"projwfc.out", filband = directory/"bands.dat",
+                 filband_gnu = directory/"bands.dat.gnu", pdos_dir = directory/"pdos",
+                 pwx_input = directory/"scf.in")
+    if "projwfc_out" in kinds:
+        write_projwfc_out(files["projwfc_out"], nk = params["nk"], nbnd = params["nbnd"], natom = params["natom"])
+    if "filband" in kinds or "filband_gnu" in kinds:
+        write_filband(files["filband"], nk = params["nk"], nbnd = params["nbnd"], gnu = "filband_gnu" in kinds)
+    if "pdos_dir" in kinds:
+        write_pdos_dir(files["pdos_dir"], natom = params["natom"], ne = params["ne"])
+    if "pwx_input" in kinds:
+        write_pwx_input(files["pwx_input"], natom = params["natom"])
+    return {kind: file for kind, file in files.items() if kind in kinds}
+
+def readers(files:dict[str, Path], size:str)->dict[str, Callable]:
+    """readers to be benchmarked for files of make_files.
+    """
+    from qe_utils.projwfc import ProjwfcOut
+    from qe_utils.bands import Filband, Filbandgnu
+    from qe_utils.pdos import PdosSet, find_pdos_files, read_pdos_files
+    from qe_utils.namelist import NameList
+    from qe_utils.pwx_in import PWxIn
+
+    params = SIZES[size]
+    projwfc_out = str(files.get("projwfc_out"))
+    pdos_files = find_pdos_files(files["pdos_dir"])[0] if "pdos_dir" in files else None
+    # reader -> (the kind of the file, the function reading it)
+    cases = {
+        "ProjwfcOut.header"        : ("projwfc_out", lambda: ProjwfcOut(projwfc_out).natomwfc),
+        "ProjwfcOut.bulk"          : ("projwfc_out", lambda: ProjwfcOut(projwfc_out).read_projections()),
+        "ProjwfcOut.bulk_sparse"   : ("projwfc_out", lambda: ProjwfcOut(projwfc_out, sparse = True).read_projections()),
+        "ProjwfcOut.regex"         : ("projwfc_out", lambda: ProjwfcOut(projwfc_out, engine = "regex").read_projections()),
+        "Filband"                  : ("filband", lambda: Filband(str(files["filband"]))),
+        "Filbandgnu"               : ("filband_gnu", lambda: Filbandgnu(files["filband_gnu"], params["nk"], params["nbnd"])),
+        "read_pdos_files"          : ("pdos_dir", lambda: read_pdos_files(files["pdos_dir"], pdos_files)),
+        "PdosSet.from_dir"         : ("pdos_dir", lambda: PdosSet.from_dir(files["pdos_dir"])),
+        "NameList"                 : ("pwx_input", lambda: NameList(str(files["pwx_input"]))),
+        "PWxIn.from_pwx_input"     : ("pwx_input", lambda: PWxIn.from_pwx_input(str(files["pwx_input"]))),
+    }
+    if size not in REGEX_SIZES:
+        del cases["ProjwfcOut.regex"]
+    return {name: func for name, (kind, func) in cases.items() if kind in files}
+
+def file_sizes(files:dict[str, Path])->dict[str, int]:
+    """bytes of files read by each reader.
+    """
+    sizes = {kind: file.stat().st_size for kind, file in files.items() if kind != "pdos_dir"}
+    if "pdos_dir" in files:
+        sizes["pdos_dir"] = sum(file.stat().st_size for file in files["pdos_dir"].iterdir())
+    return {reader: sizes[kind] for reader, kind in [("ProjwfcOut", "projwfc_out"), ("Filband", "filband"),
+                                                     ("Filbandgnu", "filband_gnu"), ("read_pdos_files", "pdos_dir"),
+                                                     ("PdosSet", "pdos_dir"), ("NameList", "pwx_input"),
+                                                     ("PWxIn", "pwx_input")] if kind in sizes}
+
+def measure(func:Callable, repeat:int = 3)->tuple[float, int]:
+    """the best time of repeats and the peak memory of a run of func.
+
+    The peak memory is measured in a separate run, since tracemalloc slows down allocations.
+
+    Returns
+    -------
+    tuple[float, int]
+        time in seconds and peak memory in bytes.
+    """
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(times), peak
+
+def import_time(module:str, repeat:int = 3)->float:
+    """the best cumulative import time [sec] of module in a new process by python -X importtime.
+    """
+    times = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], 
+                                capture_output = True, text = True, check = True)
+        for line in result.stderr.splitlines():
+            if line.startswith("import time:") and line.split("|")[-1].strip() == module:
+                times.append(int(line.split("|")[1])*1e-6)
+    return min(times)
+
+def metadata()->dict:
+    """versions of python, numpy and qe_utils.
+    """
+    from importlib.metadata import version, PackageNotFoundError
+    try:
+        qe_utils_version = version("qe-utils")
+    except PackageNotFoundError:
+        qe_utils_version = None
+    return dict(python = platform.python_version(), numpy = np.__version__, qe_utils = qe_utils_version,
+                platform = platform.platform(), timestamp = time.strftime("%Y-%m-%dT%H:%M:%S"))
+
+def run_benchmark(sizes:list[str], repeat:int = 3, readers_filter:list[str]|None = None,
+                  echo:Callable|None = None)->dict:
+    """benchmark readers for sizes.
+
+    Parameters
+    ----------
+    sizes : list[str]
+        keys of SIZES.
+    repeat : int, optional
+        the number of timed runs of each reader, by default 3
+    readers_filter : list[str] | None, optional
+        names of readers benchmarked, by default None (all readers)
+    echo : Callable | None, optional
+        a function printing progress, by default None
+
+    Returns
+    -------
+    dict
+        "metadata" and "results", a list of dicts of reader, size, time (s), peak_memory (bytes) and file_size (bytes).
+    """
+    results = []
+    for size in sizes:
+        if size not in SIZES:
+            raise ValueError(f"size, {size} is invalid.")
+        with tempfile.TemporaryDirectory() as directory:
+            files = make_files(directory, size)
+            bytes_read = file_sizes(files)
+            for name, func in readers(files, size).items():
+                if readers_filter and name not in readers_filter:
+                    continue
+                elapsed, peak = measure(func, repeat)
+                result = dict(reader = name, size = size, time = elapsed, peak_memory = peak,
+                              file_size = bytes_read[name.split(".")[0]],
+                              **{key: value for key, value in SIZES[size].items() if key != "files"})
+                results.append(result)
+                if echo:
+                    echo(format_result(result))
+    return dict(metadata = metadata(), results = results)
+
+def format_result(result:dict)->str:
+    return "{:<24s} {:<7s} {:10.4f} s {:10.2f} MiB {:10.2f} MiB/s".format(
+        result["reader"], result["size"], result["time"], result["peak_memory"]/2**20,
+        result["file_size"]/2**20/result["time"] if result["time"] > 0 else np.inf)
+
+def engine_speedups(results:dict)->dict[str, float]:
+    """the time of the regex engine of ProjwfcOut divided by that of the bulk engine for each size.
+    """
+    times = {(result["reader"], result["size"]): result["time"] for result in results["results"]}
+    return {size: times[("ProjwfcOut.regex", size)]/times[("ProjwfcOut.bulk", size)] 
+            for reader, size in times if reader == "ProjwfcOut.regex" and times.get(("ProjwfcOut.bulk", size), 0) > 0}
+
+def compare_results(new:dict, old:dict, threshold:float = 1.2)->list[dict]:
+    """ratios (new/old) of time and peak memory of readers in both results.
+
+    Parameters
+    ----------
+    new, old : dict
+        results of run_benchmark.
+    threshold : float, optional
+        a ratio over which a reader is regarded as a regression, by default 1.2
+
+    Returns
+    -------
+    list[dict]
+        reader, size, time_ratio, memory_ratio and regression of readers in both results.
+    """
+    old_results = {(result["reader"], result["size"]): result for result in old["results"]}
+    comparison = []
+    for result in new["results"]:
+        key = (result["reader"], result["size"])
+        if key not in old_results:
+            continue
+        time_ratio = result["time"]/old_results[key]["time"] if old_results[key]["time"] > 0 else np.inf
+        memory_ratio = result["peak_memory"]/old_results[key]["peak_memory"] if old_results[key]["peak_memory"] > 0 else np.inf
+        comparison.append(dict(reader = key[0], size = key[1], time_ratio = time_ratio, memory_ratio = memory_ratio,
+                               regression = bool(time_ratio > threshold or memory_ratio > threshold)))
+    return comparison
+
+@click.command()
+@click.option("--sizes", default = "small,medium", show_default = True,
+              help = f"comma separated sizes of synthetic files in {list(SIZES)}.")
+@click.option("--repeat", default = 3, show_default = True, help = "the number of timed runs of each reader.")
+@click.option("--readers", "readers_filter", default = None, help = "comma separated names of readers benchmarked.")
+@click.option("-o", "--output", default = None, help = "the JSON file where results are written.")
+@click.option("--compare", default = None, help = "the JSON file of previous results compared with new results.")
+@click.option("--threshold", default = 1.2, show_default = True, help = "the ratio regarded as a regression.")
+@click.option("--imports", is_flag = True, help = "also measure import times of modules of qe_utils.")
+def benchmark(sizes, repeat, readers_filter, output, compare, threshold, imports):
+    """benchmark readers of qe_utils on synthetic files.
+    """
+    readers_filter = readers_filter.split(",") if readers_filter else None
+    results = run_benchmark(sizes.split(","), repeat, readers_filter, echo = click.echo)
+    results["engine_speedups"] = engine_speedups(results)
+    for size, speedup in results["engine_speedups"].items():
+        click.echo(f"ProjwfcOut bulk engine is {speedup:.1f} times faster than regex engine ({size})")
+    if imports:
+        results["import_times"] = {module: import_time(module, repeat) for module in IMPORTED_MODULES}
+        for module, elapsed in results["import_times"].items():
+            click.echo(f"import {module:<28s} {elapsed:10.4f} s")
+    if output:
+        with open(output, "w") as fp:
+            json.dump(results, fp, indent = 2)
+    if compare:
+        with open(compare) as fp:
+            old = json.load(fp)
+        comparison = compare_results(results, old, threshold)
+        click.echo(f"{'reader':<24s} {'size':<7s} {'time':>8s} {'memory':>8s}")
+        for item in comparison:
+            click.echo("{:<24s} {:<7s} {:8.3f} {:8.3f}{}".format(item["reader"], item["size"], item["time_ratio"],
+                                                                 item["memory_ratio"], "  REGRESSION" if item["regression"] else ""))
+        if any(item["regression"] for item in comparison):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,261 @@
+"""synthetic
+
+This module contains generators of synthetic outputs of Quantum ESPRESSO in the formats
+read by qe_utils, so that readers are tested and benchmarked for arbitrary sizes.
+
+Each generator writes files and returns the values written in them (after rounding to the
+printed precision), which readers must reproduce.
+
+Example
+-------
+>>> truth = write_projwfc_out("projwfc.out", nk = 100, nbnd = 40, natom = 8)
+>>> ProjwfcOut("projwfc.out").read_projections() # == truth["proj"]
+"""
+import numpy as np
+from numpy.typing import NDArray
+from pathlib import Path
+
+ELEMENTS = ["V", "O"]
+SPD = "spdf"
+
+def make_states(natom:int, natomwfc:int|None = None, elements:list[str] = ELEMENTS):
+    """atomic states (atom, wfc, l, m) in the order of projwfc.x.
+
+    If natomwfc is None, atoms of the even indices have s, p and d shells and the others have s and p shells.
+    Otherwise, shells with l = 0, 1, 2, 0, ... are added to atoms in turn until natomwfc states are made
+    (s shells are added if a shell does not fit).
+
+    Returns
+    -------
+    dict
+        "iatom", "wfc" (Fortran index), "l", "m" of states and "elements" of atoms.
+    """
+    shells:list[list[int]] = [[] for _ in range(natom)]
+    if natomwfc is None:
+        for iatom in range(natom):
+            shells[iatom] = [0, 1, 2] if iatom % 2 == 0 else [0, 1]
+    else:
+        remaining, turn = natomwfc, 0
+        while remaining > 0:
+            iatom = turn % natom
+            l = len(shells[iatom]) % 3
+            if 2*l + 1 > remaining:
+                l = 0
+            shells[iatom].append(l)
+            remaining -= 2*l + 1
+            turn += 1
+    iatom, wfc, l, m = [], [], [], []
+    for atom, atom_shells in enumerate(shells):
+        for iwfc, shell_l in enumerate(atom_shells):
+            for shell_m in range(2*shell_l + 1):
+                iatom.append(atom)
+                wfc.append(iwfc + 1)
+                l.append(shell_l)
+                m.append(shell_m + 1)
+    return dict(iatom = np.array(iatom), wfc = np.array(wfc), l = np.array(l), m = np.array(m),
+                elements = [elements[atom % len(elements)] for atom in range(natom)])
+
+def write_projwfc_out(file:str|Path, nk:int = 10, nbnd:int = 20, natom:int = 2, natomwfc:int|None = None,
+                      terms:int = 6, seed:int = 0):
+    """write the standard output of projwfc.x.
+
+    Each state (k, band) projects onto terms consecutive atomic wave functions with random weights
+    whose sum is in [0.7, 1]. Weights are printed as f5.3 in descending order, 5 terms per line.
+
+    Parameters
+    ----------
+    file : str | Path
+        the output file.
+    nk, nbnd : int, optional
+        the numbers of k points and bands, by default 10 and 20
+    natom : int, optional
+        the number of atoms, by default 2
+    natomwfc : int | None, optional
+        the number of atomic wave functions, by default None (see make_states)
+    terms : int, optional
+        the maximum number of atomic wave functions printed for a state, by default 6
+    seed : int, optional
+        the seed of random numbers, by default 0
+
+    Returns
+    -------
+    dict
+        "k", "ek", "proj" and the states of make_states.
+    """
+    rng = np.random.default_rng(seed)
+    states = make_states(natom, natomwfc)
+    natomwfc = len(states["iatom"])
+    terms = min(terms, natomwfc)
+    k = np.round(rng.random([nk, 3]), 10)
+    ek = np.round(np.sort(rng.uniform(-20, 10, [nk, nbnd]), axis = 1), 5)
+    weights = rng.dirichlet(np.ones(terms), size = nk*nbnd)*rng.uniform(0.7, 1, [nk*nbnd, 1])
+    weights = np.round(weights, 3)
+    orbitals = (rng.integers(0, natomwfc, [nk*nbnd, 1]) + np.arange(terms)) % natomwfc
+    proj = np.zeros([nk*nbnd, natomwfc])
+    np.put_along_axis(proj, orbitals, weights, axis = 1)
+    order = np.argsort(-weights, axis = 1, kind = "stable")
+    weights, orbitals = np.take_along_axis(weights, order, axis = 1), np.take_along_axis(orbitals, order, axis = 1)
+
+    lines = [
+        "",
+        "     Program PROJWFC v.7.3.1 starts on  1Jan2024 at  0: 0: 0 ",
+        "",
+        " ",
+        "  Problem Sizes ",
+        f"  natomwfc = {natomwfc:12d}",
+        f"  nbnd     = {nbnd:12d}",
+        f"  nkstot   = {nk:12d}",
+        f"  npwx     = {1000:12d}",
+        f"  nkb      = {4*natom:12d}",
+        " ",
+        "",
+        "     Atomic states used for projection",
+        "     (read from pseudopotential files):",
+        "",
+    ]
+    for istate in range(natomwfc):
+        iatom = states["iatom"][istate]
+        lines.append(f"     state #{istate + 1:4d}: atom {iatom + 1:3d} ({states['elements'][iatom]:<3s}), "
+                     f"wfc {states['wfc'][istate]:2d} (l={states['l'][istate]:1d} m={states['m'][istate]:2d})")
+    lines.append("")
+    with open(file, "w") as fp:
+        fp.write("\n".join(lines) + "\n")
+        for ik in range(nk):
+            block = [" k = " + "".join(f"{x:14.10f}" for x in k[ik])]
+            for ibnd in range(nbnd):
+                state = ik*nbnd + ibnd
+                block.append(f"==== e({ibnd + 1:4d}) = {ek[ik, ibnd]:11.5f} eV ==== ")
+                pairs = [f"{w:5.3f}*[#{i + 1:4d}]" for w, i in zip(weights[state], orbitals[state]) if w >= 0.001]
+                if pairs:
+                    block.append("     psi = " + "+".join(pairs[:5]))
+                    block += ["          +" + "+".join(pairs[i:i + 5]) for i in range(5, len(pairs), 5)]
+                else:
+                    block.append(" ")
+                block.append(f"    |psi|^2 = {weights[state].sum():5.3f}")
+            fp.write("\n".join(block) + "\n\n")
+        fp.write("Lowdin Charges: \n\n")
+        for iatom in range(natom):
+            fp.write(f"     Atom #{iatom + 1:4d}: total charge = {4.0:8.4f}, s = {1.0:7.4f}, \n")
+        fp.write("     Spilling Parameter:   0.0100\n")
+    return dict(k = k, ek = ek, proj = proj.reshape(nk, nbnd, natomwfc), **states)
+
+def write_filband(file:str|Path, nk:int = 10, nbnd:int = 20, seed:int = 0, gnu:bool = True, chunk_size:int = 1 << 20):
+    """write filband of bands.x and its .gnu file.
+
+    Lines are formatted by a single %-formatting for chunks of about chunk_size energies.
+
+    Returns
+    -------
+    dict
+        "k" (nk, 3), "bands_en" (nk, nbnd) and "gnu" (nbnd, nk, 2, None if gnu is False) written in the files.
+    """
+    rng = np.random.default_rng(seed)
+    k = np.round(rng.random([nk, 3]), 6)
+    bands_en = np.round(np.sort(rng.uniform(-20, 10, [nk, nbnd]), axis = 1), 3)
+    # the format of a k point and its energies by (10f9.3).
+    kpoint_format = "%20.6f%10.6f%10.6f\n" + "".join("%9.3f" + ("\n" if (i + 1) % 10 == 0 or i == nbnd - 1 else "")
+                                                    for i in range(nbnd))
+    step = max(1, chunk_size//max(nbnd, 1))
+    with open(file, "w") as fp:
+        fp.write(f" &plot nbnd={nbnd:4d}, nks={nk:6d} /\n")
+        for start in range(0, nk, step):
+            rows = np.concatenate([k[start:start + step], bands_en[start:start + step]], axis = 1)
+            fp.write((kpoint_format*len(rows)) % tuple(rows.ravel().tolist()))
+    if not gnu:
+        return dict(k = k, bands_en = bands_en, gnu = None)
+    # the length of the path and energies in the .gnu file.
+    path = np.round(np.concatenate([[0], np.cumsum(np.linalg.norm(np.diff(k, axis = 0), axis = 1))]), 4)
+    gnu = np.stack([np.broadcast_to(path, (nbnd, nk)), np.round(bands_en.T, 4)], axis = -1)
+    with open(f"{file}.gnu", "w") as fp:
+        for ibnd in range(nbnd):
+            fp.write(("%10.4f%10.4f\n"*nk) % tuple(gnu[ibnd].ravel().tolist()) + "\n")
+    return dict(k = k, bands_en = bands_en, gnu = gnu)
+
+def _fortran_e11_3(values:NDArray)->list[str]:
+    """format values as e11.3 of Fortran (e.g. "  0.165E-07")."""
+    exponent = np.where(values != 0, np.floor(np.log10(np.abs(values), where = values != 0, out = np.zeros_like(values))) + 1, 0)
+    mantissa = np.round(values/10.0**exponent, 3)
+    carry = np.abs(mantissa) >= 1
+    exponent, mantissa = exponent + carry, np.where(carry, np.round(values/10.0**(exponent + carry), 3), mantissa)
+    return [f"{m:7.3f}E{int(e):+03d}" for m, e in zip(mantissa.tolist(), exponent.tolist())]
+
+def write_pdos_dir(pdos_dir:str|Path, natom:int = 2, natomwfc:int|None = None, ne:int = 500, prefix:str = "pwscf", seed:int = 0):
+    """write pdos files of projwfc.x for the states of make_states.
+
+    Energies are printed as f8.3 and dos as e11.3.
+
+    Returns
+    -------
+    list[str]
+        names of written pdos files.
+    """
+    rng = np.random.default_rng(seed)
+    pdos_dir = Path(pdos_dir)
+    pdos_dir.mkdir(parents = True, exist_ok = True)
+    states = make_states(natom, natomwfc)
+    energies = -20 + 0.01*np.arange(ne)
+    energy_fields = [f"{e:8.3f}" for e in energies]
+    files = []
+    total = np.zeros(ne)
+    for iatom, wfc in dict.fromkeys(zip(states["iatom"].tolist(), states["wfc"].tolist())):
+        l = int(states["l"][(states["iatom"] == iatom) & (states["wfc"] == wfc)][0])
+        pdos = rng.random([ne, 2*l + 1])*np.exp(-((energies[:, None] - rng.uniform(-10, 5))/2)**2)
+        pdos[pdos < 1e-30] = 0 # exponents of e11.3 have 2 digits.
+        table = np.concatenate([pdos.sum(axis = 1, keepdims = True), pdos], axis = 1)
+        total += table[:, 0]
+        file = f"{prefix}.pdos_atm#{iatom + 1}({states['elements'][iatom]})_wfc#{wfc}({SPD[l]})"
+        fields = np.array(_fortran_e11_3(table.ravel())).reshape(table.shape)
+        with open(pdos_dir/file, "w") as fp:
+            fp.write("# E (eV)  ldos(E)  " + "pdos(E)    "*(2*l + 1) + "\n")
+            fp.write("".join(energy + "".join(row) + "\n" for energy, row in zip(energy_fields, fields.tolist())))
+        files.append(file)
+    fields = np.array(_fortran_e11_3(np.stack([total, total], axis = 1).ravel())).reshape(ne, 2)
+    with open(pdos_dir/f"{prefix}.pdos_tot", "w") as fp:
+        fp.write("# E (eV)  dos(E)    pdos(E)\n")
+        fp.write("".join(energy + "".join(row) + "\n" for energy, row in zip(energy_fields, fields.tolist())))
+    return files
+
+def write_pwx_input(file:str|Path, natom:int = 2, nk:int = 4, seed:int = 0):
+    """write an input file of pw.x (scf) for natom atoms of ELEMENTS in a cubic cell.
+
+    Returns
+    -------
+    dict
+        "elements" and "positions" (crystal coordinates) of atoms.
+    """
+    rng = np.random.default_rng(seed)
+    elements = [ELEMENTS[iatom % len(ELEMENTS)] for iatom in range(natom)]
+    positions = np.round(rng.random([natom, 3]), 10)
+    species = list(dict.fromkeys(elements))
+    lines = [
+        "&CONTROL",
+        "  calculation = 'scf'",
+        "  outdir = './out/'",
+        "  prefix = 'synthetic'",
+        "  pseudo_dir = './pseudo/'",
+        "/",
+        "&SYSTEM",
+        "  ecutwfc =   4.0000000000d+01",
+        "  ibrav = 0",
+        f"  nat = {natom}",
+        f"  ntyp = {len(species)}",
+        "  occupations = 'smearing'",
+        "  degauss =   1.0000000000d-02",
+        "/",
+        "&ELECTRONS",
+        "  conv_thr =   1.0000000000d-08",
+        "/",
+        "ATOMIC_SPECIES",
+        *[f"{element}      1.000 {element}.upf" for element in species],
+        "ATOMIC_POSITIONS crystal",
+        *[f"{element}  {x:18.10f}{y:18.10f}{z:18.10f}" for element, (x, y, z) in zip(elements, positions)],
+        "K_POINTS automatic",
+        f"{nk} {nk} {nk} 0 0 0",
+        "CELL_PARAMETERS angstrom",
+        "      5.0000000000       0.0000000000       0.0000000000",
+        "      0.0000000000       5.0000000000       0.0000000000",
+        "      0.0000000000       0.0000000000       5.0000000000",
+    ]
+    with open(file, "w") as fp:
+        fp.write("\n".join(lines) + "\n")
+    return dict(elements = elements, positions = positions)
@@ -2,6 +2,7 @@ from qe_utils.bands import *
 from qe_utils.pwx_in import PWxIn
 import time
 import numpy as np
+import pytest
 
 def test_filband():
     start = time.time()
@@ -19,8 +20,65 @@ def test_filband():
     np.testing.assert_almost_equal(filband.e_max, e_max)
     np.testing.assert_almost_equal(filband.e_min, e_min)
     
-def test_filband_gnu():
+def test_filband_gnu(tmp_path):
     filband = Filband("tests/models/test_bands.out")
     filbandgnu = Filbandgnu.from_Filband(filband)
     print(filbandgnu.ek)
-    filbandgnu.plot(savefig = "tests/models/test_filband.pdf", pwxin = PWxIn.from_pwx_input("tests/models/test_band_nscf.in"))
\ No newline at end of file
+    filbandgnu.plot(savefig = tmp_path/"test_filband.pdf", pwxin = PWxIn.from_pwx_input("tests/models/test_band_nscf.in"))
+
+def test_energy_index():
+    filband = Filband("tests/models/bands.dat")
+    index = filband.energy_index
+    assert filband.energy_index is index
+    for emin, emax in [(-1, 1), (None, -10), (5.0, None), (100, 200)]:
+        mask = (filband.bands_en >= (-np.inf if emin is None else emin)) & (filband.bands_en <= (np.inf if emax is None else emax))
+        np.testing.assert_array_equal(np.stack(index.states(emin, emax)), np.nonzero(mask))
+        np.testing.assert_array_equal(index.bands(emin, emax), np.flatnonzero(mask.any(axis = 0)))
+    edge = filband.bands_en[3, 7]
+    assert np.ravel_multi_index((3, 7), filband.bands_en.shape) in index.window(edge, edge)
+
+def test_filband_layouts(tmp_path):
+    from tests.synthetic import write_filband
+    file = tmp_path/"bands.dat"
+    # the last line of each k point is ragged (nbnd % 10 != 0) and nbnd has 4 digits.
+    for nk, nbnd in [(5, 23), (3, 10), (2, 1234), (1, 3)]:
+        truth = write_filband(file, nk = nk, nbnd = nbnd, gnu = False)
+        for chunk_size in [1, 1 << 18]:
+            filband = Filband(str(file))
+            filband.read(chunk_size = chunk_size)
+            assert (filband.num_k, filband.num_band) == (nk, nbnd)
+            np.testing.assert_array_equal(filband.k_list, truth["k"])
+            np.testing.assert_array_equal(filband.bands_en, truth["bands_en"])
+    # values separated by spaces but not in the fixed-width layout.
+    file.write_text(" &plot nbnd=   3, nks=     2 /\n 0.5 0 0\n -1.25 0.5 2\n 0 0 0.25\n 3 4\n 5\n")
+    filband = Filband(str(file))
+    np.testing.assert_array_equal(filband.k_list, [[0.5, 0, 0], [0, 0, 0.25]])
+    np.testing.assert_array_equal(filband.bands_en, [[-1.25, 0.5, 2], [3, 4, 5]])
+    # values which cannot be converted are not skipped.
+    file.write_text(" &plot nbnd=   3, nks=     2 /\n 0.5 0 0\n -1.25 0.5 2\n 0 0 0.25\n 3 4\n 5x\n")
+    with pytest.raises(ValueError):
+        Filband(str(file))
+
+def test_filbandgnu_layouts(tmp_path):
+    from tests.synthetic import write_filband
+    # blank lines of bands.x contain a space.
+    filbandgnu = Filbandgnu("tests/models/test_bands.out.gnu", 122, 39)
+    assert filbandgnu.k_path.shape == (122,) and filbandgnu.energies.shape == (39, 122)
+    assert filbandgnu.ek.shape == (39, 122, 2)
+    np.testing.assert_array_equal(filbandgnu.ek[:, :, 0], np.broadcast_to(filbandgnu.k_path, (39, 122)))
+    assert (filbandgnu.k_path[1], filbandgnu.energies[0, 0], filbandgnu.energies[-1, -1]) == (0.025, -53.9418, 31.8748)
+    file = tmp_path/"bands.dat"
+    for nk, nbnd in [(5, 23), (1, 1), (7, 1)]:
+        truth = write_filband(file, nk = nk, nbnd = nbnd)
+        filbandgnu = Filband(str(file)).get_filbandgnu()
+        np.testing.assert_array_equal(filbandgnu.k_path, truth["gnu"][0, :, 0])
+        np.testing.assert_array_equal(filbandgnu.energies, truth["gnu"][:, :, 1])
+        np.testing.assert_array_equal(filbandgnu.ek, truth["gnu"])
+    # values separated by spaces but not in the fixed-width layout.
+    (tmp_path/"other.gnu").write_text("0 -1.5\n1 2\n\n0 3\n1 4.25\n")
+    filbandgnu = Filbandgnu(tmp_path/"other.gnu", 2, 2)
+    np.testing.assert_array_equal(filbandgnu.k_path, [0, 1])
+    np.testing.assert_array_equal(filbandgnu.energies, [[-1.5, 2], [3, 4.25]])
+    (tmp_path/"other.gnu").write_text("0 -1.5\n1 2\n\n0 3\n1 4.25x\n")
+    with pytest.raises(ValueError):
+        Filbandgnu(tmp_path/"other.gnu", 2, 2)
@@ -0,0 +1,48 @@
+from qe_utils.cache import ArrayCache
+import os
+import numpy as np
+
+def test_array_cache(tmp_path):
+    source = tmp_path/"source.txt"
+    source.write_text("1 2 3\n")
+    cache = ArrayCache()
+    assert cache.load(source) is None
+    cache.save(source, {"a": np.arange(3)}, {"n": 3})
+    assert cache.entry_dir(source).parent == tmp_path
+    arrays, data = cache.load(source)
+    assert isinstance(arrays["a"], np.memmap)
+    np.testing.assert_array_equal(arrays["a"], np.arange(3))
+    assert data == {"n": 3}
+    
+    # only mtime is changed.
+    os.utime(source, ns = (0, 0))
+    assert cache.load(source) is not None
+    
+    # the content is changed.
+    source.write_text("1 2 4\n")
+    assert cache.load(source) is None
+    assert not cache.entry_dir(source).exists()
+    
+def test_array_cache_eviction(tmp_path):
+    cache = ArrayCache(tmp_path/"cache", max_bytes = 3000)
+    for i in range(3):
+        source = tmp_path/f"source{i}.txt"
+        source.write_text(str(i))
+        cache.save(source, {"a": np.zeros(100)})
+        os.utime(cache.entry_dir(source), (i, i))
+    assert cache.load(tmp_path/"source0.txt") is None
+    assert cache.load(tmp_path/"source2.txt") is not None
+
+def test_array_cache_dependencies(tmp_path):
+    source, dependency = tmp_path/"source.txt", tmp_path/"dependency.txt"
+    source.write_text("1 2 3\n")
+    dependency.write_text("4 5 6\n")
+    cache = ArrayCache()
+    cache.save(source, {"a": np.arange(3)}, dependencies = [dependency])
+    # an entry saved with other dependencies is invalid.
+    assert cache.load(source) is None
+    cache.save(source, {"a": np.arange(3)}, dependencies = [dependency])
+    os.utime(dependency, ns = (0, 0))
+    assert cache.load(source, dependencies = [dependency]) is not None
+    dependency.write_text("4 5 7\n")
+    assert cache.load(source, dependencies = [dependency]) is None
@@ -1,7 +1,11 @@
 import os
+import json
+import numpy as np
 from click.testing import CliRunner
 from qe_utils.cli.command_script import make_qe_command_script
 from qe_utils.cli.write_plotband import make_plotband_input
+from qe_utils.cli.projwfc import projwfc
+from qe_utils.projwfc import ProjwfcOut
 
 def test_make_qe_command_script():
     #TODO: make more precise test.
@@ -25,3 +29,142 @@ def test_make_plotband_input():
 
     
     
+def test_projwfc_stream():
+    runner = CliRunner()
+    args = ["--pdos_dir", "tests/models/bands", "--no_cache", "tests/models/bands/projwfc.out", "tests/models/scf.in"]
+    result = runner.invoke(projwfc, args + ["projections", "--kpoints", "0 5", "--threshold", "0.1"])
+    assert result.exit_code == 0
+    streamed = runner.invoke(projwfc, args + ["projections", "--kpoints", "0 5", "--threshold", "0.1", "--stream"])
+    assert streamed.exit_code == 0
+    assert result.output == streamed.output
+    selection = ["--kpoints", "0 5", "--bands", "3 1 2", "--atomwfcs", "2:6", "--threshold", "0.05"]
+    result = runner.invoke(projwfc, args + ["projections"] + selection)
+    streamed = runner.invoke(projwfc, args + ["projections", "--stream"] + selection)
+    assert result.output == streamed.output and len(result.output.splitlines()) > 1
+    selection = ["--kpoints", "0 5", "--emin", "-6", "--emax", "0", "--threshold", "0.05"]
+    result = runner.invoke(projwfc, args + ["projections"] + selection)
+    streamed = runner.invoke(projwfc, args + ["projections", "--stream"] + selection)
+    assert result.output == streamed.output
+    assert all(-6 <= float(line.split()[3]) <= 0 for line in result.output.splitlines()[2:])
+    result = runner.invoke(projwfc, args + ["top-orbs", "-n", "2", "--kpoints", "0 5"])
+    assert result.exit_code == 0
+    lines = result.output.splitlines()
+    states = lines[lines.index("# k-index, band-index, energy, (wfc-index, projection) * num") + 1:]
+    assert len(states) == 2*len([line for line in result.output.splitlines() if line.startswith("  0 ")])
+    assert all(len(line.split()) <= 3 + 2*2 for line in states)
+    result = runner.invoke(projwfc, args + ["sort-orbs", "--emin", "-5", "--emax", "2", "--source", "projections"])
+    assert result.exit_code == 0
+    print(result.output)
+    
+def test_projwfc_projections_repeated_indices():
+    import itertools
+    runner = CliRunner()
+    args = ["--pdos_dir", "tests/models/bands", "tests/models/bands/projwfc.out", "tests/models/scf.in"]
+    selection = ["--kpoints", "5 0 5", "--bands", "3 1 3", "--atomwfcs", "2 0 2", "--threshold", "0"]
+    result = runner.invoke(projwfc, args + ["projections"] + selection)
+    assert result.exit_code == 0
+    projwfcout = ProjwfcOut("tests/models/bands/projwfc.out", pdos_dir = "tests/models/bands")
+    proj = projwfcout.read_projections()
+    expected = [(ik, ibnd, iwfc) for ik, ibnd, iwfc in itertools.product([5, 0, 5], [3, 1, 3], [2, 0, 2])
+                if proj[ik, ibnd, iwfc] > 0]
+    assert [tuple(int(value) for value in line.split()[:3]) for line in result.output.splitlines()[1:]] == expected
+    streamed = runner.invoke(projwfc, args + ["projections", "--stream"] + selection)
+    assert sorted(streamed.output.splitlines()) == sorted(result.output.splitlines())
+
+def test_projwfc_sort_orbs_windows():
+    runner = CliRunner()
+    args = ["--pdos_dir", "tests/models", "--no_cache", "--fermi", "10", "tests/models/bands/projwfc.out", "tests/models/SrVO3_scf.in"]
+    result = runner.invoke(projwfc, args + ["sort-orbs", "--window", "-2:4", "--window", "-1:1"])
+    assert result.exit_code == 0
+    assert result.output.count("energy range is") == 2
+    result = runner.invoke(projwfc, args + ["sort-orbs", "--emin", "-2", "--emax", "2", "--sliding", "1:0.5"])
+    assert result.exit_code == 0
+    assert result.output.count("energy range is") == 7
+    result = runner.invoke(projwfc, args + ["sort-orbs", "--window", "-2:4", "--group_by", "element,l"])
+    assert result.exit_code == 0
+    lines = result.output.splitlines()
+    assert lines[lines.index("energy range is -2.0:4.0") + 1].startswith("('V', 'd')")
+
+def test_projwfc_output_formats(tmp_path):
+    runner = CliRunner()
+    args = ["--pdos_dir", "tests/models/bands", "--no_cache", "tests/models/bands/projwfc.out", "tests/models/scf.in"]
+    selection = ["projections", "--kpoints", "0 5", "--threshold", "0.05"]
+    text = runner.invoke(projwfc, args + selection).output.splitlines()
+    rows = text[text.index("# k-index, band-index, wfc-index, energy, projection") + 1:]
+    expected = np.array([[float(value) for value in row.split()] for row in rows])
+    for stream in [[], ["--stream"]]:
+        csv = runner.invoke(projwfc, args + selection + stream + ["--format", "csv"]).output.splitlines()
+        csv = csv[csv.index("ik,ibnd,iwfc,energy,projection") + 1:]
+        np.testing.assert_allclose(np.array([row.split(",") for row in csv], dtype = float), expected, atol = 5e-4)
+    jsonl = runner.invoke(projwfc, args + selection + ["--format", "jsonl"]).output.splitlines()
+    jsonl = [json.loads(line) for line in jsonl if line.startswith("{")]
+    assert [row["iwfc"] for row in jsonl] == expected[:,2].astype(int).tolist()
+    result = runner.invoke(projwfc, args + selection + ["--format", "npy", "-o", str(tmp_path/"proj.npy")])
+    assert result.exit_code == 0
+    table = np.load(tmp_path/"proj.npy")
+    assert table.dtype.names == ("ik", "ibnd", "iwfc", "energy", "projection")
+    np.testing.assert_array_equal(table["ibnd"], expected[:,1])
+    np.testing.assert_allclose(table["projection"], expected[:,4], atol = 5e-4)
+    assert runner.invoke(projwfc, args + selection + ["--format", "npz"]).exit_code != 0
+    
+    result = runner.invoke(projwfc, args + ["kpoints", "--format", "npz", "-o", str(tmp_path/"k.npz")])
+    assert result.exit_code == 0
+    with np.load(tmp_path/"k.npz") as kpoints:
+        assert kpoints["kx"].shape == kpoints["ik"].shape == (274,)
+    result = runner.invoke(projwfc, args + ["states", "--format", "csv", "-o", str(tmp_path/"states.csv")])
+    assert result.exit_code == 0
+    assert (tmp_path/"states.csv").read_text().splitlines()[:2] == ["index,atom,x,y,z,l,m", "0,C,0.0,1.4202816622,0.0,0,1"]
+    args = ["--pdos_dir", "tests/models", "--no_cache", "--fermi", "10", "tests/models/bands/projwfc.out", "tests/models/SrVO3_scf.in"]
+    result = runner.invoke(projwfc, args + ["sort-orbs", "--window", "-2:4", "--window", "-1:1", "--group_by", "element,l", "--format", "jsonl"])
+    rows = [json.loads(line) for line in result.output.splitlines() if line.startswith("{")]
+    assert len(rows) == 2*len(set(row["label"] for row in rows))
+    assert rows[0] == {**rows[0], "emin": -2, "emax": 4, "label": "('V', 'd')"} and rows[0]["value"] >= rows[1]["value"]
+    result = runner.invoke(projwfc, args + ["sort-orbs", "--emin", "-2", "--emax", "4", "--format", "csv"])
+    assert result.output.splitlines()[1] == "emin,emax,index,label,value"
+
+def test_projwfc_lazy_stages(monkeypatch):
+    instances = []
+    class RecordedProjwfcOut(ProjwfcOut):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            instances.append(self)
+    monkeypatch.setattr("qe_utils.cli.projwfc.ProjwfcOut", RecordedProjwfcOut)
+    runner = CliRunner()
+    args = ["--pdos_dir", "tests/models", "--no_cache", "--fermi", "10", "tests/models/bands/projwfc.out", "tests/models/SrVO3_scf.in"]
+    for command, stages in [(["states"], ["header"]), 
+                            (["kpoints"], ["header", "projections"]),
+                            (["sort-orbs", "--emin", "-2", "--emax", "2"], ["labels", "pdos_files"]),
+                            (["sort-orbs", "--source", "projections"], ["header"]),
+                            (["sort-orbs", "--source", "projections", "--format", "csv"], ["header"])]:
+        result = runner.invoke(projwfc, args + command)
+        assert result.exit_code == 0
+        assert sorted(instances[-1].stages) == stages
+
+def test_projwfc_cache_option(tmp_path, monkeypatch):
+    monkeypatch.delenv("QE_UTILS_CACHE_DIR", raising = False)
+    runner = CliRunner()
+    args = ["--pdos_dir", "tests/models/bands", "tests/models/bands/projwfc.out", "tests/models/scf.in"]
+    # the cache is opt-in.
+    result = runner.invoke(projwfc, ["--cache_dir", str(tmp_path/"unused")] + args + ["kpoints"])
+    assert result.exit_code == 0
+    assert not (tmp_path/"unused").exists()
+    for _ in range(2):
+        cached = runner.invoke(projwfc, ["--cache", "--cache_dir", str(tmp_path/"cache")] + args + ["kpoints"])
+        assert cached.output == result.output
+    assert len(list((tmp_path/"cache").iterdir())) == 1
+
+def test_profile(tmp_path):
+    from qe_utils.cli.bands import bands
+    runner = CliRunner()
+    output = tmp_path/"profile.json"
+    args = ["--pdos_dir", "tests/models", "--no_cache", "--fermi", "10", "--profile", "--profile_output", str(output),
+            "tests/models/bands/projwfc.out", "tests/models/SrVO3_scf.in"]
+    result = runner.invoke(projwfc, args + ["sort-orbs", "--emin", "-2", "--emax", "2"])
+    assert result.exit_code == 0
+    profile = json.loads(output.read_text())
+    for name in ["PWxIn.from_pwx_input", "ProjwfcOut.pdos_files", "pdos.find_pdos_files", "PdosSet.from_dir"]:
+        assert profile[name]["calls"] >= 1 and profile[name]["time"] >= 0 and profile[name]["peak_memory"] >= 0
+    assert "ProjwfcOut.pdos_files" in result.stderr
+    result = runner.invoke(bands, ["--profile", "tests/models/bands/bands.dat", "band-info", "0"])
+    assert result.exit_code == 0
+    assert "Filband.read" in result.stderr and "Filband.read" not in result.stdout
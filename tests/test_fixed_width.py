@@ -0,0 +1,29 @@
+from qe_utils.fixed_width import parse_reals, parse_ints
+import numpy as np
+import pytest
+
+def to_chars(fields:list[str])->np.ndarray:
+    return np.frombuffer("".join(fields).encode(), dtype = np.uint8).reshape(len(fields), -1)
+
+def test_parse_reals():
+    rng = np.random.default_rng(0)
+    values = rng.normal(scale = 100, size = 1000)
+    for fmt in ["{:10.4f}", "{:9.3f}", "{:20.10f}", "{:12.4E}", "{:12.3e}"]:
+        fields = [fmt.format(value) for value in values]
+        np.testing.assert_array_equal(parse_reals(to_chars(fields)), [float(field) for field in fields])
+    # exponents out of exact powers of 10 and negative zero.
+    fields = ["  1.2345E-30", " -9.8765E+25", " -0.0000E+00"]
+    np.testing.assert_array_equal(parse_reals(to_chars(fields)), [float(field) for field in fields])
+    assert np.signbit(parse_reals(to_chars(fields))[2])
+    # fields of strided views.
+    chars = to_chars([f"{value:9.3f}" for value in values[:12]]).reshape(3, 2, 2, 9)[:, ::2]
+    np.testing.assert_array_equal(parse_reals(chars, 5), values[:12].round(3).reshape(3, 2, 2)[:, ::2])
+    assert parse_reals(np.zeros([0, 9], dtype = np.uint8)).shape == (0,)
+    for fields in [["  1.23", "  12.3"], ["  1.23", "  1,23"], [" 1.2E+0", " 1.2E+a"]]:
+        with pytest.raises(ValueError):
+            parse_reals(to_chars(fields))
+
+def test_parse_ints():
+    np.testing.assert_array_equal(parse_ints(to_chars(["   1", "-234", "  +5"])), [1, -234, 5])
+    with pytest.raises(ValueError):
+        parse_ints(to_chars(["   1", " 2.0"]))
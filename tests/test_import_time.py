@@ -0,0 +1,51 @@
+import subprocess
+import sys
+import pytest
+
+# budget of the cumulative import time of each module in multiples of that of numpy, 
+# which is measured in the same environment so that the budget does not depend on the machine.
+# qe_utils.projwfc takes about 2-3 times numpy, and the budgets are lenient not to be flaky.
+IMPORT_TIME_BUDGET = {
+    "qe_utils.projwfc": 8,
+    "qe_utils.bands": 8,
+    "qe_utils.pwx_in": 8,
+    "qe_utils.cli.projwfc": 8,
+    "qe_utils.cli.bands": 8,
+    "qe_utils.cli.write_plotband": 8,
+    "qe_utils.cli.command_script": 8,
+}
+
+def import_times(module:str)->dict[str, float]:
+    """cumulative import times [sec] of modules imported by "import module" from python -X importtime.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], 
+                            capture_output = True, text = True, check = True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative)*1e-6
+    return times
+
+def best_import_time(module:str, repeat:int = 3)->float:
+    """the best of a few runs not to be affected by the cold cache of the file system.
+    """
+    return min(import_times(module)[module] for _ in range(repeat))
+
+@pytest.fixture(scope = "module")
+def numpy_import_time():
+    return best_import_time("numpy")
+
+@pytest.mark.parametrize("module", list(IMPORT_TIME_BUDGET))
+def test_import_time(module, numpy_import_time):
+    elapsed = best_import_time(module)
+    print(f"{module}: {elapsed:.3f} [sec] ({elapsed/numpy_import_time:.1f} times numpy)")
+    assert elapsed < IMPORT_TIME_BUDGET[module]*numpy_import_time
+
+@pytest.mark.parametrize("module", list(IMPORT_TIME_BUDGET))
+def test_lazy_imports(module):
+    code = f"import sys, {module}; print(' '.join(sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], capture_output = True, text = True, check = True)
+    imported = {name.split(".")[0] for name in result.stdout.split()}
+    assert not imported & {"matplotlib", "scipy"}
@@ -0,0 +1,196 @@
+from qe_utils.pdos import PdosSet, find_pdos_files, read_pdos_file, read_pdos_files, vectorized, broadened_dos
+from qe_utils.projwfc import ProjwfcOut
+from qe_utils.cache import ArrayCache
+from pathlib import Path
+import os
+import shutil
+import time
+import numpy as np
+import scipy.integrate as integrate
+
+import pytest
+
+PDOS_DIR = "tests/models"
+
+@pytest.fixture(scope="module")
+def pdos_set():
+    return PdosSet.from_dir(PDOS_DIR)
+
+def test_pdos_set(pdos_set):
+    files = find_pdos_files(PDOS_DIR)[0]
+    assert pdos_set.files == files
+    assert pdos_set.data.shape == (len(files), 7959, 6)
+    for i in [0, len(files) - 1]:
+        table = np.loadtxt(str(Path(PDOS_DIR)/files[i]))
+        np.testing.assert_array_equal(pdos_set.energies, table[:,0])
+        np.testing.assert_array_equal(pdos_set.data[i, :, :table.shape[1] - 1], table[:,1:])
+        assert pdos_set.n_columns[i] == table.shape[1] - 1
+    d = files.index("pwscf.pdos_atm#10(V)_wfc#4(d)")
+    assert (pdos_set.atom_indices[d], pdos_set.atom_names[d], pdos_set.wfc_indices[d], pdos_set.angular[d]) == (10, "V", 4, "d")
+    assert pdos_set.n_columns[d] == 6
+    
+def test_pdos_set_cache(tmp_path, pdos_set):
+    pdos_dir = tmp_path/"pdos"
+    pdos_dir.mkdir()
+    for file in pdos_set.files[:3]:
+        shutil.copy(Path(PDOS_DIR)/file, pdos_dir/file)
+    cache = ArrayCache(tmp_path/"cache")
+    load = lambda: ProjwfcOut("tests/models/bands/projwfc.out", pdos_dir = str(pdos_dir), cache = cache).pdos
+    loaded = load()
+    entry = cache.entry_dir("tests/models/bands/projwfc.out", kind = "pdos")
+    assert (entry/"meta.json").is_file()
+    assert sorted(file.name for file in pdos_dir.iterdir()) == sorted(pdos_set.files[:3]) # nothing is written in pdos_dir.
+    cached = load()
+    np.testing.assert_array_equal(cached.data, loaded.data)
+    assert cached.files == loaded.files and cached.pdos_dir == pdos_dir
+    
+    # the cache is not used if a file is changed.
+    file = pdos_dir/loaded.files[0]
+    file.write_text(file.read_text().replace("E-", "E+", 1))
+    assert cache.load("tests/models/bands/projwfc.out", kind = "pdos", 
+                      dependencies = [pdos_dir/file for file in loaded.files]) is None
+    assert not np.array_equal(load().data, loaded.data)
+    
+    # the entry counts toward max_bytes.
+    ArrayCache(tmp_path/"cache", max_bytes = 0).evict()
+    assert not entry.exists()
+    
+def test_projwfcout_pdos(tmp_path, pdos_set):
+    projwfcout = ProjwfcOut("tests/models/bands/projwfc.out", pdos_dir = PDOS_DIR, fermi = 10, 
+                            cache = ArrayCache(tmp_path/"cache"))
+    order, contribution = projwfcout.sort_orbs_by_pdos_contribution(energy_range = [-2, 4])
+    energies = pdos_set.energies - 10
+    expected = pdos_set.ldos[:, (-2 <= energies) & (energies <= 4)].max(axis = 1)
+    np.testing.assert_array_equal(contribution, expected[order])
+    assert projwfcout.pdos is projwfcout.pdos # loaded once.
+    assert len(list((tmp_path/"cache").glob("*/meta.json"))) == 1
+    order, contribution = projwfcout.sort_orbs_by_pdos_contribution(energy_range = [-2, 4], group_by = "element")
+    assert [projwfcout.pdos.group_index("element")[0][i] for i in order] == ["V", "O", "Sr"]
+    projwfcout.plot_pdos(savefig = str(tmp_path/"pdos.pdf"), group_by = "element")
+    
+def test_read_pdos_files(tmp_path, pdos_set):
+    # 4 copies of the pdos files as a benchmark.
+    files = []
+    for i in range(4):
+        for file in pdos_set.files:
+            shutil.copy(Path(PDOS_DIR)/file, tmp_path/f"{i}{file}")
+            files.append(f"{i}{file}")
+    times = {}
+    start = time.time()
+    expected = [np.loadtxt(str(tmp_path/file)) for file in files]
+    times["loadtxt"] = time.time() - start
+    for max_workers in [1, 4]:
+        start = time.time()
+        tables = read_pdos_files(tmp_path, files, max_workers = max_workers)
+        times[f"read_pdos_files ({max_workers} workers)"] = time.time() - start
+        for table, expected_table in zip(tables, expected):
+            np.testing.assert_array_equal(table, expected_table)
+    print(times)
+    
+def test_read_pdos_file_fallback(tmp_path):
+    pdos_file = tmp_path/"pwscf.pdos_atm#1(C)_wfc#1(s)"
+    pdos_file.write_text("# E (eV)  ldos(E)  pdos(E)\n -1.000  0.100E+01  0.100E+01\n  -0.5 1.5e-3 1.5e-3\n")
+    np.testing.assert_array_equal(read_pdos_file(pdos_file), [[-1, 1, 1], [-0.5, 1.5e-3, 1.5e-3]])
+    pdos_file.write_text("# E (eV)  ldos(E)  pdos(E)\n -1.000  0.100E+01  0.100E+01\n -0.500  0.150E-29 -0.150E+30")
+    np.testing.assert_array_equal(read_pdos_file(pdos_file), [[-1, 1, 1], [-0.5, 0.15e-29, -0.15e30]])
+    
+@pytest.mark.parametrize("contribution_type", ["max", "integral", "mean", "centroid", "band_center"])
+def test_pdos_contributions(pdos_set, contribution_type):
+    energies = pdos_set.energies - 10
+    window = (-2 <= energies) & (energies <= 4)
+    start = time.time()
+    contributions = pdos_set.contributions([-2, 4], contribution_type, fermi = 10)
+    print(f"{contribution_type}: {time.time() - start} [sec]")
+    for i in [0, 10, len(pdos_set.files) - 1]:
+        dos = pdos_set.ldos[i]
+        if contribution_type == "max":
+            expected = dos[window].max()
+        elif contribution_type == "integral":
+            expected = integrate.simpson(dos[window], x = energies[window])
+        elif contribution_type == "mean":
+            expected = dos[window].mean()
+        elif contribution_type == "centroid":
+            expected = np.sum(energies[window]*dos[window])/np.sum(dos[window])
+        else:
+            expected = (integrate.simpson(energies[window]*dos[window], x = energies[window])
+                        /integrate.simpson(dos[window], x = energies[window]))
+        np.testing.assert_allclose(contributions[i], expected, rtol = 1e-10)
+    
+def test_pdos_contributions_callable(pdos_set):
+    np.testing.assert_array_equal(pdos_set.contributions([-2, 4], np.max, fermi = 10), 
+                                  pdos_set.contributions([-2, 4], "max", fermi = 10))
+    @vectorized
+    def weight_below_fermi(dos, energies):
+        return dos[:, energies < 0].sum(axis = -1)
+    np.testing.assert_array_equal(pdos_set.contributions(None, weight_below_fermi, fermi = 10), 
+                                  pdos_set.ldos[:, pdos_set.energies < 10].sum(axis = -1))
+    assert np.all(pdos_set.contributions([100, 200], "integral") == 0)
+    with pytest.raises(ValueError):
+        pdos_set.contributions(None, "median")
+    
+def test_pdos_scan(pdos_set):
+    windows = np.concatenate([[[-2, 4], [-60, 60], [100, 200], [0, 0.005]], PdosSet.sliding_windows(-5, 5, 1, 0.5)])
+    assert len(windows) == 4 + 19
+    start = time.time()
+    orders, integrals = pdos_set.scan(windows, fermi = 10)
+    print("scan time of {} windows: {} [sec]".format(len(windows), time.time() - start))
+    means = pdos_set.scan(windows, "mean", fermi = 10)[1]
+    energies = pdos_set.energies - 10
+    for order, integral, mean, (emin, emax) in zip(orders, integrals, means, windows):
+        window = (emin <= energies) & (energies <= emax)
+        expected = integrate.trapezoid(pdos_set.ldos[:, window], x = energies[window], axis = -1) if window.sum() > 1 else np.zeros(len(order))
+        np.testing.assert_allclose(integral, expected[order], atol = 1e-10)
+        expected = pdos_set.ldos[:, window].mean(axis = -1) if window.any() else np.zeros(len(order))
+        np.testing.assert_allclose(np.sort(mean), np.sort(expected), atol = 1e-12)
+    with pytest.raises(ValueError):
+        pdos_set.scan(windows, "max")
+    
+def test_pdos_group_by(pdos_set):
+    labels, grouped = pdos_set.grouped("element")
+    assert labels == ["O", "Sr", "V"]
+    for label, dos in zip(labels, grouped):
+        np.testing.assert_allclose(dos, pdos_set.data[pdos_set.atom_names == label].sum(axis = 0))
+    labels, matrix = pdos_set.group_index(["atom", "l"])
+    assert (10, "d") in labels
+    np.testing.assert_array_equal(matrix.sum(axis = 0), 1)
+    labels, grouped = pdos_set.grouped({"apical": [20, 21], "V": [7, 8, 9, 10, 11]})
+    assert labels == ["apical", "V"]
+    np.testing.assert_allclose(grouped[0], pdos_set.data[np.isin(pdos_set.atom_indices, [20, 21])].sum(axis = 0))
+    
+    contributions = pdos_set.contributions([-2, 4], "integral", fermi = 10, group_by = "l")
+    labels, grouped = pdos_set.grouped("l")
+    for i, label in enumerate(labels):
+        np.testing.assert_allclose(contributions[i], PdosSet(PDOS_DIR, [f"x.pdos_atm#1(X)_wfc#1({label})"], pdos_set.energies, 
+                                                             grouped[i:i+1], [1]).contributions([-2, 4], "integral", fermi = 10)[0])
+    orders, values = pdos_set.scan([[-2, 4]], fermi = 10, group_by = "l")
+    file_values = pdos_set.scan([[-2, 4]], fermi = 10)
+    np.testing.assert_allclose(np.sort(values[0]), np.sort(pdos_set.group_index("l")[1] @ file_values[1][0][np.argsort(file_values[0][0])]))
+    with pytest.raises(ValueError):
+        pdos_set.group_index("site")
+
+@pytest.mark.parametrize("smearing", ["gaussian", "lorentzian"])
+def test_compute_pdos(pdos_set, smearing):
+    projwfcout = ProjwfcOut("tests/models/bands/projwfc.out", pdos_dir = "tests/models/bands", fermi = 0)
+    computed = projwfcout.compute_pdos(0.1, smearing = smearing)
+    energies = computed.energies
+    assert energies[0] == pytest.approx(projwfcout.ek.min() - 0.3)
+    assert energies[-1] >= projwfcout.ek.max() + 0.3 - 0.01
+    np.testing.assert_allclose(np.diff(energies), 0.01)
+    # the same columns as the output of projwfc.x; ldos and pdos of each m.
+    for expected in [pdos_set, computed]:
+        np.testing.assert_array_equal(expected.n_columns, [{"s": 2, "p": 4, "d": 6}[angular] for angular in expected.angular])
+    assert computed.files[1] == "pwscf.pdos_atm#1(C)_wfc#2(p)"
+    np.testing.assert_allclose(computed.data[:, :, 0], computed.data[:, :, 1:].sum(axis = 2))
+    if smearing == "gaussian":
+        # each state contributes its weight times the projectability.
+        weights = np.zeros(len(computed.files))
+        file_index = [computed.files.index(f"pwscf.pdos_atm#{iatom + 1}(C)_wfc#{wfc}({'spdf'[l]})") 
+                      for iatom, wfc, l in zip(projwfcout.iatom, projwfcout.wfc, projwfcout.l)]
+        np.add.at(weights, file_index, 2/projwfcout.nk*projwfcout.proj.sum(axis = (0, 1)))
+        np.testing.assert_allclose(integrate.trapezoid(computed.ldos, energies), weights, rtol = 1e-6)
+        assert integrate.trapezoid(computed.total[:, 0], energies) == pytest.approx(2*projwfcout.nbnd)
+    chunked = broadened_dos(projwfcout.ek, projwfcout.proj, energies, 0.1, smearing, max_elements = 1)
+    np.testing.assert_allclose(chunked[0], broadened_dos(projwfcout.ek, projwfcout.proj, energies, 0.1, smearing)[0])
+    assert projwfcout.pdos is computed
+    order, _ = projwfcout.sort_orbs_by_pdos_contribution([-2, 2], "integral")
+    assert [computed.angular[i] for i in order[:2]] == ["p", "p"]
@@ -0,0 +1,47 @@
+from qe_utils.profiling import Profiler, PROFILER, profiled, profiled_iter
+import numpy as np
+import pytest
+
+@pytest.fixture
+def profiler():
+    PROFILER.reset()
+    PROFILER.enable()
+    yield PROFILER
+    PROFILER.disable()
+    PROFILER.reset()
+
+def test_profiler():
+    profiler = Profiler()
+    with profiler.stage("disabled"):
+        pass
+    assert profiler.stats == {}
+    profiler.enable()
+    for _ in range(3):
+        with profiler.stage("outer"):
+            before = np.ones(1 << 17) # 1 MiB
+            with profiler.stage("inner"):
+                array = np.ones(1 << 18) # 2 MiB
+                del array
+            del before
+    profiler.disable()
+    assert list(profiler.stats) == ["inner", "outer"]
+    assert profiler.stats["outer"].calls == profiler.stats["inner"].calls == 3
+    assert profiler.stats["outer"].time >= profiler.stats["inner"].time > 0
+    assert 2*2**20 <= profiler.stats["inner"].peak_memory < 2.5*2**20
+    assert 3*2**20 <= profiler.stats["outer"].peak_memory < 3.5*2**20
+    assert "outer" in profiler.report()
+
+def test_profiled(profiler):
+    @profiled("square")
+    def square(x):
+        return x*x
+    assert square(3) == 9
+    assert list(profiled_iter(range(4), "range")) == [0, 1, 2, 3]
+    assert profiler.to_dict()["square"]["calls"] == 1
+    # the last step raising StopIteration is also recorded.
+    assert profiler.to_dict()["range"]["calls"] == 5
+    profiler.disable()
+    items = range(4)
+    assert profiled_iter(items, "range") is items
+    square(2)
+    assert profiler.to_dict()["square"]["calls"] == 1
@@ -1,8 +1,12 @@
 from qe_utils.projwfc import ProjwfcOut
 from qe_utils.pwx_in import PWxIn
+from qe_utils.cache import ArrayCache
+from qe_utils.sparse_proj import SparseProjections
 import os
 import numpy as np
 import time
+import re
+import shutil
 
 import pytest
 
@@ -66,6 +70,315 @@ def test_sort_atom_proj(projwfcout):
     print(indices[0,0,:]) # at (k=0, ek[iband = 0])
     print(projection[0,0,:])
     
+@pytest.fixture(scope="module")
+def graphene_projwfcout():
+    return ProjwfcOut("tests/models/bands/projwfc.out", pdos_dir = "tests/models/bands")
+
+def test_read_projections_graphene(graphene_projwfcout):
+    proj = graphene_projwfcout.read_projections()
+    assert proj.shape == (274, 60, 8)
+    np.testing.assert_allclose(graphene_projwfcout.k[1], [0.005, 0.0028867513, 0.0])
+    np.testing.assert_allclose(graphene_projwfcout.k[-1], [0.0, 0.0, 0.0])
+    np.testing.assert_almost_equal(graphene_projwfcout.ek[0,0], -21.91161)
+    np.testing.assert_allclose(proj[0,0], [0.492, 0, 0, 0, 0.492, 0, 0, 0])
+    
+@pytest.mark.parametrize("engine", ["regex", "bulk"])
+def test_read_projections_parallel(graphene_projwfcout, engine):
+    proj = graphene_projwfcout.read_projections()
+    start = time.time()
+    parallel = ProjwfcOut("tests/models/bands/projwfc.out", pdos_dir = "tests/models/bands", nproc = 2, engine = engine)
+    parallel.read_projections()
+    end = time.time()
+    print("parallel read time: {} [sec]".format(end - start))
+    assert parallel.proj.tobytes() == proj.tobytes()
+    assert parallel.ek.tobytes() == graphene_projwfcout.ek.tobytes()
+    assert parallel.k.tobytes() == graphene_projwfcout.k.tobytes()
+    
+def scale_projwfc_out(file, scaled_file, repeat:int):
+    """write an output of projwfc.x whose k blocks are repeated."""
+    with open(file) as fp:
+        content = fp.read()
+    start = content.index(" k = ")
+    end = content.index("Lowdin Charges")
+    nkstot = int(re.search(r"nkstot *= *([0-9]+)", content).group(1))
+    header = re.sub(r"nkstot *= *[0-9]+", f"nkstot   = {nkstot*repeat:12d}", content[:start])
+    with open(scaled_file, "w") as fp:
+        fp.write(header + content[start:end]*repeat + content[end:])
+    
+def test_read_projections_bulk(tmp_path):
+    scaled_file = tmp_path/"projwfc.out"
+    scale_projwfc_out("tests/models/bands/projwfc.out", scaled_file, 4)
+    results = {}
+    for engine in ["regex", "bulk"]:
+        projwfcout = ProjwfcOut(str(scaled_file), pdos_dir = str(tmp_path), engine = engine)
+        projwfcout.read_projections()
+        results[engine] = projwfcout
+    assert results["bulk"].proj.shape == (274*4, 60, 8)
+    for attr in ["k", "ek", "proj"]:
+        assert getattr(results["bulk"], attr).tobytes() == getattr(results["regex"], attr).tobytes()
+    
+def test_projwfc_cache(tmp_path, graphene_projwfcout):
+    projwfc_out = tmp_path/"projwfc.out"
+    shutil.copy("tests/models/bands/projwfc.out", projwfc_out)
+    ProjwfcOut(str(projwfc_out), pdos_dir = str(tmp_path), cache = True).read_projections()
+    
+    cache = ArrayCache(tmp_path/"cache")
+    ProjwfcOut(str(projwfc_out), pdos_dir = str(tmp_path), cache = cache).read_projections()
+    start = time.time()
+    cached = ProjwfcOut(str(projwfc_out), pdos_dir = str(tmp_path), cache = cache)
+    print("load time from cache: {} [sec]".format(time.time() - start))
+    assert cached.proj_read
+    assert isinstance(cached.proj, np.memmap)
+    proj = graphene_projwfcout.read_projections()
+    for attr in ["k", "ek", "proj", "iatom", "l", "m"]:
+        np.testing.assert_array_equal(getattr(cached, attr), getattr(graphene_projwfcout, attr))
+    for attr in ["natomwfc", "nbnd", "nkstot", "npwx", "nkb", "nk", "start_projection_block"]:
+        assert getattr(cached, attr) == getattr(graphene_projwfcout, attr)
+    assert not cached.soc
+    
+@pytest.mark.parametrize(["engine", "nproc"], [("bulk", None), ("regex", None), ("bulk", 2)])
+def test_sparse_projections(graphene_projwfcout, engine, nproc):
+    proj = graphene_projwfcout.read_projections()
+    sparse = ProjwfcOut("tests/models/bands/projwfc.out", pdos_dir = "tests/models/bands", 
+                        sparse = True, engine = engine, nproc = nproc)
+    sparse_proj = sparse.read_projections()
+    assert isinstance(sparse_proj, SparseProjections)
+    assert sparse_proj.nnz == np.count_nonzero(proj)
+    print("nnz / size: {}".format(sparse_proj.nnz/proj.size))
+    np.testing.assert_array_equal(sparse_proj.todense(), proj)
+    
+    selection = dict(kpoints = [3, 0, 10], bands = np.arange(5), atomwfcs = [4, 0])
+    np.testing.assert_array_equal(sparse.get_projections(**selection).todense(),
+                                  graphene_projwfcout.get_projections(**selection))
+    np.testing.assert_array_equal(np.array(sparse.get_zero_projections(**selection)),
+                                  np.array(graphene_projwfcout.get_zero_projections(**selection)))
+    
+    # repeated indices are kept as the dense case.
+    repeated = dict(kpoints = [3, 3, 0], bands = [2, 0, 2], atomwfcs = [4, 0, 4, 4])
+    np.testing.assert_array_equal(sparse.get_projections(**repeated).todense(),
+                                  graphene_projwfcout.get_projections(**repeated))
+    
+    values, indices = sparse.sort_atom_proj()
+    dense_values, dense_indices = graphene_projwfcout.sort_atom_proj()
+    assert values.shape == indices.shape
+    assert values.shape[2] == np.count_nonzero(proj, axis = 2).max() < dense_values.shape[2]
+    np.testing.assert_array_equal(values, dense_values[:,:,:values.shape[2]])
+    assert np.all(dense_values[:,:,values.shape[2]:] == 0)
+    padded_values, padded_indices = sparse.sort_atom_proj(dense = True)
+    np.testing.assert_array_equal(padded_values, dense_values)
+    np.testing.assert_array_equal(padded_indices[:,:,:values.shape[2]], indices)
+    np.testing.assert_array_equal(sparse.sort_atom_proj(dense = True, **selection)[0], 
+                                  graphene_projwfcout.sort_atom_proj(**selection)[0])
+    nonzero = values > 0
+    assert np.all(indices[~nonzero] == -1)
+    assert np.all(np.take_along_axis(proj, np.where(nonzero, indices, 0), axis = 2)[nonzero] == values[nonzero])
+    
+    for threshold in [0.0, 0.1]:
+        for sparse_bands, dense_bands in zip(sparse.extract_atom_bands(0, [0, 2, 4], threshold), 
+                                             graphene_projwfcout.extract_atom_bands(0, [0, 2, 4], threshold)):
+            np.testing.assert_array_equal(sparse_bands, dense_bands)
+    
+def test_lazy_stages(tmp_path, graphene_projwfcout):
+    projwfcout = ProjwfcOut("tests/models/bands/projwfc.out", pdos_dir = "tests/models/bands")
+    assert projwfcout.stages == []
+    assert projwfcout.natomwfc == graphene_projwfcout.natomwfc
+    np.testing.assert_array_equal(projwfcout.l, graphene_projwfcout.l)
+    assert projwfcout.stages == ["header"]
+    assert not projwfcout.soc and not projwfcout.proj_read
+    graphene_projwfcout.read_projections()
+    np.testing.assert_array_equal(projwfcout.ek, graphene_projwfcout.ek)
+    assert projwfcout.stages == ["header", "projections"]
+    with pytest.raises(AttributeError):
+        projwfcout.undefined_attribute
+    
+    pdos_only = ProjwfcOut("tests/models/bands/projwfc.out", pdos_dir = "tests/models")
+    pdos_only.sort_orbs_by_pdos_contribution([-2, 2], "integral")
+    assert len(pdos_only.orbitals) == len(pdos_only.pdos_files)
+    assert sorted(pdos_only.stages) == ["labels", "pdos_files"]
+    
+    projwfc_out = tmp_path/"projwfc.out"
+    shutil.copy("tests/models/bands/projwfc.out", projwfc_out)
+    ProjwfcOut(str(projwfc_out), pdos_dir = str(tmp_path), cache = True).read_projections()
+    cached = ProjwfcOut(str(projwfc_out), pdos_dir = str(tmp_path), cache = True)
+    cached.read_projections()
+    assert cached.stages == ["header"]
+
+def test_failed_stage():
+    projwfcout = ProjwfcOut("tests/models/bands/projwfc.out", pdos_dir = "tests/models/not_found")
+    # a failed stage is not marked as done and raises the same error at the next access.
+    for _ in range(2):
+        with pytest.raises(FileNotFoundError):
+            projwfcout.orbitals
+        with pytest.raises(FileNotFoundError):
+            projwfcout.atom_names
+    assert projwfcout.stages == []
+    projwfcout.pdos_dir = "tests/models"
+    assert len(projwfcout.orbitals) == len(projwfcout.pdos_files)
+    assert sorted(projwfcout.stages) == ["labels", "pdos_files"]
+
+@pytest.mark.parametrize("sparse", [False, True])
+def test_top_atom_proj(graphene_projwfcout, sparse):
+    proj = graphene_projwfcout.read_projections()
+    projwfcout = ProjwfcOut("tests/models/bands/projwfc.out", pdos_dir = "tests/models/bands", sparse = sparse)
+    sorted_values = -np.sort(-proj, axis = 2)
+    for n in [1, 3, projwfcout.natomwfc + 2]:
+        values, indices = projwfcout.top_atom_proj(n, max_elements = 100)
+        assert values.shape == indices.shape == (projwfcout.nk, projwfcout.nbnd, n)
+        width = min(n, projwfcout.natomwfc)
+        np.testing.assert_array_equal(values[:,:,:width], sorted_values[:,:,:width])
+        found = indices >= 0
+        np.testing.assert_array_equal(np.take_along_axis(proj, np.where(found, indices, 0), axis = 2)[found], values[found])
+        assert np.all(values[:,:,width:] == 0) and np.all(indices[:,:,width:] == -1)
+    values, indices = projwfcout.top_atom_proj(2, kpoints = [3, 1], bands = [0, 4], atomwfcs = [6, 2, 5])
+    expected = -np.sort(-proj[np.ix_([3, 1], [0, 4], [6, 2, 5])], axis = 2)[:,:,:2]
+    np.testing.assert_array_equal(values, expected)
+    assert set(indices[indices >= 0]) <= {2, 5, 6}
+
+@pytest.mark.parametrize("sparse", [False, True])
+def test_energy_window(graphene_projwfcout, sparse):
+    proj = graphene_projwfcout.read_projections()
+    projwfcout = ProjwfcOut("tests/models/bands/projwfc.out", pdos_dir = "tests/models/bands", sparse = sparse, fermi = -2.5)
+    ik, ibnd = projwfcout.energy_index.states(-3, 1)
+    mask = (projwfcout.ek + 2.5 >= -3) & (projwfcout.ek + 2.5 <= 1)
+    np.testing.assert_array_equal(np.stack([ik, ibnd]), np.nonzero(mask))
+    np.testing.assert_array_equal(projwfcout.get_projections(energy_window = (-3, 1)), proj[mask])
+    selected = projwfcout.get_projections(kpoints = [0, 4], atomwfcs = [5, 1], energy_window = (-3, 1))
+    mask[1:4] = False
+    mask[5:] = False
+    np.testing.assert_array_equal(selected, proj[mask][:, [5, 1]])
+    np.testing.assert_array_equal(projwfcout.get_state_projections(np.array([2, 0]), np.array([1, 3]), [4, 0]),
+                                  proj[[2, 0], [1, 3]][:, [4, 0]])
+    projwfcout.fermi = 0
+    np.testing.assert_array_equal(np.stack(projwfcout.energy_index.states(-3, 1)), 
+                                  np.nonzero((projwfcout.ek >= -3) & (projwfcout.ek <= 1)))
+
+@pytest.mark.parametrize("sparse", [False, True])
+def test_orbital_index(graphene_projwfcout, sparse):
+    proj = graphene_projwfcout.read_projections()
+    projwfcout = ProjwfcOut("tests/models/bands/projwfc.out", pdos_dir = "tests/models/bands", sparse = sparse)
+    index = projwfcout.orbital_index(0.1)
+    assert projwfcout.orbital_index(0.1) is index
+    assert len(index) == np.count_nonzero(proj > 0.1)
+    for iwfc in range(projwfcout.natomwfc):
+        ik, ibnd, weight = index.lookup(iwfc)
+        np.testing.assert_array_equal(np.stack([ik, ibnd]), np.nonzero(proj[:, :, iwfc] > 0.1))
+        np.testing.assert_array_equal(weight, proj[ik, ibnd, iwfc])
+        np.testing.assert_array_equal(index.lookup(iwfc, 3)[1], np.flatnonzero(proj[3, :, iwfc] > 0.1))
+    ik, ibnd, iwfc, weight = index.select([5, 1])
+    assert set(iwfc) == {1, 5} and np.all(weight > 0.1)
+    np.testing.assert_array_equal(weight, proj[ik, ibnd, iwfc])
+
+def test_sparse_projections_cache(tmp_path, graphene_projwfcout):
+    projwfc_out = tmp_path/"projwfc.out"
+    shutil.copy("tests/models/bands/projwfc.out", projwfc_out)
+    ProjwfcOut(str(projwfc_out), pdos_dir = str(tmp_path), cache = True, sparse = True).read_projections()
+    cached = ProjwfcOut(str(projwfc_out), pdos_dir = str(tmp_path), cache = True, sparse = True)
+    assert isinstance(cached.proj, SparseProjections)
+    dense = ProjwfcOut(str(projwfc_out), pdos_dir = str(tmp_path), cache = True)
+    np.testing.assert_array_equal(dense.proj, graphene_projwfcout.read_projections())
+    
+@pytest.mark.parametrize("sparse", [False, True])
+def test_read_kpoints(tmp_path, graphene_projwfcout, sparse):
+    proj = graphene_projwfcout.read_projections()
+    projwfc_out = tmp_path/"projwfc.out"
+    shutil.copy("tests/models/bands/projwfc.out", projwfc_out)
+    projwfcout = ProjwfcOut(str(projwfc_out), pdos_dir = str(tmp_path), cache = True)
+    index = projwfcout.build_kpoint_index(chunk_size = 4096) # chunks smaller than the file.
+    np.testing.assert_array_equal(index["kpoints"], projwfcout.kpoint_index["kpoints"])
+    np.testing.assert_array_equal(index["bands"], projwfcout.kpoint_index["bands"])
+    with open(projwfc_out, "rb") as fp:
+        content = fp.read()
+    assert content[index["kpoints"][5]:].startswith(b" k = ")
+    assert content[index["bands"][5, 3]:].startswith(b"==== e(   4)")
+    
+    cached = ProjwfcOut(str(projwfc_out), pdos_dir = str(tmp_path), cache = True, sparse = sparse)
+    todense = lambda proj: proj.todense() if sparse else proj
+    start = time.time()
+    k, ek, proj_k = cached.read_kpoints([200, 3])
+    print("read time of 2 k points: {} [sec]".format(time.time() - start))
+    assert not cached.proj_read
+    np.testing.assert_array_equal(k, graphene_projwfcout.k[[200, 3]])
+    np.testing.assert_array_equal(ek, graphene_projwfcout.ek[[200, 3]])
+    assert isinstance(proj_k, SparseProjections) == sparse
+    np.testing.assert_array_equal(todense(proj_k), proj[[200, 3]])
+    
+    proj_kb = cached.read_projections(kpoints = [0, 273], bands = [10, 2])
+    assert isinstance(proj_kb, SparseProjections) == sparse
+    np.testing.assert_array_equal(todense(proj_kb), proj[[0, 273]][:, [10, 2]])
+    k, ek, proj_b = cached.read_kpoints(bands = [59])
+    np.testing.assert_array_equal(ek, graphene_projwfcout.ek[:, [59]])
+    np.testing.assert_array_equal(todense(proj_b), proj[:, [59]])
+    # the same type after all projections are read.
+    cached.read_projections()
+    assert isinstance(cached.read_projections(kpoints = [0, 273], bands = [10, 2]), SparseProjections) == sparse
+    
+@pytest.mark.parametrize("sparse", [False, True])
+def test_read_all(tmp_path, graphene_projwfcout, sparse):
+    proj = graphene_projwfcout.read_projections()
+    projwfcout = ProjwfcOut("tests/models/bands/projwfc.out", pdos_dir = "tests/models/bands", sparse = sparse)
+    projwfcout.read_all(chunk_size = 4096) # k blocks are split by chunks.
+    assert projwfcout.proj_read
+    assert projwfcout.stages == ["header"] # the header is parsed once.
+    with open("tests/models/bands/projwfc.out", "rb") as fp:
+        fp.seek(projwfcout.start_projection_offset)
+        assert fp.read(200).lstrip().startswith(b"k = ")
+    np.testing.assert_array_equal(projwfcout.k, graphene_projwfcout.k)
+    np.testing.assert_array_equal(projwfcout.ek, graphene_projwfcout.ek)
+    np.testing.assert_array_equal(projwfcout.proj.todense() if sparse else projwfcout.proj, proj)
+    assert projwfcout.lowdin_charges[1] == {"total charge": 3.9509, "s": 0.9111, "p": 3.0398, 
+                                            "pz": 0.9822, "px": 1.0300, "py": 1.0275}
+    assert projwfcout.spilling_parameter == 0.0123
+    # Lowdin charges are read from the end of the file if projections are not read by read_all.
+    regex = ProjwfcOut("tests/models/bands/projwfc.out", pdos_dir = "tests/models/bands", engine = "regex")
+    assert regex.lowdin_charges == projwfcout.lowdin_charges
+    assert regex.spilling_parameter == 0.0123
+    
+    projwfc_out = tmp_path/"projwfc.out"
+    shutil.copy("tests/models/bands/projwfc.out", projwfc_out)
+    ProjwfcOut(str(projwfc_out), pdos_dir = str(tmp_path), cache = True).read_projections()
+    cached = ProjwfcOut(str(projwfc_out), pdos_dir = str(tmp_path), cache = True)
+    assert cached.lowdin_charges == projwfcout.lowdin_charges
+    assert cached.spilling_parameter == 0.0123
+    
+def write_filproj(projwfcout, filproj):
+    """write projections of projwfcout in the format of filproj of projwfc.x."""
+    proj = projwfcout.read_projections()
+    with open(filproj, "w") as fp:
+        fp.write(" \n     45     45      1     45     45      1       2       1\n")
+        fp.write("     4   4.65000000   0.00000000   0.00000000   0.00000000   0.00000000   0.00000000\n")
+        fp.write(f"{projwfcout.natomwfc:8d}{projwfcout.nkstot:8d}{projwfcout.nbnd:8d}\n")
+        fp.write("    F    F\n")
+        for iwfc in range(projwfcout.natomwfc):
+            fp.write(f"{iwfc + 1:5d}{projwfcout.iatom[iwfc] + 1:5d}C     2S{1:5d}{projwfcout.l[iwfc]:5d}{projwfcout.m[iwfc]:5d}\n")
+            for ik in range(projwfcout.nk):
+                for ibnd in range(projwfcout.nbnd):
+                    fp.write(f"{ik + 1:8d}{ibnd + 1:8d}{proj[ik, ibnd, iwfc]:20.10f}\n")
+
+def test_read_filproj(tmp_path, graphene_projwfcout):
+    filproj = tmp_path/"graphene.bands.dat.proj"
+    write_filproj(graphene_projwfcout, filproj)
+    projwfcout = ProjwfcOut("tests/models/bands/projwfc.out", pdos_dir = "tests/models/bands", filproj = str(filproj))
+    start = time.time()
+    projwfcout.read_projections()
+    print("read time of filproj: {} [sec]".format(time.time() - start))
+    for attr in ["k", "ek", "proj"]:
+        np.testing.assert_array_equal(getattr(projwfcout, attr), getattr(graphene_projwfcout, attr))
     
+    # cached projections are those of filproj, and the cache is invalidated when filproj changes.
+    projwfc_out = tmp_path/"projwfc.out"
+    shutil.copy("tests/models/bands/projwfc.out", projwfc_out)
+    ProjwfcOut(str(projwfc_out), pdos_dir = str(tmp_path), cache = True, filproj = str(filproj)).read_projections()
+    assert ProjwfcOut(str(projwfc_out), pdos_dir = str(tmp_path), cache = True, filproj = str(filproj)).proj_read
     
-    
\ No newline at end of file
+    # filproj inconsistent with the output is not used.
+    with open(filproj) as fp:
+        content = fp.read()
+    with open(filproj, "w") as fp:
+        fp.write(content.replace("    5    2C     2S", "    5    1C     2S", 1))
+    projwfcout = ProjwfcOut("tests/models/bands/projwfc.out", pdos_dir = "tests/models/bands", filproj = str(filproj))
+    with pytest.raises(ValueError):
+        projwfcout.read_filproj()
+    np.testing.assert_array_equal(projwfcout.read_projections(), graphene_projwfcout.proj)
+    assert not ProjwfcOut(str(projwfc_out), pdos_dir = str(tmp_path), cache = True, filproj = str(filproj)).proj_read
+    ProjwfcOut(str(projwfc_out), pdos_dir = str(tmp_path), cache = True, filproj = str(filproj)).read_projections()
+    assert not ProjwfcOut(str(projwfc_out), pdos_dir = str(tmp_path), cache = True).proj_read
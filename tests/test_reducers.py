@@ -0,0 +1,38 @@
+from qe_utils.projwfc import ProjwfcOut
+from qe_utils.reducers import WindowSum, MaxWeight, Histogram, TopN
+import numpy as np
+import pytest
+
+@pytest.fixture(scope="module")
+def projwfcout():
+    return ProjwfcOut("tests/models/bands/projwfc.out", pdos_dir = "tests/models/bands", fermi = -2.3042)
+
+def test_iter_projections(projwfcout):
+    streamed = ProjwfcOut("tests/models/bands/projwfc.out", pdos_dir = "tests/models/bands")
+    proj = projwfcout.read_projections()
+    num_k = 0
+    for ik, k, ek, proj_k in streamed.iter_projections():
+        np.testing.assert_array_equal(k, projwfcout.k[ik])
+        np.testing.assert_array_equal(ek, projwfcout.ek[ik])
+        np.testing.assert_array_equal(proj_k, proj[ik])
+        num_k += 1
+    assert num_k == projwfcout.nk
+    assert not streamed.proj_read
+
+def test_reducers(projwfcout):
+    streamed = ProjwfcOut("tests/models/bands/projwfc.out", pdos_dir = "tests/models/bands", fermi = -2.3042)
+    window_sum, max_orbital, max_atom, (hist, bins), (top, top_values) = streamed.reduce(
+        WindowSum(-5, 2), MaxWeight(), MaxWeight(by = "atom"), Histogram(20, (-25, 5)), TopN(3, -5, 2))
+    
+    proj = projwfcout.read_projections()
+    energy = projwfcout.ek - projwfcout.fermi
+    in_window = (-5 <= energy) & (energy <= 2)
+    np.testing.assert_allclose(window_sum, proj[in_window].sum(axis = 0))
+    np.testing.assert_allclose(max_orbital, proj.max(axis = (0, 1)))
+    atom_weight = np.stack([proj[:,:,projwfcout.iatom == iatom].sum(axis = 2) for iatom in range(2)], axis = -1)
+    np.testing.assert_allclose(max_atom, atom_weight.max(axis = (0, 1)))
+    for iwfc in range(projwfcout.natomwfc):
+        expected, _ = np.histogram(energy.ravel(), bins = bins, weights = proj[:,:,iwfc].ravel())
+        np.testing.assert_allclose(hist[iwfc], expected, atol = 1e-10)
+    np.testing.assert_array_equal(top, np.argsort(-window_sum, kind = "stable")[:3])
+    np.testing.assert_allclose(top_values, window_sum[top])
@@ -0,0 +1,69 @@
+from qe_utils.projwfc import ProjwfcOut
+from qe_utils.bands import Filband
+from qe_utils.pdos import PdosSet, read_pdos_file
+from qe_utils.pwx_in import PWxIn
+from tests.synthetic import write_projwfc_out, write_filband, write_pdos_dir, write_pwx_input
+from tests.benchmark import benchmark, run_benchmark, compare_results, engine_speedups, import_time
+from click.testing import CliRunner
+import json
+import numpy as np
+import pytest
+
+@pytest.mark.parametrize("engine", ["bulk", "regex"])
+@pytest.mark.parametrize("sparse", [False, True])
+def test_synthetic_projwfc_out(tmp_path, engine, sparse):
+    truth = write_projwfc_out(tmp_path/"projwfc.out", nk = 7, nbnd = 9, natom = 3, natomwfc = 17, terms = 12)
+    projwfcout = ProjwfcOut(str(tmp_path/"projwfc.out"), engine = engine, sparse = sparse)
+    assert (projwfcout.nkstot, projwfcout.nbnd, projwfcout.natomwfc) == (7, 9, 17)
+    proj = projwfcout.read_projections()
+    assert np.array_equal(proj.todense() if sparse else proj, truth["proj"])
+    assert np.array_equal(projwfcout.ek, truth["ek"])
+    assert np.array_equal(projwfcout.k, truth["k"])
+    assert np.array_equal(projwfcout.l, truth["l"])
+    assert np.array_equal(projwfcout.wfc, truth["wfc"])
+
+def test_synthetic_files(tmp_path):
+    truth = write_filband(tmp_path/"bands.dat", nk = 5, nbnd = 23)
+    filband = Filband(str(tmp_path/"bands.dat"))
+    assert np.array_equal(filband.bands_en, truth["bands_en"])
+    assert np.array_equal(filband.k_list, truth["k"])
+    assert np.array_equal(filband.get_filbandgnu().ek, truth["gnu"])
+
+    files = write_pdos_dir(tmp_path/"pdos", natom = 3, ne = 300)
+    pdos_set = PdosSet.from_dir(tmp_path/"pdos")
+    assert sorted(pdos_set.files) == sorted(files)
+    for file in files:
+        assert np.array_equal(read_pdos_file(tmp_path/"pdos"/file), np.loadtxt(tmp_path/"pdos"/file))
+
+    truth = write_pwx_input(tmp_path/"scf.in", natom = 5)
+    pwxin = PWxIn.from_pwx_input(str(tmp_path/"scf.in"))
+    assert [name for name, _ in pwxin.atom_positions] == truth["elements"]
+    np.testing.assert_allclose([position for _, position in pwxin.atom_positions], truth["positions"])
+
+def test_benchmark(tmp_path):
+    results = run_benchmark(["tiny"], repeat = 1)
+    readers = [result["reader"] for result in results["results"]]
+    assert "ProjwfcOut.bulk" in readers and "Filbandgnu" in readers and "PdosSet.from_dir" in readers
+    assert all(result["time"] > 0 and result["peak_memory"] > 0 for result in results["results"])
+    assert engine_speedups(results)["tiny"] > 0
+    assert import_time("qe_utils.pwx_in", repeat = 1) > 0
+    comparison = compare_results(results, results)
+    assert len(comparison) == len(readers)
+    assert not any(item["regression"] for item in comparison)
+
+    runner = CliRunner()
+    output = tmp_path/"benchmark.json"
+    result = runner.invoke(benchmark, ["--sizes", "tiny", "--repeat", "1", "--readers", "Filband,NameList",
+                                       "-o", str(output)])
+    assert result.exit_code == 0, result.output
+    saved = json.loads(output.read_text())
+    assert [result["reader"] for result in saved["results"]] == ["Filband", "NameList"]
+    assert saved["metadata"]["numpy"] == np.__version__
+    # regressions against results 1000 times faster.
+    for result in saved["results"]:
+        result["time"] /= 1000
+    output.write_text(json.dumps(saved))
+    result = runner.invoke(benchmark, ["--sizes", "tiny", "--repeat", "1", "--readers", "Filband,NameList",
+                                       "--compare", str(output)])
+    assert result.exit_code == 1
+    assert "REGRESSION" in result.output
@@ -0,0 +1,64 @@
+from qe_utils.projwfc import ProjwfcOut
+from qe_utils.pwx_in import PWxIn
+from qe_utils.wannier import ProjectionSearch
+import itertools
+import numpy as np
+import pytest
+
+@pytest.fixture(scope="module")
+def projwfcout():
+    return ProjwfcOut("tests/models/bands/projwfc.out", pdos_dir = "tests/models/bands", fermi = -2.3042,
+                      pwxin = PWxIn.from_pwx_input("tests/models/scf.in"))
+
+def test_projection_search(projwfcout):
+    search = ProjectionSearch(projwfcout, -25, 2)
+    assert search.shells == [(0, "C", 0, 1), (0, "C", 1, 1), (1, "C", 0, 1), (1, "C", 1, 1)]
+    proj = projwfcout.read_projections()
+    energy = projwfcout.ek - projwfcout.fermi
+    in_window = (-25 <= energy) & (energy <= 2)
+    np.testing.assert_allclose(search.partial_sums[1], (proj[:,:,1:4]*in_window[:,:,None]).sum(axis = (1, 2))/in_window.sum(axis = 1))
+    
+    best_scores = {}
+    for num_wann in [2, 4, 5]:
+        # exhaustive search
+        expected = {}
+        for size in range(1, len(search.shells) + 1):
+            for members in itertools.combinations(range(len(search.shells)), size):
+                if search.shell_sizes[list(members)].sum() == num_wann:
+                    expected[members] = search.scores(search.partial_sums[list(members)].sum(axis = 0))
+        candidates = projwfcout.search_wannier_projections(num_wann, -25, 2, beam_width = 100, num_results = 100)
+        assert len(candidates) == len(expected)
+        assert candidates[0].score == pytest.approx(max(expected.values()))
+        best_scores[num_wann] = max(expected.values())
+        assert all(candidate.num_wann == num_wann for candidate in candidates)
+        assert [c.score for c in candidates] == sorted([c.score for c in candidates], reverse = True)
+    greedy = projwfcout.search_wannier_projections(4, -25, 2, beam_width = 1)
+    assert greedy[0].num_wann == 4
+    assert greedy[0].score <= best_scores[4] + 1e-12
+    assert projwfcout.search_wannier_projections(100, -25, 2) == []
+
+def test_projections_block(projwfcout):
+    search = ProjectionSearch(projwfcout, -25, 2)
+    candidates = search.search(2, beam_width = 100, num_results = 100)
+    both_s = [c for c in candidates if [shell[2] for shell in c.shells] == [0, 0]][0]
+    assert both_s.projections_block(projwfcout.pwxin) == "begin projections\nC:l=0\nend projections"
+    candidates = search.search(4, beam_width = 100, num_results = 100)
+    one_atom = [c for c in candidates if [shell[0] for shell in c.shells] == [0, 0]][0]
+    assert one_atom.projections_block(projwfcout.pwxin).splitlines() == [
+        "begin projections", "c=0.000000,1.420282,0.000000:l=0", "c=0.000000,1.420282,0.000000:l=1", "end projections"]
+    with pytest.raises(ValueError):
+        one_atom.projections_block(atom_names = ["C", "C"])
+
+def test_projections_block_alat(projwfcout):
+    pwxin = PWxIn.from_pwx_input("tests/models/scf.in")
+    pwxin.card_dict["ATOMIC_POSITIONS"]["options"] = "alat"
+    pwxin.card_dict["ATOMIC_POSITIONS"]["body"] = [["C", "0.0", "0.5", "0.0"], ["C", "0.5", "0.0", "0.0"]]
+    search = ProjectionSearch(projwfcout, -25, 2)
+    one_atom = [c for c in search.search(4, beam_width = 100, num_results = 100) if [shell[0] for shell in c.shells] == [0, 0]][0]
+    with pytest.raises(ValueError):
+        one_atom.projections_block(pwxin)
+    pwxin.namelist_dict["&SYSTEM"]["celldm(1)"] = "4.0d+00"
+    assert one_atom.projections_block(pwxin).splitlines()[1] == "c=0.000000,1.058354,0.000000:l=0"
+    del pwxin.namelist_dict["&SYSTEM"]["celldm(1)"]
+    pwxin.namelist_dict["&SYSTEM"]["A"] = "2.46"
+    assert one_atom.projections_block(pwxin).splitlines()[1] == "c=0.000000,1.230000,0.000000:l=0"